@@ -0,0 +1,38 @@
+"""add standingscache table
+
+Revision ID: 5e2d8c41a9b7
+Revises: f3c9b1a7d2e4
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2d8c41a9b7'
+down_revision = 'f3c9b1a7d2e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('standingscache',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('club_id', sa.Integer(), nullable=True),
+    sa.Column('seriesid', sa.Integer(), nullable=True),
+    sa.Column('year', sa.Integer(), nullable=True),
+    sa.Column('gender', sa.String(length=1), nullable=True),
+    sa.Column('division', sa.String(length=20), nullable=True),
+    sa.Column('position', sa.Integer(), nullable=True),
+    sa.Column('rows', sa.Text(length=4294967295), nullable=True),
+    sa.Column('cached_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['club_id'], ['club.id'], ),
+    sa.ForeignKeyConstraint(['seriesid'], ['series.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('club_id', 'seriesid', 'year', 'gender', 'division')
+    )
+
+
+def downgrade():
+    op.drop_table('standingscache')
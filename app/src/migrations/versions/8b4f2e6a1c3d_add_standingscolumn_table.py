@@ -0,0 +1,37 @@
+"""add standingscolumn table
+
+Revision ID: 8b4f2e6a1c3d
+Revises: 5e2d8c41a9b7
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4f2e6a1c3d'
+down_revision = '5e2d8c41a9b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('standingscolumn',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('club_id', sa.Integer(), nullable=True),
+    sa.Column('seriesid', sa.Integer(), nullable=True),
+    sa.Column('raceid', sa.Integer(), nullable=True),
+    sa.Column('year', sa.Integer(), nullable=True),
+    sa.Column('gender', sa.String(length=1), nullable=True),
+    sa.Column('standings', sa.Text(length=4294967295), nullable=True),
+    sa.ForeignKeyConstraint(['club_id'], ['club.id'], ),
+    sa.ForeignKeyConstraint(['raceid'], ['race.id'], ),
+    sa.ForeignKeyConstraint(['seriesid'], ['series.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('club_id', 'seriesid', 'raceid', 'gender')
+    )
+
+
+def downgrade():
+    op.drop_table('standingscolumn')
@@ -0,0 +1,35 @@
+"""add seriesresultscache table
+
+Revision ID: c7d3e9f2a4b6
+Revises: 8b4f2e6a1c3d
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d3e9f2a4b6'
+down_revision = '8b4f2e6a1c3d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('seriesresultscache',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('club_id', sa.Integer(), nullable=True),
+    sa.Column('raceid', sa.Integer(), nullable=True),
+    sa.Column('year', sa.Integer(), nullable=True),
+    sa.Column('rows', sa.Text(length=4294967295), nullable=True),
+    sa.Column('cached_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['club_id'], ['club.id'], ),
+    sa.ForeignKeyConstraint(['raceid'], ['race.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('club_id', 'raceid')
+    )
+
+
+def downgrade():
+    op.drop_table('seriesresultscache')
@@ -0,0 +1,48 @@
+"""add standingsarchive and seriesresultsarchive tables
+
+Revision ID: d1e8f4a6b2c9
+Revises: c7d3e9f2a4b6
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd1e8f4a6b2c9'
+down_revision = 'c7d3e9f2a4b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('standingsarchive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('club_id', sa.Integer(), nullable=True),
+    sa.Column('seriesid', sa.Integer(), nullable=True),
+    sa.Column('year', sa.Integer(), nullable=True),
+    sa.Column('snapshot', sa.LargeBinary(length=4294967295), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['club_id'], ['club.id'], ),
+    sa.ForeignKeyConstraint(['seriesid'], ['series.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('club_id', 'seriesid')
+    )
+    op.create_table('seriesresultsarchive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('club_id', sa.Integer(), nullable=True),
+    sa.Column('raceid', sa.Integer(), nullable=True),
+    sa.Column('year', sa.Integer(), nullable=True),
+    sa.Column('snapshot', sa.LargeBinary(length=4294967295), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['club_id'], ['club.id'], ),
+    sa.ForeignKeyConstraint(['raceid'], ['race.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('club_id', 'raceid')
+    )
+
+
+def downgrade():
+    op.drop_table('seriesresultsarchive')
+    op.drop_table('standingsarchive')
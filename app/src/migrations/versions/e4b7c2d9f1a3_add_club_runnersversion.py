@@ -0,0 +1,24 @@
+"""add club runnersversion column
+
+Revision ID: e4b7c2d9f1a3
+Revises: d1e8f4a6b2c9
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7c2d9f1a3'
+down_revision = 'd1e8f4a6b2c9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('club', sa.Column('runnersversion', sa.Integer(), server_default='0', nullable=True))
+
+
+def downgrade():
+    op.drop_column('club', 'runnersversion')
@@ -8,6 +8,7 @@ import os.path
 
 # pypi
 from celery import Celery
+from celery.schedules import crontab
 from celery.signals import worker_process_init
 from loutilities.configparser import getitems
 
@@ -41,6 +42,13 @@ with open(f'/run/secrets/rabbitmq-app-password') as pw:
 celeryconfig['broker_url'] =  f'amqp://{username}:{password}@{brokerhost}/{brokerserver}'
 # print(f'broker_url = {celeryconfig['broker_url']}')
 
+# standings and series results are prewarmed nightly, see tasks.prewarmtask(), this requires celery beat to be running
+celeryapp.conf.beat_schedule = {
+    'prewarm-standings': {
+        'task': 'rrwebapp.tasks.prewarmtask',
+        'schedule': crontab(hour=3, minute=0),
+    },
+}
 celeryapp.conf.update(celeryconfig)
 
 
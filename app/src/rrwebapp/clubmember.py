@@ -7,10 +7,12 @@ clubmember - manage club member information
 import pdb
 import datetime
 import difflib
+import heapq
 from collections import OrderedDict
 from csv import DictReader
 
 # pypi
+import numpy
 from flask import current_app
 from loutilities.timeu import age
 
@@ -18,7 +20,7 @@ from loutilities.timeu import age
 
 # home grown
 from . import version
-from .model import Runner
+from .model import Runner, Club
 from loutilities import timeu, csvwt
 from loutilities.transform import Transform
 from .model import db
@@ -92,6 +94,89 @@ def getratio(a,b):
     sm.set_seqs(a,b)
     return sm.ratio()
 
+########################################################################
+class NameIndex():
+########################################################################
+    '''
+    index of names for finding close matches, giving the same results as
+    difflib.get_close_matches(word, names, n, cutoff)
+
+    get_close_matches() only computes SequenceMatcher.ratio() for names whose quick_ratio() is at least
+    cutoff. quick_ratio() is 2*M/(len(word)+len(name)), where M is the number of characters the two
+    strings have in common, counting repeated characters. The index keeps the character counts of each
+    name, so M for all names is computed at once, and ratio() is only computed for the few names which
+    pass the same test
+
+    :param names: list of names, matching is case sensitive
+    '''
+    #----------------------------------------------------------------------
+    def __init__(self, names):
+    #----------------------------------------------------------------------
+        self.names = list(names)
+        self.chars = {c:i for i, c in enumerate(sorted({c for name in self.names for c in name}))}
+        self.lengths = numpy.array([len(name) for name in self.names], dtype=numpy.int32)
+        self.counts = numpy.zeros((len(self.names), len(self.chars)), dtype=numpy.int32)
+        for row, name in enumerate(self.names):
+            for c in name:
+                self.counts[row, self.chars[c]] += 1
+
+    #----------------------------------------------------------------------
+    def candidates(self, word, cutoff):
+    #----------------------------------------------------------------------
+        '''
+        names which may be within cutoff of word, i.e., whose quick_ratio() is at least cutoff
+
+        :param word: word to match
+        :param cutoff: float in [0,1]
+        :rtype: [(quickratio, name), ...] highest quickratio first
+        '''
+        if not self.names: return []
+
+        wordcounts = numpy.zeros(len(self.chars), dtype=numpy.int32)
+        for c in word:
+            if c in self.chars:
+                wordcounts[self.chars[c]] += 1
+
+        # same arithmetic as difflib's quick_ratio(), so the comparison with cutoff is the same
+        common = numpy.minimum(self.counts, wordcounts).sum(axis=1)
+        quickratios = 2.0 * common / (self.lengths + len(word))
+        found = numpy.flatnonzero(quickratios >= cutoff)
+        found = found[numpy.argsort(-quickratios[found], kind='stable')]
+        return [(float(quickratios[i]), self.names[i]) for i in found]
+
+    #----------------------------------------------------------------------
+    def get_close_matches(self, word, n=3, cutoff=0.6):
+    #----------------------------------------------------------------------
+        '''
+        return the same list as difflib.get_close_matches(word, names, n, cutoff), with scores
+
+        :param word: word to match
+        :param n: maximum number of matches to return
+        :param cutoff: float in [0,1]
+        :rtype: [(ratio, name), ...] best match first
+        '''
+        if not n > 0:
+            raise ValueError('n must be > 0: {}'.format(n))
+
+        s = difflib.SequenceMatcher()
+        s.set_seq2(word)
+        result = []
+        # n best ratios so far, lowest first
+        best = []
+        for quickratio, name in self.candidates(word, cutoff):
+            # ratio() is never more than quick_ratio(), so the remaining names can't displace n better matches
+            if len(best) >= n and quickratio < best[0]:
+                break
+            s.set_seq1(name)
+            if s.real_quick_ratio() >= cutoff and s.quick_ratio() >= cutoff and s.ratio() >= cutoff:
+                ratio = s.ratio()
+                result.append((ratio, name))
+                if len(best) < n:
+                    heapq.heappush(best, ratio)
+                else:
+                    heapq.heappushpop(best, ratio)
+        return heapq.nlargest(n, result)
+
 ########################################################################
 class ClubMember():
 ########################################################################
@@ -189,6 +274,10 @@ class ClubMember():
         # done with the file
         if closeit:
             _IN.close()
+
+        # index member names for getmember(), and remember its matches, as members don't change
+        self.nameindex = NameIndex(self.members.keys())
+        self.closematches = {}
         
     #----------------------------------------------------------------------
     def file2ascdate(self,date):
@@ -238,19 +327,36 @@ class ClubMember():
         :rtype: {'matchingmembers':member record list, 'exactmatch':boolean, 'closematches':member name list}
         '''
         
-        closematches = difflib.get_close_matches(name.lower(),list(self.members.keys()),cutoff=self.cutoff)
-        
+        lowername = name.lower()
+        if lowername not in self.closematches:
+            closematches = [match for ratio, match in self.nameindex.get_close_matches(lowername, cutoff=self.cutoff)]
+            topratio = difflib.SequenceMatcher(a=lowername, b=closematches[0]).ratio() if closematches else 0
+            self.closematches[lowername] = (closematches, topratio)
+        closematches, topratio = self.closematches[lowername]
+
         rval = {}
         self.lastratio = 0
         if len(closematches) > 0:
-            topmatch = closematches.pop(0)
-            rval['exactmatch'] = (name.lower() == topmatch.lower()) # ignore case
+            topmatch = closematches[0]
+            rval['exactmatch'] = (lowername == topmatch) # ignore case
             rval['matchingmembers'] = self.members[topmatch][:] # make a copy
-            rval['closematches'] = closematches[:]
-            self.lastratio = difflib.SequenceMatcher(a=name.lower(), b=topmatch.lower()).ratio()
+            rval['closematches'] = closematches[1:]
+            self.lastratio = topratio
             
         return rval
         
+    #----------------------------------------------------------------------
+    def getnamedmembers(self, membername):
+    #----------------------------------------------------------------------
+        '''
+        returns list of member entries for the name of a member, as getmember(membername)['matchingmembers']
+        would, without searching for close matches
+
+        :param membername: name of member, as from getmember() 'matchingmembers' or 'closematches'
+        :rtype: member record list
+        '''
+        return self.members[membername.lower()][:]
+        
     #----------------------------------------------------------------------
     def findmember(self, name, theage, asofdate):
     #----------------------------------------------------------------------
@@ -285,8 +391,7 @@ class ClubMember():
                 checkmember = next(checkmembers)
             except StopIteration:
                 break
-            matches = self.getmember(checkmember)
-            for member in matches['matchingmembers']:
+            for member in self.getnamedmembers(checkmember):
                 # assume match for first member of correct age -- TODO: need to do better age checking [what the heck did I mean here?]
                 asofdate_dt = tYmd.asc2dt(asofdate)
                 try:
@@ -340,11 +445,11 @@ class ClubMember():
                 checkmember = next(checkmembers)
             except StopIteration:
                 break
-            matches = self.getmember(checkmember)
-            if len(matches['matchingmembers']) > 0:
+            matchingmembers = self.getnamedmembers(checkmember)
+            if len(matchingmembers) > 0:
                 # assume match for first member found
                 foundname = True
-                membername = matches['matchingmembers'][0]['name']
+                membername = matchingmembers[0]['name']
                 
         if foundname:
             return membername
@@ -423,65 +528,89 @@ class DbClubMember(ClubMember):
 ########################################################################
     '''
     ClubMember object with database input
-    
-    :params dbfilename: database file from which club members are to be retrieved -- default is to use configured database
+
+    members are loaded with a single Runner query. The loaded members are cached by filter, and reused
+    until club.runnersversion is bumped (see model.bumprunnersversion()), so kwfilter must include club_id
+    for the members to be cached
+
+    :params dbfilename: ignored, configured database is used
     :params cutoff: cutoff for getmember.  float in (0,1].  higher means strings have to match more closely to be considered "close".  Default 0.6
-    :params encoding: encoding for csv file, defaults to utf8 for backwards compatibility
+    :params encoding: ignored, kept for compatibility
     :params **kwfilter: keyword parameters for Runner database filter
     '''
-    
+
+    # {(cutoff, filter): (runnersversion, members, nameindex, closematches), ...}
+    pools = {}
+
     #----------------------------------------------------------------------
     def __init__(self, dbfilename=None, cutoff=0.6, encoding='utf8', **kwfilter):
     #----------------------------------------------------------------------
-        # create database session
-        s = db.session
-        
-        # TODO: don't really need this since adding exceldates as parameter to ClubMember, but for now keeping for safety
-        def _dob2excel(s,f):
-            try:
-                xl = tYmd.asc2excel(f)
-            except ValueError:
-                xl = None
-            return xl
-        
-        def _city(s,f):
-            if f:
-                return ','.join(f.split(',')[0:-1])
-            else:
-                return None
-        
-        def _state(s,f):
-            if f:
-                return lambda s,f: f.split(',')[-1]
-            else:
-                return None
-        
-        # map database table column names to output column names, and optionally function for transformation
-        # function x is x(s,f), where s is session, f is field value
-        # note it is ok to split name like this, because it will just get joined together when the csv is processed in clubmember
-        # match database encoding - utf8
-        d = csvwt.Db2Csv(encoding=encoding)
-        hdrmap = {'id' : 'id',
-                  'dateofbirth' : {'DOB':_dob2excel},
-                  'estdateofbirth' : 'estdateofbirth',
-                  'member' : 'member',
-                  'gender' : 'Gender',
-                  'name' : {'First':lambda s,f: ' '.join(f.split(' ')[0:-1]),'Last':lambda s,f: f.split(' ')[-1]},
-                  'hometown' : {'City':_city, 'State':_state}
-                    }
-        d.addtable('Sheet1', s, Runner, hdrmap, **kwfilter)
-        
-        # retrieve first sheet's csv filename
-        csvfiles = d.getfiles()
-        csvsheets = list(csvfiles.keys())
-        csvfile = csvfiles[csvsheets[0]]
-        
-        # do all the work
-        ClubMember.__init__(self,csvfile,cutoff=cutoff,exceldates=True)
-        
-        ## csv files not needed any more
-        #del d
-    
+        self.exceldates = True
+        self.cutoff = cutoff
+
+        club_id = kwfilter.get('club_id')
+        key = (cutoff, tuple(sorted(kwfilter.items())))
+
+        # changes not yet committed by this session aren't cached, as they may be rolled back
+        # version query comes first, as pending changes are flushed by it
+        version = db.session.query(Club.runnersversion).filter_by(id=club_id).scalar() if club_id is not None else None
+        cacheable = club_id is not None and club_id not in db.session.info.get('runnersflushed', set())
+        if cacheable:
+            pool = self.pools.get(key)
+            if pool and pool[0] == version:
+                version, self.members, self.nameindex, self.closematches = pool
+                return
+
+        self.members = {}
+        runners = Runner.query.filter_by(**kwfilter).order_by(Runner.id).all()
+        for runner in runners:
+            thismember = self.runner2member(runner)
+            if not thismember['name']: continue
+            self.members.setdefault(thismember['name'].lower(), []).append(thismember)
+
+        self.nameindex = NameIndex(self.members.keys())
+        self.closematches = {}
+
+        if cacheable:
+            self.pools[key] = (version, self.members, self.nameindex, self.closematches)
+
+    #----------------------------------------------------------------------
+    def runner2member(self, runner):
+    #----------------------------------------------------------------------
+        '''
+        returns member entry for a runner, as ClubMember builds it from a file row
+
+        :param runner: Runner instance
+        :rtype: {'name':name,'dob':dateofbirth,'gender':'M'|'F'|'X','hometown':City, ST, ...}
+        '''
+        # name is split as last word and the words before it, which are joined again for name
+        first = ' '.join(runner.name.split(' ')[0:-1]).strip() if runner.name else ''
+        last = runner.name.split(' ')[-1].strip() if runner.name else ''
+
+        try:
+            dob = tYmd.dt2asc(tYmd.asc2dt(runner.dateofbirth))
+        except (ValueError, TypeError):   # handle invalid dates
+            dob = ''
+
+        hometown = runner.hometown.split(',') if runner.hometown else ['']
+        city = ','.join(hometown[0:-1])
+        state = hometown[-1]
+
+        return {
+            'id': str(runner.id),
+            'name': ' '.join([first,last]).strip(),
+            'fname': first,
+            'lname': last,
+            'mname': '',
+            'dob': dob,
+            'gender': (runner.gender or '').upper().strip(),
+            'hometown': ', '.join([city.strip(),state.strip()]),
+            'renewdate': None,
+            'expdate': None,
+            'member': '' if runner.member is None else str(runner.member),
+            'estdateofbirth': '' if runner.estdateofbirth is None else str(runner.estdateofbirth),
+        }
+
 #----------------------------------------------------------------------
 def main(): # TODO: Update this for testing
 #----------------------------------------------------------------------
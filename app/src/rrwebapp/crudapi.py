@@ -21,6 +21,7 @@ from . import app
 from .model import db
 from loutilities.tables import DbCrudApi
 from .accesscontrol import UpdateClubDataPermission, ViewClubDataPermission
+from .standingscache import invalidatestandings
 
 class parameterError(Exception): pass
 
@@ -235,6 +236,34 @@ class CrudApi(DbCrudApi):
         return super(CrudApi, self)._retrieverows()
 
 
+class StandingsCrudApi(CrudApi):
+    '''
+    CrudApi for tables which affect series standings, invalidating the cached standings for the
+    club (and year, if byyear) whenever a row is created, updated or deleted
+
+    see CrudApi for parameters
+    '''
+
+    def invalidate(self):
+        year = flask.session['year'] if self.byyear else None
+        invalidatestandings(flask.session['club_id'], year=year)
+
+    def createrow(self, formdata):
+        row = super().createrow(formdata)
+        self.invalidate()
+        return row
+
+    def updaterow(self, thisid, formdata):
+        row = super().updaterow(thisid, formdata)
+        self.invalidate()
+        return row
+
+    def deleterow(self, thisid):
+        row = super().deleterow(thisid)
+        self.invalidate()
+        return row
+
+
 def deepupdate(obj, val, newval):
     '''
     recursively searches obj object and replaces any val values with newval
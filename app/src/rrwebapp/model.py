@@ -8,8 +8,9 @@ model  -- manage race database
 
 # pypi
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import func, types, cast
+from sqlalchemy import func, types, cast, event
 from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import Session as OrmSession
 from flask import session
 from flask_sqlalchemy import SQLAlchemy
 from flask_security import UserMixin, RoleMixin
@@ -315,6 +316,7 @@ class Club(Base):
     location = Column(String(MAX_LOCATION_LEN))
     agegradetable_id = Column(Integer, ForeignKey('agegrade_table.id'))
     agegradetable = relationship('AgeGradeTable', back_populates='clubs')
+    runnersversion = Column(Integer, default=0, server_default='0')  # bumped when club's runners change, see bumprunnersversion()
 
     roles = relationship('Role',backref='club',cascade="all, delete")
     runners = relationship('Runner',backref='club',cascade="all, delete")
@@ -427,6 +429,51 @@ class RunnerAlias(Base):
         return '<RunnerAlias %s %s>' % (self.name, self.runnerid)
 
 
+@event.listens_for(OrmSession, 'after_flush')
+def collectrunnersflushed(session, flush_context):
+    '''
+    remember clubs whose runners were added, updated or deleted by the flush, for bumprunnersversion()
+
+    the clubs are remembered in session.info['runnersflushed'] until the transaction ends, because
+    the bumped version isn't visible to other sessions before commit
+    '''
+    club_ids = {obj.club_id for obj in list(session.new) + list(session.deleted) if isinstance(obj, Runner)}
+    club_ids |= {obj.club_id for obj in session.dirty
+                 if isinstance(obj, Runner) and session.is_modified(obj, include_collections=False)}
+    if not club_ids: return
+
+    session.info.setdefault('runnersflushed', set()).update(club_ids)
+    session.info.setdefault('runnersbump', set()).update(club_ids)
+
+@event.listens_for(OrmSession, 'before_commit')
+def bumprunnersversion(session):
+    '''
+    bump club.runnersversion once per commit for clubs remembered by collectrunnersflushed(), so
+    member pools cached by clubmember.DbClubMember are loaded again
+
+    this is done at commit rather than at each flush because the update locks the club row until the
+    transaction ends, which would serialize long transactions which flush runners for the same club
+    '''
+    # before_commit is called before commit's final flush
+    session.flush()
+    club_ids = session.info.pop('runnersbump', None)
+    if not club_ids: return
+
+    clubtable = Club.__table__
+    session.connection().execute(clubtable.update()
+                                 .where(clubtable.c.id.in_(club_ids))
+                                 .values(runnersversion=func.coalesce(clubtable.c.runnersversion, 0) + 1))
+
+@event.listens_for(OrmSession, 'after_commit')
+@event.listens_for(OrmSession, 'after_rollback')
+def clearrunnersflushed(session):
+    '''
+    forget clubs remembered by collectrunnersflushed() when the transaction ends
+    '''
+    session.info.pop('runnersflushed', None)
+    session.info.pop('runnersbump', None)
+
+
 CLUBAFFILIATION_ALTERNATES_SEPARATOR = '||'
 class ClubAffiliation(Base):
     __tablename__ = 'clubaffiliation'
@@ -835,6 +882,91 @@ class Divisions(Base):
 
 
 
+class StandingsCache(Base):
+    '''
+    Rendered standings rows for a series, one row per gender and division
+
+    maintained by standingscache.getstandings(), and deleted by standingscache.invalidatestandings()
+    whenever data which affects standings is changed
+    '''
+    __tablename__ = 'standingscache'
+    __table_args__ = (UniqueConstraint('club_id', 'seriesid', 'year', 'gender', 'division'),)
+    id = Column(Integer, primary_key=True)
+    club_id = Column(Integer, ForeignKey('club.id'))
+    seriesid = Column(Integer, ForeignKey('series.id'))
+    year = Column(Integer)
+    gender = Column(String(1))
+    division = Column(String(20))   # 'Overall', '40 to 44', etc.
+    position = Column(Integer)      # order of division within gender
+    rows = Column(Text(2**32-1))    # json list of rendered rows, LONGTEXT for mysql
+    cached_at = Column(DateTime)
+
+
+class StandingsColumn(Base):
+    '''
+    Standings collected for one race in a series, by gender -- see renderstandings.StandingsRenderer.collectrace()
+
+    kept across retabulation of other races in the series, so only the retabulated race needs to be
+    collected again
+    '''
+    __tablename__ = 'standingscolumn'
+    __table_args__ = (UniqueConstraint('club_id', 'seriesid', 'raceid', 'gender'),)
+    id = Column(Integer, primary_key=True)
+    club_id = Column(Integer, ForeignKey('club.id'))
+    seriesid = Column(Integer, ForeignKey('series.id'))
+    raceid = Column(Integer, ForeignKey('race.id'))
+    year = Column(Integer)
+    gender = Column(String(1))
+    standings = Column(Text(2**32-1))   # json list of RaceStanding.asdict(), LONGTEXT for mysql
+
+
+
+class SeriesResultsCache(Base):
+    '''
+    Rendered series results rows for a race, as displayed by the seriesresults view
+
+    maintained by standingscache.getseriesresults(), and deleted along with the race's standings by
+    standingscache.invalidaterace() and standingscache.invalidatestandings()
+    '''
+    __tablename__ = 'seriesresultscache'
+    __table_args__ = (UniqueConstraint('club_id', 'raceid'),)
+    id = Column(Integer, primary_key=True)
+    club_id = Column(Integer, ForeignKey('club.id'))
+    raceid = Column(Integer, ForeignKey('race.id'))
+    year = Column(Integer)
+    rows = Column(Text(2**32-1))    # json list of rendered rows, LONGTEXT for mysql
+    cached_at = Column(DateTime)
+
+
+class StandingsArchive(Base):
+    '''
+    Snapshot of a finalized season's standings for a series, see seasonarchive.finalizeseason()
+
+    never changed once stored, views serve the snapshot instead of rendering the standings
+    '''
+    __tablename__ = 'standingsarchive'
+    __table_args__ = (UniqueConstraint('club_id', 'seriesid'),)
+    id = Column(Integer, primary_key=True)
+    club_id = Column(Integer, ForeignKey('club.id'))
+    seriesid = Column(Integer, ForeignKey('series.id'))
+    year = Column(Integer)
+    snapshot = Column(LargeBinary(2**32-1))     # zlib compressed json, LONGBLOB for mysql
+    archived_at = Column(DateTime)
+
+
+class SeriesResultsArchive(Base):
+    '''
+    Snapshot of a finalized season's series results for a race, see seasonarchive.finalizeseason()
+    '''
+    __tablename__ = 'seriesresultsarchive'
+    __table_args__ = (UniqueConstraint('club_id', 'raceid'),)
+    id = Column(Integer, primary_key=True)
+    club_id = Column(Integer, ForeignKey('club.id'))
+    raceid = Column(Integer, ForeignKey('race.id'))
+    year = Column(Integer)
+    snapshot = Column(LargeBinary(2**32-1))     # zlib compressed json, LONGBLOB for mysql
+    archived_at = Column(DateTime)
+
 class Exclusion(Base):
     '''
     Close names found matching a member, which are not the member runner
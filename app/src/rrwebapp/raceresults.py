@@ -86,7 +86,8 @@ class RaceResults():
         # self.field item value will be of form {'begin':startindex,'end':startindex+length} for easy slicing
         self.field = {}
 
-        # scan to the header line
+        # scan to the header line, counting the lines read for count()
+        self.hdrlines = 0
         self._findhdr()
 
     #----------------------------------------------------------------------
@@ -109,6 +110,7 @@ class RaceResults():
             # loop for each line until header found
             while True:
                 origline = next(self.file)
+                self.hdrlines += 1
                 fieldsfound = 0
                 self.field = {} # need to clear in case earlier line had some garbage
                 line = []
@@ -301,6 +303,11 @@ class RaceResults():
         
         return normalizeracetime(thistime, distance)
     
+    #----------------------------------------------------------------------
+    def __iter__(self):
+    #----------------------------------------------------------------------
+        return self
+
     #----------------------------------------------------------------------
     def __next__(self):
     #----------------------------------------------------------------------
@@ -385,6 +392,30 @@ class RaceResults():
         # and return result
         return result
     
+    #----------------------------------------------------------------------
+    def count(self):
+    #----------------------------------------------------------------------
+        '''
+        return the number of rows after the header, without reading them
+
+        rows which are skipped by next(), e.g., those without a time, are counted, as are any line breaks
+        within quoted csv fields, so this is the most results which can be returned
+        '''
+        # excel rows are already loaded
+        if hasattr(self.file, 'nrows'):
+            return self.file.nrows - self.file.currrow
+
+        numlines = 0
+        lastchunk = b''
+        with open(self.filename, 'rb') as rawfile:
+            for chunk in iter(lambda: rawfile.read(2**16), b''):
+                numlines += chunk.count(b'\n')
+                lastchunk = chunk
+        # last line may not end with newline
+        if lastchunk and not lastchunk.endswith(b'\n'):
+            numlines += 1
+        return max(numlines - self.hdrlines, 0)
+
     #----------------------------------------------------------------------
     def close(self):
     #----------------------------------------------------------------------
@@ -24,9 +24,14 @@ from functools import cmp_to_key
 
 # pypi
 import xlwt
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle, Font, Alignment
+from openpyxl.utils import get_column_letter
 import flask
 from flask import current_app
-from dominate.tags import div, a
+from sqlalchemy.orm import joinedload, selectinload
+from dominate.tags import div, a, span
 from dominate.util import text
 from loutilities import renderrun as render
 from loutilities import timeu
@@ -34,25 +39,82 @@ from loutilities import timeu
 from rrwebapp.resultssummarize import mean
 
 # home grown
-from .model import Divisions, Race, Series, RaceSeries, RaceResult, Runner
+from .model import db, Divisions, Race, Series, RaceSeries, RaceResult, Runner
 from .model import SERIES_OPTION_PROPORTIONAL_SCORING, SERIES_OPTION_REQUIRES_CLUB, SERIES_OPTION_DISPLAY_CLUB
 from .model import SERIES_TIE_OPTIONS, SERIES_TIE_OPTION_SEPARATOR, SERIES_TIE_OPTION_COMPARE_AVG, \
                    SERIES_TIE_OPTION_DIV_COMPARE_OVERALL, SERIES_TIE_OPTION_HEAD_TO_HEAD_POINTS
-from .resultsutils import get_earliestrace, clubaffiliationelement
+from .resultsutils import DivisionAgeLookup, clubaffiliationelement
 
 tYmd = timeu.asctime('%Y-%m-%d')
 
+# division column text for overall standings
+OVERALL = 'Overall'
+
 class parameterError(Exception): pass
 class dbConsistencyError(Exception): pass
 
 class Points(object):
     '''
     object to hold points information (see calcpoints())
+
+    explanation is only set if the runner's place was decided by a tie break (see resultsiterator)
     '''
+    __slots__ = ('totpoints', 'runnerid', 'name', 'age', 'numraces', 'tied', 'explanation')
+
     def __init__(self, **kwargs):
         for f in kwargs:
             setattr(self, f, kwargs[f])
 
+class RaceStanding(object):
+    '''
+    one runner's collected standing for a race (see StandingsRenderer.collectrace())
+
+    standings age is not held here, as it depends on all the runner's results for the year
+
+    :param race: Race for this standing
+    :param runnerid: runner.id
+    :param name: runner's name
+    :param agage: age recorded with the result, used if standings age isn't available
+    :param divisionlow: low age of runner's division for this race
+    :param divisionhigh: high age of runner's division for this race
+    :param genpoints: points for gender standings
+    :param divpoints: points for division standings, None if series isn't by division
+    :param clubshortname: club affiliation display name, None if no club affiliation
+    :param clubtitle: club affiliation official name
+    '''
+    FIELDS = ['runnerid', 'name', 'agage', 'divisionlow', 'divisionhigh', 'genpoints', 'divpoints',
+              'clubshortname', 'clubtitle']
+    __slots__ = ['race'] + FIELDS
+
+    def __init__(self, race, **kwargs):
+        self.race = race
+        for f in self.FIELDS:
+            setattr(self, f, kwargs.get(f))
+
+    def clubaffiliation(self):
+        '''
+        return dom element for club affiliation, see resultsutils.clubaffiliationelement()
+        '''
+        if self.clubshortname:
+            return span(self.clubshortname, title=self.clubtitle)
+        return None
+
+    def asdict(self):
+        '''
+        return json serializable dict, which can be used for fromdict()
+        '''
+        return {f:getattr(self, f) for f in self.FIELDS}
+
+    @classmethod
+    def fromdict(cls, race, d):
+        '''
+        return RaceStanding from dict created by asdict()
+
+        :param race: Race for this standing
+        :param d: dict from asdict()
+        '''
+        return cls(race, **d)
+
 #----------------------------------------------------------------------
 def addstyle(header, contents, style, title=None):
 #----------------------------------------------------------------------
@@ -84,6 +146,23 @@ def addstyle(header, contents, style, title=None):
 
     return el.render()
     
+#----------------------------------------------------------------------
+def divisiontext(divlow,divhigh):
+#----------------------------------------------------------------------
+    '''
+    text for division, as rendered in the division column
+
+    :param divlow: low age for division
+    :param divhigh: high age for division
+    :rtype: text for division
+    '''
+    if not divlow or divlow <= 1:
+        return '{0} and under'.format(divhigh)
+    elif not divhigh or divhigh >= 99:
+        return '{0} and up'.format(divlow)
+    else:
+        return '{0} to {1}'.format(divlow,divhigh)
+
 #----------------------------------------------------------------------
 def makelink(href,text):
 #----------------------------------------------------------------------
@@ -929,6 +1008,180 @@ class HtmlStandingsHandler(BaseStandingsHandler):
         
         return iter(self.HTML[gen])
     
+class JsonStandingsHandler(BaseStandingsHandler):
+    '''
+    StandingsHandler for json standings, e.g., for club websites
+
+    rows are dicts of plain values, header rows aren't rendered but each row has the division it
+    was rendered in
+    '''
+    # award for rows set by setrowclass()
+    AWARDS = {'row-overall-award': 'overall', 'row-division-award': 'division'}
+
+    def __init__(self):
+        BaseStandingsHandler.__init__(self)
+        self.rows = {}
+        self.pline = {'F':{}, 'M':{}, 'X':{}}
+        self.header = {'F':False, 'M':False, 'X':False}
+        self.division = {'F':None, 'M':None, 'X':None}
+
+    def prepare(self,gen,series,year):
+        '''
+        prepare rows for output
+
+        :param gen: gender M, F or X
+        :param series: Series
+        :param year: year of races
+        '''
+
+        self.rows[gen] = []
+        self.header[gen] = False
+        self.division[gen] = None
+        self.clearline(gen)
+
+    def clearline(self,gen):
+        '''
+        prepare rendering line for output by clearing all entries
+
+        :param gen: gender M, F or X
+        '''
+
+        self.pline[gen] = {'gender': gen, 'division': self.division[gen], 'award': None, 'races': []}
+
+    def setheader(self,gen,header):
+        '''
+        enable / disable header processing, header rows aren't rendered
+
+        :param gen: gender M, F or X
+        :param header: True or False
+        '''
+        self.header[gen] = header
+
+    def setrowclass(self, gen, _class):
+        '''
+        set class for the row, which indicates the award the runner won
+
+        :param gen: gender M, F or X
+        :param _class: value for the row class
+        '''
+
+        self.pline[gen]['award'] = self.AWARDS.get(_class)
+
+    def setplace(self, gen, place, stylename='place', title=None):
+        '''
+        put value in 'place' field for output
+
+        :param gen: gender M, F or X
+        :param place: value for place field
+        :param stylename: name of style for field display
+        :param title: (optional) explanation of tie break
+        '''
+
+        self.pline[gen]['place'] = place
+        self.pline[gen]['tiebreak'] = title
+
+    def setdivision(self,gen,division,stylename='division'):
+        '''
+        set division for the rows which follow
+
+        :param gen: gender M, F or X
+        :param division: division text
+        :param stylename: name of style for field display
+        '''
+
+        self.division[gen] = str(division)
+
+    def setname(self,gen,name,stylename='name',runnerid=None):
+        '''
+        put value in 'name' field for output
+
+        :param gen: gender M, F or X
+        :param name: value for name field
+        :param stylename: name of style for field display
+        :param runnerid: runner's id from runner table
+        '''
+
+        self.pline[gen]['name'] = name
+        self.pline[gen]['runnerid'] = runnerid
+
+    def setage(self,gen,age,stylename='age'):
+        '''
+        put value in 'age' field for output
+
+        :param gen: gender M, F or X
+        :param age: value for age field
+        :param stylename: name of style for field display
+        '''
+
+        self.pline[gen]['age'] = age
+
+    def setclubs(self,gen,clubs,stylename='clubs'):
+        '''
+        put value in 'clubs' field for output
+
+        :param gen: gender M, F or X
+        :param clubs: heading, or list of club affiliation elements (see RaceStanding.clubaffiliation())
+        :param stylename: name of style for field display
+        '''
+
+        if not isinstance(clubs, str):
+            self.pline[gen]['clubs'] = [{'shortname': c.children[0], 'title': c.attributes.get('title')} for c in clubs]
+
+    def setnraces(self,gen,nraces,stylename='nraces'):
+        '''
+        put value in 'nraces' field for output
+
+        :param gen: gender M, F or X
+        :param nraces: value for nraces field
+        :param stylename: name of style for field display
+        '''
+
+        self.pline[gen]['nraces'] = nraces
+
+    def setrace(self,gen,racenum,result,stylename='race'):
+        '''
+        add race to 'races' field for output, races not run aren't added
+
+        :param gen: gender M, F or X
+        :param racenum: number of race
+        :param result: points for race, '' for race not run
+        :param stylename: name of style for field display
+        '''
+
+        if not self.header[gen] and result != '':
+            self.pline[gen]['races'].append({'race': racenum, 'points': result, 'dropped': stylename == 'race-dropped'})
+
+    def settotal(self,gen,total,stylename='total'):
+        '''
+        put value in 'total' field for output
+
+        :param gen: gender M, F or X
+        :param total: value for total field
+        :param stylename: name of style for field display
+        '''
+
+        self.pline[gen]['total'] = total
+
+    def render(self,gen):
+        '''
+        output current line, unless it's a header
+
+        :param gen: gender M, F or X
+        '''
+
+        if not self.header[gen]:
+            self.rows[gen].append(self.pline[gen])
+        self.clearline(gen)
+
+    def iter(self,gen):
+        '''
+        return iterable for gender
+
+        :param gen: gender M, F or X
+        '''
+
+        return iter(self.rows[gen])
+
 ########################################################################
 class XlStandingsHandler(BaseStandingsHandler):
 ########################################################################
@@ -1194,315 +1447,866 @@ class XlStandingsHandler(BaseStandingsHandler):
         self.rownum = {'F':0, 'M':0, 'X':0}
     
 ########################################################################
-class StandingsRenderer():
+class XlsxStandingsHandler(BaseStandingsHandler):
 ########################################################################
     '''
-    StandingsRenderer collects standings and provides rendering methods, for a single series
-    
-    :param club_id: club.id
-    :param year: year for standings
-    :param series: Series
-    :param races: list of Races
-    :param racenums: list of race numbers for standings 
+    StandingsHandler for .xlsx files
+
+    uses a write-only workbook, so each row is written out when it is rendered and memory use doesn't grow
+    with the number of rows. Styles are created once for the workbook and shared by all the cells.
+
+    each gender of each series is rendered to its own worksheet, so the same handler can be used for
+    all the series of a year. setraces() must be called before each series is rendered, and save() after
+    the last series is rendered
+
+    :param record: (optional) if True, the worksheets are kept in self.sheets as plain data rather than written
+        to the workbook, e.g., for a finalized season's snapshot, see writesheet()
     '''
+    # column widths, in characters
+    WIDTHS = {'place': 6, 'name': 24, 'age': 8, 'clubs': 10, 'nraces': 4, 'race': 6, 'total': 10}
+
+    # name style for rows set by setrowclass(), as described by the notes in prepare()
+    ROWSTYLE = {'row-overall-award': 'name-noteligable', 'row-division-award': 'name-won-agegroup'}
+
     #----------------------------------------------------------------------
-    def __init__(self,club_id,year,series,races,racenums):
+    def __init__(self, record=False):
     #----------------------------------------------------------------------
-        self.club_id = club_id
-        self.series = series
-        self.orderby = series.orderby
-        self.hightolow = series.hightolow
-        self.bydiv = series.divisions
-        self.avgtie = series.averagetie
-        self.multiplier = series.multiplier
-        self.maxgenpoints = series.maxgenpoints
-        self.maxdivpoints = series.maxdivpoints
-        self.maxraces = series.maxraces
-        self.maxbynumrunners = series.maxbynumrunners
-        self.proportional_scoring = series.has_series_option(SERIES_OPTION_PROPORTIONAL_SCORING)
-        self.requires_club = series.has_series_option(SERIES_OPTION_REQUIRES_CLUB)
-        self.display_club = series.has_series_option(SERIES_OPTION_DISPLAY_CLUB)
-        self.year = year
-        self.races = races
-        self.racenums = racenums
-        
+        BaseStandingsHandler.__init__(self)
+        self.wb = Workbook(write_only=True) if not record else None
+        self.ws = {}
+        # {gen: {'title': title, 'widths': {column: width, ...}, 'rows': [cells, ...]}, ...}, if record
+        self.sheets = {} if record else None
+        self.pline = {'F':{}, 'M':{}, 'X':{}}
+        self.rowstyle = {'F':None, 'M':None, 'X':None}
+        self.racelist = []
+        self.races = []
+
+        # named styles are added to the workbook once, and cells refer to them by name
+        center = Alignment(horizontal='center')
+        fonts = {
+            'majorhdr': Font(bold=True, size=12),
+            'hdr': Font(bold=True, size=10),
+            'divhdr': Font(bold=True, size=10),
+            'racehdr': Font(bold=True, size=10),
+            'racename': Font(size=10),
+            'place': Font(size=10),
+            'name': Font(size=10),
+            'name-won-agegroup': Font(size=10, color='008000'),
+            'name-noteligable': Font(size=10, color='0000FF'),
+            'age': Font(size=10),
+            'clubs': Font(size=10),
+            'nraces': Font(size=10),
+            'race': Font(size=10),
+            'race-dropped': Font(size=10, color='FF0000'),
+            'total': Font(size=10),
+            }
+        centered = ['racehdr', 'place', 'age', 'nraces', 'race', 'race-dropped', 'total']
+        for stylename in self.style:
+            self.style[stylename] = NamedStyle(name=stylename, font=fonts[stylename])
+            if stylename in centered:
+                self.style[stylename].alignment = center
+            if self.wb:
+                self.wb.add_named_style(self.style[stylename])
+
     #----------------------------------------------------------------------
-    def collectstandings(self, racesprocessed, gen, raceid, byrunner, divrunner, runnerresults): 
+    def setraces(self, races, racelist):
     #----------------------------------------------------------------------
         '''
-        collect standings for this race / series
-        
-        in byrunner[runnerid,name,age][type], points{race} entries are set to '' for race not run, to 0 for race run but no points given
-        
-        :param racesprocessed: number of races processed so far
-        :param gen: gender, M or F
-        :param raceid: race.id to collect standings for
-        :param byrunner: dict updated as runner standings are collected {runnerid,name,age:{'bygender':[points1,points2,...],'bydivision':[points1,points2,...]}}
-        :param divrunner: dict updated with runner names by division {divlow,divhigh:[runner1,runner2,...],...}
-        :param runnerresults: dict updated with set of results runner has {runnerid:{RaceResult1, ...}}
-        :rtype: number of standings processed for this race / series
-        '''
-        numresults = 0
-    
-        # get all the results currently in the database
-        # byrunner = {name:{'bygender':[points,points,...],'bydivision':[points,points,...]}, ...}
-        allresults = RaceResult.query.order_by(self.orderby).filter_by(club_id=self.club_id,raceid=raceid,seriesid=self.series.id,gender=gen).all()
-        #app.logger.debug('gather results for: clubid={}, raceid={}, seriesid={}, gen={}'.format(self.club_id,raceid,self.series.id,gen))
-        if self.hightolow: 
-            allresults.reverse()
-        
-        # determine age for all runners for which there are results
-        age = {}
-
-        # for proportional scoring, make a pass through the results to determine best times for gender, division
-        if self.proportional_scoring:
-            # 48 hours seems long enough
-            LONGTIME = 48*60*60
-            propbest = {
-                'M': {'time': LONGTIME, 'div': {}},
-                'F': {'time': LONGTIME, 'div': {}},
-                'X': {'time': LONGTIME, 'div': {}},
-            }
-            for result in allresults:
-                gen = result.gender
-                div = (result.divisionlow, result.divisionhigh)
-                propbest[gen]['div'].setdefault(div, LONGTIME)
-                if result.time < propbest[gen]['time']:
-                    propbest[gen]['time'] = result.time
-                if result.time < propbest[gen]['div'][div]:
-                    propbest[gen]['div'][div] = result.time
-
-        # accumulate results
-        for resultndx in range(len(allresults)):
-            numresults += 1
-            result = allresults[resultndx]
-            
-            # add runner name 
-            name = result.runner.name
-            runnerid = result.runnerid
-            
-            # collect runner's results
-            if runnerid not in runnerresults:
-                runnerresults[runnerid] = set()
-            runnerresults[runnerid].add(result)
-            
-            # convenience variables
-            gen = result.gender
-            div = (result.divisionlow, result.divisionhigh)
-            racedate = tYmd.asc2dt(result.race.date)
-            clubaffiliation = clubaffiliationelement(result)
-
-            # get runner's age for standings
-            if runnerid not in age:
-                # should be no need to filter on club here
-                runner = Runner.query.filter_by(id=runnerid).one()
-                # use age on Jan 1 from current year if dob available, else just use age from earliest result
-                if runner.dateofbirth:
-                    if not runner.estdateofbirth:
-                        thisage = timeu.age(datetime(int(self.year),1,1),tYmd.asc2dt(runner.dateofbirth))
-                    else:
-                        # TODO: this doesn't quite seem right -- we want to emulate Jan 1, but don't know the real dob 
-                        # -- should we be looking at earliest race in *any* year?
-                        # get_earliestrace can return None if none found, but logic to get here guarantees at least one will be found
-                        earlyresult = get_earliestrace(runner, year=racedate.year)
-                        divdate = tYmd.asc2dt(earlyresult.race.date)
-                        thisage = timeu.age(divdate, tYmd.asc2dt(runner.dateofbirth))
-                # no dob found, so just use age from earliest race in the race's year
-                else:
-                    # TODO: this doesn't quite seem right -- we want to emulate Jan 1, but don't know the real dob 
-                    # -- should we be looking at earliest race in *any* year?
-                    # get_earliestrace can return None if none found, but logic to get here guarantees at least one will be found
-                    earlyresult = get_earliestrace(runner, year=racedate.year)
-                    # but check anyway
-                    if earlyresult:
-                        divdate = tYmd.asc2dt(earlyresult.race.date)
-                        # estimate this non-member's birth date to be date of race in the year indicated by age
-                        racedatedt = tYmd.asc2dt(earlyresult.race.date)
-                        dobdt = datetime(racedatedt.year-earlyresult.age, racedatedt.month, racedatedt.day)
-                        # this assumes previously recorded age was correct, probably ok for most series
-                        thisage = timeu.age(divdate, dobdt)
-                    # strange, how is there RaceResult but no ManagedResult?
-                    else:
-                        current_app.logger.warning(f'no ManagedResult found for raceid {result.race.id} {runner.name}')
-                        thisage = result.agage
-                age[runnerid] = thisage
-            thisage = age[runnerid]
-            
-            if (runnerid, name, thisage) not in byrunner:
-                byrunner[runnerid, name, thisage] = {}
-                byrunner[runnerid, name, thisage]['bygender'] = []
-                if self.bydiv:
-                    if (runnerid, name, thisage) not in divrunner[(result.divisionlow, result.divisionhigh)]:
-                        divrunner[(result.divisionlow,result.divisionhigh)].append((runnerid, name, thisage))
-                    byrunner[runnerid, name, thisage]['bydivision'] = []
-                if self.display_club:
-                    byrunner[runnerid, name, thisage]['clubaffiliation'] = []
-            
-            # pick up club affiliation if needed and not already in the list
-            if self.display_club:
-                if clubaffiliation and clubaffiliation.render() not in [c.render() for c in byrunner[runnerid, name, thisage]['clubaffiliation']]:
-                    byrunner[runnerid, name, thisage]['clubaffiliation'].append(clubaffiliation)
-
-            # for this runner, catch 'bygender' and 'bydivision' up to current race position
-            while len(byrunner[runnerid,name,thisage]['bygender']) < racesprocessed:
-                byrunner[runnerid, name, thisage]['bygender'].append('')
-                if self.bydiv:
-                    byrunner[runnerid, name, thisage]['bydivision'].append('')
-                    
-            # accumulate points for this result
-            # if result is ordered by time, genderplace and divisionplace may be used
-            if self.orderby in ['time', 'overallplace']:
-                # if result points depend on the number of runners, update maxgenpoints
-                if self.maxbynumrunners:
-                    self.maxgenpoints = len(allresults)
-                
-                # if starting at the top (i.e., maxgenpoints is non-zero, accumulate points accordingly
-                if self.maxgenpoints:
-                    genpoints = self.multiplier*(self.maxgenpoints+1-result.genderplace)
-                
-                # proportional scoring means points = multiplier * toptime/thistime
-                elif self.proportional_scoring:
-                    genpoints = round(self.multiplier * (propbest[gen]['time'] / result.time))
+        set the races for the next series to be rendered
 
-                # otherwise, accumulate from the bottom
-                else:
-                    genpoints = self.multiplier*result.genderplace
-                
-                # record gender points
-                byrunner[runnerid,name,thisage]['bygender'].append(max(genpoints,0))
+        :param races: list of Race records in series, in date order
+        :param racelist: list of race numbers in series, as used by the renderer, in the same order
+        '''
+        self.races = races
+        self.racelist = racelist
 
-                # handle divisions
-                if self.bydiv:
-                    # "normal" case is by max division points
-                    if not self.proportional_scoring:
-                        divpoints = self.multiplier*(self.maxdivpoints+1-result.divisionplace)
-                    
-                    # proportional scoring means points = multiplier * toptime/thistime
-                    else:
-                        divpoints = round(self.multiplier * (propbest[gen]['div'][div] / result.time))
-                    
-                    byrunner[runnerid,name,thisage]['bydivision'].append(max(divpoints,0))
-            
-            # if result was ordered by agpercent, agpercent is used -- assume no divisions
-            elif self.orderby == 'agpercent':
-                # some combinations don't make sense, and have been commented out
-                # TODO: verify combinations in updaterace.py
-                
-                ## if result points depend on the number of runners, update maxgenpoints
-                #if byrunner:
-                #    maxgenpoints = len(allresults)
-                #
-                ## if starting at the top (i.e., maxgenpoints is non-zero, accumulate points accordingly
-                #if maxgenpoints:
-                #    genpoints = self.multiplier*(self.maxgenpoints+1-result.genderplace)
-                #
-                ## otherwise, accumulate from the bottom (this should never happen)
-                #else:
-                genpoints = int(round(self.multiplier*result.agpercent))
-                
-                byrunner[runnerid,name,thisage]['bygender'].append(max(genpoints,0))
-                #if self.bydiv:
-                #    divpoints = self.multiplier*(self.maxdivpoints+1-result.divisionplace)
-                #    byrunner[runnerid,name,thisage]['bydivision'].append(max(divpoints,0))
-            
-            # if result is ordered by agtime, agtimeplace may be used -- assume no divisions
-            elif self.orderby == 'agtime':
-                # if result points depend on the number of runners, update maxgenpoints
-                if byrunner:
-                    self.maxgenpoints = len(allresults)
-                
-                # if starting at the top (i.e., maxgenpoints is non-zero, accumulate points accordingly
-                if self.maxgenpoints:
-                    genpoints = self.multiplier*(self.maxgenpoints+1-result.agtimeplace)
-                
-                # otherwise, accumulate from the bottom
-                else:
-                    genpoints = self.multiplier*result.agtimeplace
-                
-                byrunner[runnerid,name,thisage]['bygender'].append(max(genpoints,0))
-                #if self.bydiv:
-                #    divpoints = self.multiplier*(self.maxdivpoints+1-result.divisionplace)
-                #    byrunner[runnerid,name]['bydivision'].append(max(divpoints,0))
-                #
-            else:
-                raise parameterError("series '{}' results must be ordered by time, overallplace, agtime or agpercent".format(self.series.name))
-            
-        return numresults            
-    
     #----------------------------------------------------------------------
-    def renderseries(self,fh): 
+    def prepare(self,gen,series,year):
     #----------------------------------------------------------------------
         '''
-        render standings for a single series
-        
-        see BaseStandingsHandler for methods of fh
-        
-        :param fh: StandingsHandler object-like
-        '''
+        prepare output file for output, including as appropriate
 
-        # calculate points
-        def calcpoints(byrunner, runnerpool, selector):
-            '''
-            calculate list of runner results, sorted by (total points, numraces) (max to min)
-            
-            :param byrunner: full data structure by runner
-            :param runnerpool: pool of runners to use for this set of results
-            :param selector: selector from point to pull results, either 'bygender' or 'bydivision'
-            '''
-            bypoints = []
-            for runnerid,name,age in runnerpool:
-                # convert each race result to int if possible
-                byrunner[runnerid,name,age][selector] = [int(r) if isinstance(r, float) and r==int(r) else r for r in byrunner[runnerid,name,age][selector]]
-                racetotals = byrunner[runnerid,name,age][selector][:]    # make a copy
-                # total numbers only, and convert to int if possible
-                racetotals = [r for r in racetotals if type(r) in [int,float]]
-                racetotals.sort(reverse=True)
-                numracesused = min(self.maxraces, len(racetotals)) if self.maxraces else len(racetotals)
-                racesused = racetotals[0:numracesused]
-                byrunner[runnerid,name,age]['racesused'] = racesused[:]
-                totpoints = sum(racesused)
-                totpoints = int(totpoints) if totpoints == int(totpoints) else totpoints
-                # tied=False may be updated in resultsiterator.tiesort()
-                bypoints.append(Points(totpoints=totpoints, runnerid=runnerid, name=name, age=age, numraces=len(racetotals), tied=False))
-                
-            bypoints.sort(key=lambda i: (i.totpoints, i.numraces), reverse=True)
-            return bypoints
+        * open
+        * print header information
+        * collect format for output
+        * collect print line dict for output
 
-        # collect divisions if necessary
-        if self.bydiv:
-            divisions = []
-            for div in Divisions.query.filter_by(club_id=self.club_id,seriesid=self.series.id,active=True).order_by(Divisions.divisionlow).all():
-                divisions.append((div.divisionlow, div.divisionhigh))
-            if len(divisions) == 0:
-                raise dbConsistencyError('series {0} indicates divisions to be calculated, but no divisions found'.format(self.series.name))
+        numraces has number of races
 
-        # process each gender
-        for gen in ['F', 'M', 'X']:
-            # open file, prepare header, etc
-            fh.prepare(gen, self.series, self.year)
-                    
-            # collect data for each race, within byrunner dict
-            # track names of runners within each division
-            # track results by runner
-            byrunner = {}
-            runnerresults = {}
-            divrunner = None
-            if self.bydiv:
-                divrunner = {}
-                for div in divisions:
-                    divrunner[div] = []
+        :param gen: gender M, F or X
+        :param series: Series
+        :param year: year of races
+        :rtype: numraces
+        '''
+
+        # worksheet titles are limited to 31 characters and some characters aren't allowed
+        MF = {'F':'Women', 'M':'Men', 'X':'Non-binary'}
+        rengen = MF[gen]
+        title = '{} {}'.format(series.name, rengen)
+        title = ''.join([c for c in title if c not in '[]:*?/\\'])[:31]
+        self.rowstyle[gen] = None
+
+        # set up column numbers -- reset for each series
+        self.colnum = {}
+        self.colnum['place'] = 0
+        self.colnum['name'] = 1
+        self.colnum['age'] = 2
+        thiscol = 3
+        if series.has_series_option(SERIES_OPTION_DISPLAY_CLUB):
+            self.colnum['clubs'] = thiscol
+            thiscol += 1
+        self.colnum['nraces'] = thiscol
+        thiscol += 1
+        for racenum in self.racelist:
+            self.colnum['race{0}'.format(racenum)] = thiscol
+            thiscol += 1
+        self.colnum['total'] = thiscol
+
+        # open worksheet
+        widths = {}
+        for col, colnum in self.colnum.items():
+            widths[get_column_letter(colnum+1)] = self.WIDTHS['race'] if col.startswith('race') else self.WIDTHS[col]
+        self.addsheet(gen, title, widths)
+
+        # render list of all races which will be in the series
+        self.writerow(gen, [(0, '{0} {1} {2} standings'.format(rengen,year,series.name), 'majorhdr')])
+        # only drop races if max defined
+        if series.maxraces:
+            self.writerow(gen, [(1, 'Points in red are dropped.', 'hdr')])
+        # don't mention divisions unless series is using divisions
+        if series.divisions:
+            self.writerow(gen, [(1, 'Runners highlighted in blue won an overall award and are not eligible for age group awards.', 'hdr')])
+            self.writerow(gen, [(1, 'Runners highlighted in green won an age group award.', 'hdr')])
+        self.writerow(gen, [])
+
+        for racenum, race in zip(self.racelist, self.races):
+            self.writerow(gen, [(1, 'Race {0}: {1}: {2}'.format(racenum,race.name,render.renderdate(race.date)), 'racename')])
+        self.writerow(gen, [])
+
+        # render header
+        self.clearline(gen)
+        self.settotal(gen,'Total Pts.',stylename='racehdr')
+        for racenum in self.racelist:
+            self.setrace(gen,racenum,racenum,stylename='racehdr')
+        self.render(gen)
+
+        return len(self.racelist)
+
+    #----------------------------------------------------------------------
+    def addsheet(self, gen, title, widths):
+    #----------------------------------------------------------------------
+        '''
+        add the worksheet the gender's rows are written to
+
+        :param gen: gender M, F or X
+        :param title: worksheet title
+        :param widths: {column letter: width, ...}, col widths must be set before any rows are written
+        '''
+        if self.sheets is not None:
+            self.sheets[gen] = {'title': title, 'widths': widths, 'rows': []}
+            return
+
+        self.ws[gen] = self.wb.create_sheet(title)
+        for column, width in widths.items():
+            self.ws[gen].column_dimensions[column].width = width
+
+    #----------------------------------------------------------------------
+    def writerow(self, gen, cells):
+    #----------------------------------------------------------------------
+        '''
+        append a row to the gender's worksheet
+
+        :param gen: gender M, F or X
+        :param cells: [(colnum, value, stylename), ...]
+        '''
+        if self.sheets is not None:
+            self.sheets[gen]['rows'].append(cells)
+            return
+
+        row = [None] * (max([c[0] for c in cells]) + 1) if cells else []
+        for colnum, value, stylename in cells:
+            cell = WriteOnlyCell(self.ws[gen], value=value)
+            cell.style = stylename
+            row[colnum] = cell
+        self.ws[gen].append(row)
+
+    #----------------------------------------------------------------------
+    def writesheet(self, gen, sheet):
+    #----------------------------------------------------------------------
+        '''
+        write a worksheet which was recorded by another XlsxStandingsHandler, without rendering the standings
+
+        :param gen: gender M, F or X
+        :param sheet: {'title': title, 'widths': {column: width, ...}, 'rows': [cells, ...]}, from self.sheets
+        '''
+        self.addsheet(gen, sheet['title'], sheet['widths'])
+        for cells in sheet['rows']:
+            self.writerow(gen, cells)
+
+    #----------------------------------------------------------------------
+    def clearline(self,gen):
+    #----------------------------------------------------------------------
+        '''
+        prepare rendering line for output by clearing all entries
+
+        :param gen: gender M, F or X
+        '''
+
+        self.pline[gen] = {}
+        self.rowstyle[gen] = None
+
+    #----------------------------------------------------------------------
+    def setcol(self, gen, col, value, stylename):
+    #----------------------------------------------------------------------
+        '''
+        put value in col for output, if the column is rendered, empty values leave the cell empty
+
+        :param gen: gender M, F or X
+        :param col: key into self.colnum
+        :param value: value for column
+        :param stylename: key into self.style
+        '''
+        if col in self.colnum and value != '':
+            self.pline[gen][col] = (value, stylename)
+
+    #----------------------------------------------------------------------
+    def setrowclass(self, gen, _class):
+    #----------------------------------------------------------------------
+        '''
+        set class for the row, award winners' names are highlighted
+
+        :param gen: gender M, F or X
+        :param _class: value for the row class
+        '''
+
+        self.rowstyle[gen] = self.ROWSTYLE.get(_class)
+
+    #----------------------------------------------------------------------
+    def setplace(self,gen,place,stylename='place',title=None):
+    #----------------------------------------------------------------------
+        '''
+        put value in 'place' column for output (this should be rendered in 1st column)
+
+        :param gen: gender M, F or X
+        :param place: value for place column
+        :param stylename: key into self.style
+        :param title: (optional) title for popup display
+        '''
+
+        self.setcol(gen, 'place', place, stylename)
+
+    #----------------------------------------------------------------------
+    def setname(self,gen,name,stylename='name',runnerid=None):
+    #----------------------------------------------------------------------
+        '''
+        put value in 'name' column for output (this should be rendered in 2nd column)
+
+        :param gen: gender M, F or X
+        :param name: value for name column
+        :param stylename: key into self.style
+        :param runnerid: runner's id from runner table
+        '''
+
+        self.setcol(gen, 'name', name, stylename)
+
+    #----------------------------------------------------------------------
+    def setage(self,gen,age,stylename='age'):
+    #----------------------------------------------------------------------
+        '''
+        put value in 'age' column for output
+
+        :param gen: gender M, F or X
+        :param age: value for age column
+        :param stylename: key into self.style
+        '''
+
+        self.setcol(gen, 'age', age, stylename)
+
+    #----------------------------------------------------------------------
+    def setclubs(self,gen,clubs,stylename='clubs'):
+    #----------------------------------------------------------------------
+        '''
+        put value in 'clubs' column for output
+
+        :param gen: gender M, F or X
+        :param clubs: heading, or list of club affiliation elements (see RaceStanding.clubaffiliation())
+        :param stylename: key into self.style
+        '''
+
+        if not isinstance(clubs, str):
+            clubs = ', '.join([c.children[0] for c in clubs])
+        self.setcol(gen, 'clubs', clubs, stylename)
+
+    #----------------------------------------------------------------------
+    def setnraces(self,gen,nraces,stylename='nraces'):
+    #----------------------------------------------------------------------
+        '''
+        put value in 'nraces' column for output
+
+        :param gen: gender M, F or X
+        :param nraces: value for nraces column
+        :param stylename: key into self.style
+        '''
+
+        self.setcol(gen, 'nraces', nraces, stylename)
+
+    #----------------------------------------------------------------------
+    def setrace(self,gen,racenum,result,stylename='race'):
+    #----------------------------------------------------------------------
+        '''
+        put value in 'race{n}' column for output, for race n
+        should be '' for empty race
+
+        :param gen: gender M, F or X
+        :param racenum: number of race
+        :param result: value for race column
+        :param stylename: key into self.style
+        '''
+
+        self.setcol(gen, 'race{0}'.format(racenum), result, stylename)
+
+    #----------------------------------------------------------------------
+    def settotal(self,gen,total,stylename='total'):
+    #----------------------------------------------------------------------
+        '''
+        put value in 'total' column for output
+
+        :param gen: gender M, F or X
+        :param total: value for total column
+        :param stylename: key into self.style
+        '''
+
+        self.setcol(gen, 'total', total, stylename)
+
+    #----------------------------------------------------------------------
+    def render(self,gen):
+    #----------------------------------------------------------------------
+        '''
+        output current line to gender worksheet
+
+        :param gen: gender M, F or X
+        '''
+
+        if self.rowstyle[gen] and 'name' in self.pline[gen]:
+            self.pline[gen]['name'] = (self.pline[gen]['name'][0], self.rowstyle[gen])
+        self.writerow(gen, [(self.colnum[col], value, stylename) for col, (value, stylename) in self.pline[gen].items()])
+
+    #----------------------------------------------------------------------
+    def skipline(self,gen):
+    #----------------------------------------------------------------------
+        '''
+        output blank line to gender worksheet
+
+        :param gen: gender M, F or X
+        '''
+
+        self.writerow(gen, [])
+
+    #----------------------------------------------------------------------
+    def close(self):
+    #----------------------------------------------------------------------
+        '''
+        series is complete, NOOP as the workbook may have more series, see save()
+        '''
+
+        pass
+
+    #----------------------------------------------------------------------
+    def save(self, fileobj):
+    #----------------------------------------------------------------------
+        '''
+        write the workbook, this may only be done once
+
+        :param fileobj: file name or binary file-like object
+        '''
+
+        self.wb.save(fileobj)
+
+#----------------------------------------------------------------------
+def scoreresults(series, results):
+#----------------------------------------------------------------------
+    '''
+    calculate series points for results of a single race and gender
+
+    used when results are tabulated, to store points with the results, and by StandingsRenderer
+    for results which don't have stored points
+
+    :param series: Series
+    :param results: list of RaceResult for one race, one gender, placed for this series
+    :rtype: [(genpoints, divpoints), ...] in results order, divpoints is None if series isn't by division
+    '''
+    multiplier = series.multiplier
+    bydiv = series.divisions
+    proportional_scoring = series.has_series_option(SERIES_OPTION_PROPORTIONAL_SCORING)
+
+    # if result points depend on the number of runners, maxgenpoints is for this race only
+    maxgenpoints = len(results) if series.maxbynumrunners else series.maxgenpoints
+
+    # for proportional scoring, make a pass through the results to determine best times for gender, division
+    if proportional_scoring:
+        # 48 hours seems long enough
+        LONGTIME = 48*60*60
+        propbest = {
+            'M': {'time': LONGTIME, 'div': {}},
+            'F': {'time': LONGTIME, 'div': {}},
+            'X': {'time': LONGTIME, 'div': {}},
+        }
+        for result in results:
+            gen = result.gender
+            div = (result.divisionlow, result.divisionhigh)
+            propbest[gen]['div'].setdefault(div, LONGTIME)
+            if result.time < propbest[gen]['time']:
+                propbest[gen]['time'] = result.time
+            if result.time < propbest[gen]['div'][div]:
+                propbest[gen]['div'][div] = result.time
+
+    # accumulate points for each result
+    allpoints = []
+    for result in results:
+        # convenience variables
+        gen = result.gender
+        div = (result.divisionlow, result.divisionhigh)
+        divpoints = None
+
+        # if result is ordered by time, genderplace and divisionplace may be used
+        if series.orderby in ['time', 'overallplace']:
+            # if starting at the top (i.e., maxgenpoints is non-zero, accumulate points accordingly
+            if maxgenpoints:
+                genpoints = multiplier*(maxgenpoints+1-result.genderplace)
+            
+            # proportional scoring means points = multiplier * toptime/thistime
+            elif proportional_scoring:
+                genpoints = round(multiplier * (propbest[gen]['time'] / result.time))
+
+            # otherwise, accumulate from the bottom
+            else:
+                genpoints = multiplier*result.genderplace
+            
+            # handle divisions, results without a division don't get division points
+            if bydiv and result.divisionplace is not None:
+                # "normal" case is by max division points
+                if not proportional_scoring:
+                    divpoints = multiplier*(series.maxdivpoints+1-result.divisionplace)
                 
-            # pick up active races as supplied by caller
-            racesprocessed = 0
-            for race in self.races:
-                # skip races not included in this series (note race.series points at raceseries table)
-                #if self.series.id not in [s.seriesid for s in race.series]: continue
-                self.collectstandings(racesprocessed, gen, race.id, byrunner, divrunner, runnerresults)
-                racesprocessed += 1
+                # proportional scoring means points = multiplier * toptime/thistime
+                else:
+                    divpoints = round(multiplier * (propbest[gen]['div'][div] / result.time))
                 
-            # render standings
+                divpoints = max(divpoints,0)
+        
+        # if result was ordered by agpercent, agpercent is used -- assume no divisions
+        elif series.orderby == 'agpercent':
+            # some combinations don't make sense, and have been commented out
+            # TODO: verify combinations in updaterace.py
+            
+            ## if starting at the top (i.e., maxgenpoints is non-zero, accumulate points accordingly
+            #if maxgenpoints:
+            #    genpoints = multiplier*(maxgenpoints+1-result.genderplace)
+            #
+            ## otherwise, accumulate from the bottom (this should never happen)
+            #else:
+            genpoints = int(round(multiplier*result.agpercent))
             
-            # overall
+            #if bydiv:
+            #    divpoints = multiplier*(series.maxdivpoints+1-result.divisionplace)
+        
+        # if result is ordered by agtime, agtimeplace may be used -- assume no divisions
+        elif series.orderby == 'agtime':
+            # agtime points always start at the number of runners in this race and gender
+            genpoints = multiplier*(len(results)+1-result.agtimeplace)
+            
+            #if bydiv:
+            #    divpoints = multiplier*(series.maxdivpoints+1-result.divisionplace)
+            #
+        else:
+            raise parameterError("series '{}' results must be ordered by time, overallplace, agtime or agpercent".format(series.name))
+        
+        allpoints.append((max(genpoints,0), divpoints))
+
+    return allpoints
+
+#----------------------------------------------------------------------
+def scoreseries(club_id, series):
+#----------------------------------------------------------------------
+    '''
+    (re)calculate and store points for all the series results, e.g., after series configuration changes
+
+    caller is responsible for committing the session
+
+    :param club_id: club.id
+    :param series: Series
+    '''
+    byraceandgen = {}
+    for result in RaceResult.query.filter_by(club_id=club_id, seriesid=series.id).all():
+        byraceandgen.setdefault((result.raceid, result.gender), []).append(result)
+
+    for results in byraceandgen.values():
+        for result, (genpoints, divpoints) in zip(results, scoreresults(series, results)):
+            result.genderpoints = genpoints
+            result.divisionpoints = divpoints
+
+class RunnerStanding(object):
+    '''
+    one runner's points across the series races for a gender (see StandingsRenderer.collectstandings())
+
+    bygender and bydivision have an entry for each race in the series, '' for a race not run, 0 for a
+    race run but no points given
+
+    :param runnerid: runner.id
+    :param name: runner's name
+    :param age: runner's standings age
+    :param numraces: number of races in the series
+    :param bydiv: True if division points are collected
+    :param display_club: True if club affiliations are collected
+    '''
+    __slots__ = ('runnerid', 'name', 'age', 'bygender', 'bydivision', 'clubaffiliation', 'racescollected', 'dropped')
+
+    def __init__(self, runnerid, name, age, numraces, bydiv=False, display_club=False):
+        self.runnerid = runnerid
+        self.name = name
+        self.age = age
+        self.bygender = [''] * numraces
+        self.bydivision = [''] * numraces if bydiv else None
+        self.clubaffiliation = [] if display_club else None
+        # races up to and including the last race run, only these are rendered
+        self.racescollected = 0
+        # bitmask of races not used for total points, set by best()
+        self.dropped = 0
+
+    def setpoints(self, racendx, genpoints, divpoints=None):
+        '''
+        record points for a race
+
+        :param racendx: index of race within series races
+        :param genpoints: points for gender standings
+        :param divpoints: (optional) points for division standings
+        '''
+        toint = lambda r: int(r) if isinstance(r, float) and r==int(r) else r
+        self.bygender[racendx] = toint(genpoints)
+        if divpoints is not None:
+            self.bydivision[racendx] = toint(divpoints)
+        self.racescollected = racendx + 1
+
+    def best(self, selector, maxraces):
+        '''
+        determine which races are used for the runner's total points, setting self.dropped for the others
+
+        highest points are used, earlier races first when points are equal
+
+        :param selector: 'bygender' or 'bydivision'
+        :param maxraces: maximum number of races used, all races if None
+        :rtype: (totpoints, numraces)
+        '''
+        points = getattr(self, selector)
+        racesrun = [ndx for ndx in range(self.racescollected) if points[ndx] != '']
+        racesused = sorted(racesrun, key=lambda ndx: points[ndx], reverse=True)
+        if maxraces:
+            racesused = racesused[:maxraces]
+
+        self.dropped = (1 << len(points)) - 1
+        for ndx in racesused:
+            self.dropped &= ~(1 << ndx)
+
+        totpoints = sum([points[ndx] for ndx in racesused])
+        totpoints = int(totpoints) if totpoints == int(totpoints) else totpoints
+        return totpoints, len(racesrun)
+
+    def isdropped(self, racendx):
+        '''
+        return True if race was not used for total points by last call to best()
+
+        :param racendx: index of race within series races
+        '''
+        return bool(self.dropped & (1 << racendx))
+
+########################################################################
+class StandingsRenderer():
+########################################################################
+    '''
+    StandingsRenderer collects standings and provides rendering methods, for a single series
+    
+    :param club_id: club.id
+    :param year: year for standings
+    :param series: Series
+    :param races: list of Races
+    :param racenums: list of race numbers for standings 
+    :param bulkload: (optional) if True, load all the series results with a single query, see loadresults()
+    :param divages: (optional) DivisionAgeLookup for club_id, year, created by renderseries() if not supplied
+    :param columns: (optional) standings previously collected by collectrace(), {(gen, raceid): [RaceStanding, ...], ...}
+    :param bulkresults: (optional) series results already loaded, as returned by loadresults(), e.g., by YearStandingsRenderer
+    :param divisions: (optional) active divisions for series, [(divisionlow, divisionhigh), ...] in divisionlow order,
+        queried by renderseries() if not supplied
+    :param genders: (optional) list of genders to collect and render, default all genders
+    :param division: (optional) only render this division, OVERALL or text as from divisiontext(), default all
+    '''
+    #----------------------------------------------------------------------
+    def __init__(self,club_id,year,series,races,racenums,bulkload=False,divages=None,columns=None,bulkresults=None,divisions=None,
+                 genders=None,division=None):
+    #----------------------------------------------------------------------
+        self.club_id = club_id
+        self.series = series
+        self.orderby = series.orderby
+        self.hightolow = series.hightolow
+        self.bydiv = series.divisions
+        self.avgtie = series.averagetie
+        self.multiplier = series.multiplier
+        self.maxgenpoints = series.maxgenpoints
+        self.maxdivpoints = series.maxdivpoints
+        self.maxraces = series.maxraces
+        self.maxbynumrunners = series.maxbynumrunners
+        self.proportional_scoring = series.has_series_option(SERIES_OPTION_PROPORTIONAL_SCORING)
+        self.requires_club = series.has_series_option(SERIES_OPTION_REQUIRES_CLUB)
+        self.display_club = series.has_series_option(SERIES_OPTION_DISPLAY_CLUB)
+        self.year = year
+        self.races = races
+        self.racenums = racenums
+        self.bulkload = bulkload
+        # set by renderseries() if bulkload and not supplied, {gen: {raceid: [RaceResult, ...], ...}, ...}
+        self.bulkresults = bulkresults
+        self.divisions = divisions
+        self.genders = genders if genders else ['F', 'M', 'X']
+        self.division = division
+        self.divages = divages
+        # {(gen, raceid): [RaceStanding, ...], ...}, supplied columns are used rather than collecting the race again
+        self.columns = columns if columns is not None else {}
+        
+    #----------------------------------------------------------------------
+    def loadresults(self):
+    #----------------------------------------------------------------------
+        '''
+        load all results for this series with a single query, eagerly loading each result's runner,
+        race and club affiliation, then partition the results by gender and race
+
+        each partition is in the order collectstandings() would have retrieved it from the database
+
+        only results for self.genders are loaded, and races for which these genders have already been
+        collected in self.columns are not loaded
+        
+        :rtype: {gen: {raceid: [RaceResult, ...], ...}, ...}
+        '''
+        raceids = [race.id for race in self.races if any((gen, race.id) not in self.columns for gen in self.genders)]
+        if not raceids:
+            return {}
+        allresults = (RaceResult.query
+                      .options(joinedload(RaceResult.runner), joinedload(RaceResult.race), joinedload(RaceResult.clubaffiliation))
+                      .filter_by(club_id=self.club_id, seriesid=self.series.id)
+                      .filter(RaceResult.raceid.in_(raceids), RaceResult.gender.in_(self.genders))
+                      .order_by(getattr(RaceResult, self.orderby))
+                      .all())
+
+        # partitioning retains the query order within each gender, race
+        bulkresults = {}
+        for result in allresults:
+            bulkresults.setdefault(result.gender, {}).setdefault(result.raceid, []).append(result)
+        
+        if self.hightolow:
+            for genresults in bulkresults.values():
+                for raceresults in genresults.values():
+                    raceresults.reverse()
+
+        return bulkresults
+
+    #----------------------------------------------------------------------
+    def collectrace(self, gen, raceid):
+    #----------------------------------------------------------------------
+        '''
+        collect points for each result in this race / series / gender
+        
+        the collected standings depend only on this race's results and the series configuration, so
+        they can be kept while other races are retabulated
+
+        points stored with the results at tabulation are used, else they are calculated with scoreresults()
+        
+        :param gen: gender, M or F
+        :param raceid: race.id to collect standings for
+        :rtype: [RaceStanding, ...] in results order
+        '''
+        # get all the results currently in the database, from the bulk load if available
+        if self.bulkresults is not None:
+            allresults = self.bulkresults.get(gen, {}).get(raceid, [])
+        else:
+            allresults = RaceResult.query.order_by(self.orderby).filter_by(club_id=self.club_id,raceid=raceid,seriesid=self.series.id,gender=gen).all()
+            #app.logger.debug('gather results for: clubid={}, raceid={}, seriesid={}, gen={}'.format(self.club_id,raceid,self.series.id,gen))
+            if self.hightolow: 
+                allresults.reverse()
+        
+        # results tabulated before points were stored need to be scored here
+        if all(result.genderpoints is not None for result in allresults):
+            allpoints = [(result.genderpoints, result.divisionpoints) for result in allresults]
+        else:
+            allpoints = scoreresults(self.series, allresults)
+
+        standings = []
+        for result, (genpoints, divpoints) in zip(allresults, allpoints):
+            clubshortname = clubtitle = None
+            if result.clubaffiliation and result.clubaffiliation.shortname:
+                clubshortname, clubtitle = result.clubaffiliation.shortname, result.clubaffiliation.title
+
+            standings.append(RaceStanding(result.race, runnerid=result.runnerid, name=result.runner.name,
+                                          agage=result.agage, divisionlow=result.divisionlow,
+                                          divisionhigh=result.divisionhigh, genpoints=genpoints,
+                                          divpoints=divpoints if self.bydiv else None,
+                                          clubshortname=clubshortname, clubtitle=clubtitle))
+
+        return standings
+
+    #----------------------------------------------------------------------
+    def collectstandings(self, racesprocessed, gen, raceid, byrunner, divrunner, runnerresults): 
+    #----------------------------------------------------------------------
+        '''
+        collect standings for this race / series
+        
+        in byrunner[runnerid,name,age], points entries are '' for race not run, 0 for race run but no points given
+
+        the race's standings are taken from self.columns if available, else collected with collectrace()
+        and saved in self.columns
+        
+        :param racesprocessed: number of races processed so far
+        :param gen: gender, M or F
+        :param raceid: race.id to collect standings for
+        :param byrunner: dict updated as runner standings are collected {(runnerid,name,age):RunnerStanding, ...}
+        :param divrunner: dict updated with runner names by division {divlow,divhigh:[runner1,runner2,...],...}
+        :param runnerresults: dict updated with set of results runner has {runnerid:{RaceStanding1, ...}}
+        :rtype: number of standings processed for this race / series
+        '''
+        if (gen, raceid) not in self.columns:
+            self.columns[gen, raceid] = self.collectrace(gen, raceid)
+        standings = self.columns[gen, raceid]
+    
+        # determine age for all runners for which there are results
+        age = {}
+
+        # accumulate results
+        for standing in standings:
+            # add runner name
+            name = standing.name
+            runnerid = standing.runnerid
+
+            # collect runner's results
+            if runnerid not in runnerresults:
+                runnerresults[runnerid] = set()
+            runnerresults[runnerid].add(standing)
+
+            # convenience variables
+            clubaffiliation = standing.clubaffiliation()
+
+            # get runner's age for standings
+            if runnerid not in age:
+                thisage = self.divages.standingsage(runnerid)
+                # strange, how is there RaceResult but no ManagedResult?
+                if thisage is None:
+                    current_app.logger.warning(f'no ManagedResult found for raceid {standing.race.id} {name}')
+                    thisage = standing.agage
+                age[runnerid] = thisage
+            thisage = age[runnerid]
+
+            if (runnerid, name, thisage) not in byrunner:
+                byrunner[runnerid, name, thisage] = RunnerStanding(runnerid, name, thisage, len(self.races),
+                                                                   bydiv=self.bydiv, display_club=self.display_club)
+                if self.bydiv:
+                    if (runnerid, name, thisage) not in divrunner[(standing.divisionlow, standing.divisionhigh)]:
+                        divrunner[(standing.divisionlow,standing.divisionhigh)].append((runnerid, name, thisage))
+            thisrunner = byrunner[runnerid, name, thisage]
+
+            # pick up club affiliation if needed and not already in the list
+            if self.display_club:
+                if clubaffiliation and clubaffiliation.render() not in [c.render() for c in thisrunner.clubaffiliation]:
+                    thisrunner.clubaffiliation.append(clubaffiliation)
+
+            # record points for this result
+            thisrunner.setpoints(racesprocessed, standing.genpoints, standing.divpoints if self.bydiv else None)
+
+        return len(standings)
+    
+    #----------------------------------------------------------------------
+    def calcpoints(self, gen, byrunner, runnerpool, selector):
+    #----------------------------------------------------------------------
+        '''
+        calculate list of runner results, sorted by (total points, numraces) (max to min)
+
+        the races which are dropped from each runner's total are set in byrunner, see RunnerStanding.best()
+
+        :param gen: gender M or F
+        :param byrunner: full data structure by runner
+        :param runnerpool: pool of runners to use for this set of results
+        :param selector: selector from point to pull results, either 'bygender' or 'bydivision'
+        '''
+        bypoints = []
+        for thisrunner in runnerpool:
+            runner = byrunner[thisrunner]
+            totpoints, numraces = runner.best(selector, self.maxraces)
+            # tied=False may be updated in resultsiterator.tiesort()
+            bypoints.append(Points(totpoints=totpoints, runnerid=runner.runnerid, name=runner.name, age=runner.age,
+                                   numraces=numraces, tied=False))
+
+        bypoints.sort(key=lambda i: (i.totpoints, i.numraces), reverse=True)
+        return bypoints
+
+    #----------------------------------------------------------------------
+    def renderraces(self, fh, gen, runner, selector):
+    #----------------------------------------------------------------------
+        '''
+        render runner's club affiliation, if needed, points for each race and number of races run,
+        calcpoints() must have been called for selector
+
+        :param fh: StandingsHandler object-like
+        :param gen: gender M or F
+        :param runner: RunnerStanding
+        :param selector: 'bygender' or 'bydivision'
+        '''
+        if runner.clubaffiliation is not None:
+            fh.setclubs(gen, runner.clubaffiliation)
+
+        points = getattr(runner, selector)
+        nraces = 0
+        for racendx, racenum in zip(range(runner.racescollected), self.racenums):
+            pts = points[racendx]
+            if not runner.isdropped(racendx):
+                fh.setrace(gen,racenum,pts)
+            else:
+                fh.setrace(gen,racenum,pts,stylename='race-dropped')
+            # count number of races runner ran
+            if pts != '':
+                nraces += 1
+        fh.setnraces(gen,nraces)
+
+    #----------------------------------------------------------------------
+    def rendergender(self, fh, gen, divisions):
+    #----------------------------------------------------------------------
+        '''
+        render standings for one gender of the series
+
+        :param fh: StandingsHandler object-like
+        :param gen: gender M, F or X
+        :param divisions: [(divisionlow, divisionhigh), ...] if series is by division, else None
+        '''
+        # open file, prepare header, etc
+        fh.prepare(gen, self.series, self.year)
+                
+        # collect data for each race, within byrunner dict
+        # track names of runners within each division
+        # track results by runner
+        byrunner = {}
+        runnerresults = {}
+        divrunner = None
+        if self.bydiv:
+            divrunner = {}
+            for div in divisions:
+                divrunner[div] = []
+            
+        # pick up active races as supplied by caller
+        racesprocessed = 0
+        for race in self.races:
+            # skip races not included in this series (note race.series points at raceseries table)
+            #if self.series.id not in [s.seriesid for s in race.series]: continue
+            self.collectstandings(racesprocessed, gen, race.id, byrunner, divrunner, runnerresults)
+            racesprocessed += 1
+            
+        # render standings
+
+        # overall is rendered unless only a division was requested
+        renderoverall = self.division in [None, OVERALL]
+        if renderoverall:
             fh.setheader(gen,True)
             fh.clearline(gen)
             fh.setplace(gen,'Place','racehdr')
@@ -1510,61 +2314,54 @@ class StandingsRenderer():
             fh.setage(gen,'Div Age','divhdr')
             fh.setclubs(gen,'Club','divhdr')
             fh.setnraces(gen,'n','divhdr')
-            fh.setdivision(gen,'Overall')
+            fh.setdivision(gen,OVERALL)
             fh.render(gen)
             fh.setheader(gen,False)
-            
-            # calculate runner total points overall
-            bypoints = calcpoints(byrunner, byrunner, 'bygender')
-            
-            # loop through results, handling ties as defined with self.series and render
-            oaawardwinners = {} 
-            theseresults = resultsiterator(self.series, bypoints, byrunner, runnerresults, self.races, division=False)
-            for thisbypoints in theseresults:
-                # break thisbypoints apart, matching self.collectstandings() implementation
-                totpoints, runnerid, name, age = thisbypoints.totpoints, thisbypoints.runnerid, thisbypoints.name, thisbypoints.age
-                
-                # start fresh
-                fh.clearline(gen)
-                        
-                # get the runner's calculated place
-                renderplace = theseresults.calcrenderplace(thisbypoints)
-                explanation = thisbypoints.explanation if hasattr(thisbypoints, 'explanation') else None
-                fh.setplace(gen, renderplace, title=explanation)
-                
-                # update for overall awards
-                if self.series.oaawards and renderplace and renderplace <= self.series.oaawards:
-                    oaawardwinners[runnerid] = {'place': renderplace, 'bypoints': thisbypoints}
-                    fh.setrowclass(gen, 'row-overall-award')
-                    
-                # render name and total points, remember last total points
-                fh.setname(gen,name,runnerid=runnerid)
-                fh.setage(gen,age)
-                fh.settotal(gen,totpoints)
+
+        # calculate runner total points overall
+        bypoints = self.calcpoints(gen, byrunner, byrunner, 'bygender')
+
+        # loop through results, handling ties as defined with self.series and render
+        oaawardwinners = {}
+        theseresults = resultsiterator(self.series, bypoints, byrunner, runnerresults, self.races, division=False)
+        for thisbypoints in theseresults:
+            # break thisbypoints apart, matching self.collectstandings() implementation
+            totpoints, runnerid, name, age = thisbypoints.totpoints, thisbypoints.runnerid, thisbypoints.name, thisbypoints.age
+
+            # get the runner's calculated place
+            renderplace = theseresults.calcrenderplace(thisbypoints)
+            oaaward = self.series.oaawards and renderplace and renderplace <= self.series.oaawards
+
+            # update for overall awards
+            if oaaward:
+                oaawardwinners[runnerid] = {'place': renderplace, 'bypoints': thisbypoints}
+
+            # if only a division is rendered, overall places are only needed to find the overall award winners
+            if not renderoverall:
+                if not self.series.oaawards or (renderplace and renderplace > self.series.oaawards):
+                    break
+                continue
+
+            # start fresh
+            fh.clearline(gen)
+            explanation = thisbypoints.explanation if hasattr(thisbypoints, 'explanation') else None
+            fh.setplace(gen, renderplace, title=explanation)
+            if oaaward:
+                fh.setrowclass(gen, 'row-overall-award')
                 
-                # set club affiliation, if needed
-                if 'clubaffiliation' in byrunner[runnerid,name,age]:
-                    fh.setclubs(gen, byrunner[runnerid,name,age]['clubaffiliation'])
-                        
-                # render race results
-                iracenums = iter(self.racenums)
-                nraces = 0
-                for pts in byrunner[runnerid,name,age]['bygender']:
-                    racenum = next(iracenums)
-                    if pts in byrunner[runnerid,name,age]['racesused']:
-                        fh.setrace(gen,racenum,pts)
-                        byrunner[runnerid,name,age]['racesused'].remove(pts)
-                    else:
-                        fh.setrace(gen,racenum,pts,stylename='race-dropped')
-                    # count number of races runner ran
-                    if isinstance(pts, int) or isinstance(pts, float):
-                        nraces += 1
-                fh.setnraces(gen,nraces)
-                fh.render(gen)
+            # render name and total points, remember last total points
+            fh.setname(gen,name,runnerid=runnerid)
+            fh.setage(gen,age)
+            fh.settotal(gen,totpoints)
+            
+            # set club affiliation, if needed, and race results
+            self.renderraces(fh, gen, byrunner[runnerid,name,age], 'bygender')
+            fh.render(gen)
 
-            # by division if needed
-            if self.bydiv:
-            # remember overall awards, so that division display can be adjusted
+        # by division if needed, or the requested division
+        if self.bydiv and self.division != OVERALL:
+            # the age group header separates overall from divisions, not needed for a single division
+            if not self.division:
                 fh.setheader(gen,True)
                 fh.clearline(gen)
                 fh.setplace(gen,'Place','racehdr')
@@ -1574,92 +2371,206 @@ class StandingsRenderer():
                 fh.setnraces(gen,'n','divhdr')
                 fh.render(gen)
                 fh.setheader(gen,False)
+
+            for div in divisions:
+                divlow,divhigh = div
+                divtext = divisiontext(divlow,divhigh)
+                if self.division and divtext != self.division:
+                    continue
+
+                fh.setheader(gen,True)
+                fh.clearline(gen)
+                fh.setname(gen,divtext,'divhdr')
+                fh.setdivision(gen,divtext)
+                fh.render(gen)
+                fh.setheader(gen,False)
                 
-                for div in divisions:
-                    fh.setheader(gen,True)
+                # calculate runner total points for this division
+                bypoints = self.calcpoints(gen, byrunner, divrunner[div], 'bydivision')
+                
+                # loop through results, handling ties as defined with self.series, and render
+                theseresults = resultsiterator(self.series, bypoints, byrunner, runnerresults, self.races, division=True)
+                for thisbypoints in theseresults:
+                    # break thisbypoints apart, matching self.collectstandings() implementation
+                    totpoints, runnerid, name, age = thisbypoints.totpoints, thisbypoints.runnerid, thisbypoints.name, thisbypoints.age
+
                     fh.clearline(gen)
-                    divlow,divhigh = div
-                    if not divlow or divlow <= 1:
-                        divtext = '{0} and under'.format(divhigh)
-                    elif not divhigh or divhigh >= 99: 
-                        divtext = '{0} and up'.format(divlow)
+                    
+                    # check for overall winner
+                    if runnerid in oaawardwinners:
+                        renderplace = f'oa-{oaawardwinners[runnerid]["place"]}'
+                        fh.setrowclass(gen, 'row-overall-award')
+                    
+                    # normal division placer
                     else:
-                        divtext = '{0} to {1}'.format(divlow,divhigh)
-                    fh.setname(gen,divtext,'divhdr')
-                    fh.setdivision(gen,divtext)
+                        # get the runner's calculated place
+                        renderplace = theseresults.calcrenderplace(thisbypoints)
+
+                        if self.series.divawards and renderplace and renderplace <= self.series.divawards:
+                            fh.setrowclass(gen, 'row-division-award')
+
+                    # render the place
+                    explanation = thisbypoints.explanation if hasattr(thisbypoints, 'explanation') else None
+                    fh.setplace(gen, renderplace, title=explanation)
+                    
+                    # render name and total points, remember last total points
+                    fh.setname(gen,name,runnerid=runnerid)
+                    fh.setage(gen,age)
+                    fh.settotal(gen,totpoints)
+
+                    # set club affiliation, if needed, and race results
+                    self.renderraces(fh, gen, byrunner[runnerid,name,age], 'bydivision')
                     fh.render(gen)
-                    fh.setheader(gen,False)
                     
-                    # calculate runner total points for this division
-                    bypoints = calcpoints(byrunner, divrunner[div], 'bydivision')
+                # skip line between divisions
+                fh.skipline(gen)
                     
-                    # loop through results, handling ties as defined with self.series, and render
-                    theseresults = resultsiterator(self.series, bypoints, byrunner, runnerresults, self.races, division=True)
-                    for thisbypoints in theseresults:
-                        # break thisbypoints apart, matching self.collectstandings() implementation
-                        totpoints, runnerid, name, age = thisbypoints.totpoints, thisbypoints.runnerid, thisbypoints.name, thisbypoints.age
-
-                        fh.clearline(gen)
-                        
-                        # check for overall winner
-                        if runnerid in oaawardwinners:
-                            renderplace = f'oa-{oaawardwinners[runnerid]["place"]}'
-                            fh.setrowclass(gen, 'row-overall-award')
-                        
-                        # normal division placer
-                        else:
-                            # get the runner's calculated place
-                            renderplace = theseresults.calcrenderplace(thisbypoints)
-
-                            if self.series.divawards and renderplace and renderplace <= self.series.divawards:
-                                fh.setrowclass(gen, 'row-division-award')
-
-                        # render the place
-                        explanation = thisbypoints.explanation if hasattr(thisbypoints, 'explanation') else None
-                        fh.setplace(gen, renderplace, title=explanation)
-                        
-                        # render name and total points, remember last total points
-                        fh.setname(gen,name,runnerid=runnerid)
-                        fh.setage(gen,age)
-                        fh.settotal(gen,totpoints)
-
-                        # set club affiliation, if needed
-                        if 'clubaffiliation' in byrunner[runnerid,name,age]:
-                            fh.setclubs(gen, byrunner[runnerid,name,age]['clubaffiliation'])
-                        
-                        # render race results
-                        iracenums = iter(self.racenums)
-                        nraces = 0
-                        for pts in byrunner[runnerid,name,age]['bydivision']:
-                            racenum = next(iracenums)
-                            if pts in byrunner[runnerid,name,age]['racesused']:
-                                fh.setrace(gen,racenum,pts)
-                                byrunner[runnerid,name,age]['racesused'].remove(pts)
-                            else:
-                                fh.setrace(gen,racenum,pts,stylename='race-dropped')
-                            # count number of races runner ran
-                            if isinstance(pts, int) or isinstance(pts, float):
-                                nraces += 1
-                        fh.setnraces(gen,nraces)
-                        fh.render(gen)
-                        
-                    # skip line between divisions
-                    fh.skipline(gen)
-                        
-            fh.skipline(gen)
-                        
+        fh.skipline(gen)
+
+    #----------------------------------------------------------------------
+    def renderseries(self,fh):
+    #----------------------------------------------------------------------
+        '''
+        render standings for a single series
+        
+        see BaseStandingsHandler for methods of fh
+        
+        :param fh: StandingsHandler object-like
+        '''
+
+        # collect divisions if necessary
+        divisions = None
+        if self.bydiv:
+            divisions = self.divisions
+            if divisions is None:
+                divisions = []
+                for div in Divisions.query.filter_by(club_id=self.club_id,seriesid=self.series.id,active=True).order_by(Divisions.divisionlow).all():
+                    divisions.append((div.divisionlow, div.divisionhigh))
+            if len(divisions) == 0:
+                raise dbConsistencyError('series {0} indicates divisions to be calculated, but no divisions found'.format(self.series.name))
+
+        # standings age for each runner
+        if not self.divages:
+            self.divages = DivisionAgeLookup(self.club_id, self.year)
+
+        # pick up all the results at once if requested
+        if self.bulkload and self.bulkresults is None:
+            self.bulkresults = self.loadresults()
+
+        # process each gender
+        for gen in self.genders:
+            self.rendergender(fh, gen, divisions)
+
         # done with rendering
         fh.close()
 
+########################################################################
+class YearStandingsRenderer():
+########################################################################
+    '''
+    YearStandingsRenderer renders standings for all the active series of a club for a year
+
+    the series, their races and divisions, the division ages and all the results are loaded once and
+    shared by the StandingsRenderer for each series
+
+    :param club_id: club.id
+    :param year: year for standings
+    :param excludeseries: (optional) ids of series which aren't rendered, e.g., series of a finalized season
+    '''
+    #----------------------------------------------------------------------
+    def __init__(self, club_id, year, excludeseries=None):
+    #----------------------------------------------------------------------
+        self.club_id = club_id
+        self.year = int(year)
+        self.excludeseries = excludeseries
+        # set by load()
+        self.series = None          # [Series, ...] in name order, then id
+        self.races = None           # {seriesid: [Race, ...] in date order, ...}
+        self.divisions = None       # {seriesid: [(divisionlow, divisionhigh), ...], ...}
+        self.divages = None         # DivisionAgeLookup
+        self.bulkresults = None     # {seriesid: {gen: {raceid: [RaceResult, ...], ...}, ...}, ...}
+
+    #----------------------------------------------------------------------
+    def load(self):
+    #----------------------------------------------------------------------
+        '''
+        load series, races, divisions, division ages and results for all the active series for the year
+        '''
+        query = (Series.query
+                 .options(selectinload(Series.divisions))
+                 .filter_by(club_id=self.club_id, year=self.year, active=True)
+                 .order_by(Series.name, Series.id))
+        if self.excludeseries:
+            query = query.filter(Series.id.notin_(self.excludeseries))
+        self.series = query.all()
+        seriesids = [series.id for series in self.series]
+
+        self.divisions = {}
+        for series in self.series:
+            divisions = sorted([d for d in series.divisions if d.active], key=lambda d: d.divisionlow)
+            self.divisions[series.id] = [(d.divisionlow, d.divisionhigh) for d in divisions]
+
+        self.races = {seriesid:[] for seriesid in seriesids}
+        self.bulkresults = {seriesid:{} for seriesid in seriesids}
+        self.divages = DivisionAgeLookup(self.club_id, self.year)
+        if not seriesids:
+            return
+
+        racesquery = (db.session.query(RaceSeries.seriesid, Race)
+                      .join(Race, Race.id == RaceSeries.raceid)
+                      .filter(RaceSeries.seriesid.in_(seriesids))
+                      .order_by(Race.date))
+        for seriesid, race in racesquery:
+            self.races[seriesid].append(race)
+
+        allresults = (RaceResult.query
+                      .options(joinedload(RaceResult.runner), joinedload(RaceResult.race), joinedload(RaceResult.clubaffiliation))
+                      .filter(RaceResult.club_id == self.club_id, RaceResult.seriesid.in_(seriesids))
+                      .order_by(RaceResult.id)
+                      .all())
+        for result in allresults:
+            self.bulkresults[result.seriesid].setdefault(result.gender, {}).setdefault(result.raceid, []).append(result)
+
+        # put each partition in the order StandingsRenderer.loadresults() would have retrieved it from the database,
+        # where nulls sort first
+        for series in self.series:
+            orderkey = lambda r: (getattr(r, series.orderby) is not None, getattr(r, series.orderby) or 0)
+            for genresults in self.bulkresults[series.id].values():
+                for raceresults in genresults.values():
+                    raceresults.sort(key=orderkey)
+                    if series.hightolow:
+                        raceresults.reverse()
+
+    #----------------------------------------------------------------------
+    def render(self, handlerfactory):
+    #----------------------------------------------------------------------
+        '''
+        render standings for each series, loading the year's data first if needed
+
+        :param handlerfactory: function(series, racenums) which returns StandingsHandler object-like for the series
+        :rtype: generator of (series, races, fh) in series name order, with fh rendered
+        '''
+        if self.series is None:
+            self.load()
+
+        for series in self.series:
+            races = self.races[series.id]
+            racenums = list(range(1, len(races)+1))
+            rr = StandingsRenderer(self.club_id, self.year, series, races, racenums, divages=self.divages,
+                                   bulkresults=self.bulkresults[series.id], divisions=self.divisions[series.id])
+            fh = handlerfactory(series, racenums)
+            rr.renderseries(fh)
+            yield series, races, fh
+
 class resultsiterator():
     '''
     iterate through results, handling ties if necessary
     
     :param series: Series record
     :param bypoints: sorted list [(totpoints, runnerid, name, age), ...]
-    :param byrunner: dict updated from standings collection {runnerid,name,age:{'bygender':[points1,points2,...],'bydivision':[points1,points2,...]}}
-    :param runnerresults: {runnerid: {RaceResult1, RaceResult2, ...}}
-    :param races: ordered list of Race records, same order as byrunner[]['bygender'] and byrunner[]['bydivision']
+    :param byrunner: dict updated from standings collection {(runnerid,name,age):RunnerStanding, ...}
+    :param runnerresults: {runnerid: {RaceStanding1, RaceStanding2, ...}}
+    :param races: ordered list of Race records, same order as byrunner[].bygender and byrunner[].bydivision
     :param division: (optional) use SERIES_TIE_OPTION_DIV_COMPARE_OVERALL handling if configured
     '''
     def __init__(self, series, bypoints, byrunner, runnerresults, races, division=False) -> None:
@@ -1713,10 +2624,16 @@ class resultsiterator():
                 self.pointstie.append(self.bypoints[tiendx])
             
             if tiefound:
-                # sort the ties depending on tie configuration
-                self.pointstie.sort(key=cmp_to_key(self.tiesort), reverse=True)
+                # sort the ties depending on tie configuration, using tie break values computed once for the group
+                self.tievalues(self.pointstie)
+                if SERIES_TIE_OPTION_HEAD_TO_HEAD_POINTS in self.seriestiealgs and len(self.pointstie) > 2:
+                    # head to head points depend on the pair of runners being compared, so can't be a key
+                    # for more than two runners
+                    self.pointstie.sort(key=cmp_to_key(self.tiesort), reverse=True)
+                else:
+                    self.pointstie.sort(key=self.tiekey, reverse=True)
                 
-                # set tiebreak explanations after entries are sorted (this is side-effect of tiesort())
+                # set tiebreak explanations after entries are sorted
                 for i in range(1, len(self.pointstie)):
                     self.tiesort(self.pointstie[i-1], self.pointstie[i])
                     # divoroa = 'div' if self.division else 'oa'
@@ -1769,81 +2686,127 @@ class resultsiterator():
         # current_app.logger.debug(f'cmp: x={x} y={y} (x > y) - (x < y)={(x > y) - (x < y)}')
         return (x > y) - (x < y)
     
-    def tiesort(self, x, y):
+    def tievalues(self, pointstie):
         '''
-        sort key function, based on series tie configuration
+        compute tie break values for each runner in a tied group, used by tiecompare() and tiekey()
+
+        sets self.tiegroup [Points, ...], self.racepoints {(runnerid, name, age): {raceid: points, ...}, ...}
+        and self.avgpoints {(runnerid, name, age): {algorithm: average, ...}, ...}
+
+        :param pointstie: list of Points which are tied
         '''
         # which byrunner[] field do we retrieve points from?
         if not self.division:
             rrpoints = 'bygender'
         else:
             rrpoints = 'bydivision'
-        
+
+        # pointstie is empty while being sorted, so keep the group for tiekey()
+        self.tiegroup = list(pointstie)
+        self.racepoints = {}
+        self.avgpoints = {}
+        for p in pointstie:
+            thisrunner = (p.runnerid, p.name, p.age)
+            racendxs = {r.race.id:self.racendx[r.race.id] for r in self.runnerresults[p.runnerid]}
+            points = getattr(self.byrunner[thisrunner], rrpoints)
+            self.racepoints[thisrunner] = {raceid:points[ndx] for raceid, ndx in racendxs.items()}
+            self.avgpoints[thisrunner] = {}
+            if SERIES_TIE_OPTION_COMPARE_AVG in self.seriestiealgs:
+                self.avgpoints[thisrunner][SERIES_TIE_OPTION_COMPARE_AVG] = self.bestavg(self.racepoints[thisrunner].values())
+            if SERIES_TIE_OPTION_DIV_COMPARE_OVERALL in self.seriestiealgs and self.division:
+                self.avgpoints[thisrunner][SERIES_TIE_OPTION_DIV_COMPARE_OVERALL] = \
+                    self.bestavg([self.byrunner[thisrunner].bygender[ndx] for ndx in racendxs.values()])
+
+    def bestavg(self, points):
+        '''
+        average of runner's best points, limited to series maxraces
+
+        :param points: runner's points for each race run
+        :rtype: average points
+        '''
+        results = sorted(points, reverse=True)
+        nraces = min(self.series.maxraces, len(results)) if self.series.maxraces else len(results)
+        return mean(results[:nraces])
+
+    def headtohead(self, x, y):
+        '''
+        sum x's points from races which both x and y ran
+
+        :param x: Points for runner whose points are summed
+        :param y: Points for runner x is compared against
+        :rtype: sum of points
+        '''
+        xpoints = self.racepoints[x.runnerid, x.name, x.age]
+        ypoints = self.racepoints[y.runnerid, y.name, y.age]
+        return sum([xpoints[raceid] for raceid in xpoints.keys() & ypoints.keys()])
+
+    def tiekey(self, p):
+        '''
+        sort key function for a tied group, based on series tie configuration, tievalues() must be called first
+
+        head to head points are only a key when two runners are tied
+
+        :param p: Points for runner
+        :rtype: tuple of tie break values in priority order
+        '''
+        thisrunner = (p.runnerid, p.name, p.age)
+        key = []
+        for algorithm in self.seriestiealgs:
+            if algorithm == SERIES_TIE_OPTION_HEAD_TO_HEAD_POINTS:
+                other = [o for o in self.tiegroup if o is not p][0]
+                key.append(self.headtohead(p, other))
+            elif algorithm in self.avgpoints[thisrunner]:
+                key.append(self.avgpoints[thisrunner][algorithm])
+        return tuple(key)
+
+    def tiecompare(self, x, y):
+        '''
+        compare tied runners based on series tie configuration, tievalues() must be called first
+
+        :param x: Points for first runner
+        :param y: Points for second runner
+        :rtype: (cmp, algorithm), algorithm which decided the comparison is None if x and y are equal
+        '''
         # NOTE: self.seriestiealgs has been sorted by priority
         # WARNING: do not change algorithm in place as this will change standings for previous years' races
         #          rather create new algorithm here and under SERIES_TIE_OPTIONS
+        xrunner = (x.runnerid, x.name, x.age)
+        yrunner = (y.runnerid, y.name, y.age)
         for algorithm in self.seriestiealgs:
             if algorithm == SERIES_TIE_OPTION_HEAD_TO_HEAD_POINTS:
-                # determine common races for head to head comparison
-                commonraces = {rr.race for rr in self.runnerresults[x.runnerid]} & {rr.race for rr in self.runnerresults[y.runnerid]}
-                # sum genderpoints or divisionpoints as appropriate
-                xrunner = (x.runnerid, x.name, x.age)
-                xpoints = sum([self.byrunner[xrunner][rrpoints][self.racendx[r.race.id]] for r in self.runnerresults[x.runnerid] if r.race in commonraces])
-                yrunner = (y.runnerid, y.name, y.age)
-                ypoints = sum([self.byrunner[yrunner][rrpoints][self.racendx[r.race.id]] for r in self.runnerresults[y.runnerid] if r.race in commonraces])
-                
-                # only return comparision if not equal because if equal a later algorithm will be used
-                # updating explanation works because a) top tie always has no explanation, and logic runs once again through sorted list
-                if xpoints != ypoints:
-                    cmp = self.cmp(xpoints, ypoints)
-                    if cmp > 0:
-                        y.explanation = self.tieexplain[algorithm]
-                    else:
-                        x.explanation = self.tieexplain[algorithm]
-                    return cmp
-            
-            elif algorithm == SERIES_TIE_OPTION_COMPARE_AVG:
-                xresults = [self.byrunner[xrunner][rrpoints][self.racendx[r.race.id]] for r in self.runnerresults[x.runnerid]]
-                xresults.sort(reverse=True)
-                xnraces = min(self.series.maxraces, len(xresults)) if self.series.maxraces else len(xresults)
-                xpoints = mean(xresults[:xnraces])
-                yresults = [self.byrunner[yrunner][rrpoints][self.racendx[r.race.id]] for r in self.runnerresults[y.runnerid]]
-                yresults.sort(reverse=True)
-                ynraces = min(self.series.maxraces, len(yresults)) if self.series.maxraces else len(yresults)
-                ypoints = mean(yresults[:ynraces])
-
-                # only return comparision if not equal because if equal a later algorithm will be used
-                # updating explanation works because a) top tie always has no explanation, and logic runs once again through sorted list
-                if xpoints != ypoints:
-                    cmp = self.cmp(xpoints, ypoints)
-                    if cmp > 0:
-                        y.explanation = self.tieexplain[algorithm]
-                    else:
-                        x.explanation = self.tieexplain[algorithm]
-                    return cmp
-            
-            elif algorithm == SERIES_TIE_OPTION_DIV_COMPARE_OVERALL:
-                if self.division:
-                    xresults = [self.byrunner[xrunner]['bygender'][self.racendx[r.race.id]] for r in self.runnerresults[x.runnerid]]
-                    xresults.sort(reverse=True)
-                    xnraces = min(self.series.maxraces, len(xresults)) if self.series.maxraces else len(xresults)
-                    xpoints = mean(xresults[:xnraces])
-                    yresults = [self.byrunner[yrunner]['bygender'][self.racendx[r.race.id]] for r in self.runnerresults[y.runnerid]]
-                    yresults.sort(reverse=True)
-                    ynraces = min(self.series.maxraces, len(yresults)) if self.series.maxraces else len(yresults)
-                    ypoints = mean(yresults[:ynraces])
-
-                    # only return comparision if not equal because if equal a later algorithm will be used
-                    # updating explanation works because a) top tie always has no explanation, and logic runs once again through sorted list
-                    if xpoints != ypoints:
-                        cmp = self.cmp(xpoints, ypoints)
-                        if cmp > 0:
-                            y.explanation = self.tieexplain[algorithm]
-                        else:
-                            x.explanation = self.tieexplain[algorithm]
-                        return cmp
-                
+                # sum genderpoints or divisionpoints as appropriate for common races
+                xpoints = self.headtohead(x, y)
+                ypoints = self.headtohead(y, x)
+
+            elif algorithm in self.avgpoints[xrunner]:
+                xpoints = self.avgpoints[xrunner][algorithm]
+                ypoints = self.avgpoints[yrunner][algorithm]
+
+            # e.g., SERIES_TIE_OPTION_DIV_COMPARE_OVERALL for overall standings
+            else:
+                continue
+
+            # only return comparision if not equal because if equal a later algorithm will be used
+            if xpoints != ypoints:
+                return self.cmp(xpoints, ypoints), algorithm
+
+        return 0, None
+
+    def tiesort(self, x, y):
+        '''
+        sort cmp function, based on series tie configuration, which also sets explanation for the
+        lower runner, tievalues() must be called first
+        '''
+        cmp, algorithm = self.tiecompare(x, y)
+
+        # updating explanation works because a) top tie always has no explanation, and logic runs once again through sorted list
+        if cmp > 0:
+            y.explanation = self.tieexplain[algorithm]
+        elif cmp < 0:
+            x.explanation = self.tieexplain[algorithm]
+
         # these passed all algoriths, so are defined to be equal
-        y.explanation = 'tied with last'
-        y.tied = True
-        return 0
\ No newline at end of file
+        else:
+            y.explanation = 'tied with last'
+            y.tied = True
+        return cmp
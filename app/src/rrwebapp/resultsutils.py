@@ -17,12 +17,15 @@ import traceback
 from json import loads, dumps
 from datetime import timedelta
 from collections import OrderedDict
+from queue import Empty
 
 # pypi
 from flask import current_app
+from billiard import get_context
 from googlemaps import Client
 from googlemaps.geocoding import geocode
 from haversine import haversine, Unit
+from sqlalchemy import func, and_, or_, insert
 import loutilities.renderrun as render
 from loutilities.csvu import str2num
 from loutilities.timeu import age, asctime, epoch2dt, dt2epoch
@@ -78,6 +81,7 @@ DISP_NOTUSED = ''               # not used for results
 
 
 class ParameterError(Exception): pass
+class matchError(Exception): pass
 
 def race_fixeddist(distance):
     '''
@@ -210,7 +214,7 @@ def getrunnerchoices(club_id, race, pool, result):
 
     return thisrunnerchoice
 
-def filtermissed(club_id,missed,racedate,resultage):
+def filtermissed(club_id,missed,racedate,resultage,lookup=None):
     '''
     filter missed matches which are greater than a configured max age delta
     also filter missed matches which were in the exclusions table
@@ -219,6 +223,7 @@ def filtermissed(club_id,missed,racedate,resultage):
     :param missed: list of missed matches, as returned from clubmember.xxx().getmissedmatches()
     :param racedate: race date in dbdate format
     :param age: resultage from race result, if None, '', 0, empty list is returned
+    :param lookup: (optional) ImportLookup for club, to find runners and exclusions without queries
     
     :rtype: missed list, including only elements within the allowed age range
     '''
@@ -239,8 +244,12 @@ def filtermissed(club_id,missed,racedate,resultage):
             resultname = thismissed['name']
             runnername = thismissed['dbname']
             ascdob = thismissed['dob']
-            runner = Runner.query.filter_by(club_id=club_id,name=runnername,dateofbirth=ascdob).first()
-            exclusion = Exclusion.query.filter_by(club_id=club_id,foundname=resultname,runnerid=runner.id).first()
+            if lookup:
+                runner = lookup.getrunner(runnername, ascdob)
+                exclusion = lookup.isexcluded(resultname, runner.id)
+            else:
+                runner = Runner.query.filter_by(club_id=club_id,name=runnername,dateofbirth=ascdob).first()
+                exclusion = Exclusion.query.filter_by(club_id=club_id,foundname=resultname,runnerid=runner.id).first()
             if exclusion:
                 localmissed.remove(thismissed)
                 
@@ -270,6 +279,142 @@ def get_earliestrace(runner, year=None):
             theresult = result
     return theresult
 
+class DivisionAgeLookup():
+    """
+    division age index for a club's runners within a year, which replaces per runner
+    Runner queries and :func:`get_earliestrace` scans for standings and tabulation
+
+    built with a single Runner query and a single grouped query for each runner's earliest
+    result within the year, so it reflects the member and result tables at the time it is created
+
+    :param club_id: club.id
+    :param year: year of races
+    """
+    def __init__(self, club_id, year):
+        self.club_id = club_id
+        self.year = int(year)
+        yearstart = datetime(self.year, 1, 1)
+
+        # earliest race date within the year for each runner, and the age recorded for that result
+        earliest = db.session.query(
+                ManagedResult.runnerid.label('runnerid'), func.min(Race.date).label('date')
+            ).join(Race, Race.id == ManagedResult.raceid
+            ).filter(ManagedResult.club_id == club_id, ManagedResult.runnerid != None,
+                     Race.date >= '{}-01-01'.format(self.year), Race.date <= '{}-12-31'.format(self.year)
+            ).group_by(ManagedResult.runnerid
+            ).subquery()
+        earlyresults = db.session.query(
+                earliest.c.runnerid, earliest.c.date, ManagedResult.age
+            ).join(ManagedResult, ManagedResult.runnerid == earliest.c.runnerid
+            ).join(Race, and_(Race.id == ManagedResult.raceid, Race.date == earliest.c.date)
+            ).all()
+        earlyresult = {runnerid: (dbdate.asc2dt(date), resultage) for runnerid, date, resultage in earlyresults}
+
+        self.divages = {}
+        self.standingsages = {}
+        runners = db.session.query(Runner.id, Runner.dateofbirth, Runner.estdateofbirth).filter_by(club_id=club_id).all()
+        for runnerid, dateofbirth, estdateofbirth in runners:
+            try:
+                dob = dbdate.asc2dt(dateofbirth) if dateofbirth else None
+            except ValueError:
+                dob = None      # should not really happen, but this runner does not get division placement
+            divdate, resultage = earlyresult.get(runnerid, (None, None))
+
+            # if we know dob, date for division's age calculation is Jan 1 of the year
+            if dob and not estdateofbirth:
+                thisage = age(yearstart, dob)
+                self.divages[runnerid] = thisage
+                self.standingsages[runnerid] = thisage
+
+            # if we have estimated dob, date for division's age calculation is earliest race run this year by this runner
+            # TODO: this doesn't quite seem right -- we want to emulate Jan 1, but don't know the real dob 
+            # -- should we be looking at earliest race in *any* year?
+            elif dob:
+                if divdate:
+                    thisage = age(divdate, dob)
+                    self.divages[runnerid] = thisage
+                    self.standingsages[runnerid] = thisage
+
+            # no dob, so no division, but for standings estimate birth date from age in earliest race this year
+            # this assumes previously recorded age was correct, probably ok for most series
+            elif divdate and resultage is not None:
+                dobdt = datetime(divdate.year-resultage, divdate.month, divdate.day)
+                self.standingsages[runnerid] = age(divdate, dobdt)
+
+    def divisionage(self, runnerid):
+        """
+        returns age used to determine runner's division, or None if runner is not eligible for division placement
+        """
+        return self.divages.get(runnerid)
+
+    def standingsage(self, runnerid):
+        """
+        returns age displayed for runner in standings, or None if this could not be determined
+        """
+        return self.standingsages.get(runnerid)
+
+class ImportLookup():
+    """
+    club's runners, exclusions and nonmembers' earliest results, which replace the per result
+    Runner, Exclusion and RaceResult queries made while setting dispositions for imported results
+
+    built with a single query for each, so it reflects the runner, exclusion and result tables at the
+    time it is created
+
+    :param club_id: club.id
+    """
+    def __init__(self, club_id):
+        self.club_id = club_id
+
+        # runners by (name, dateofbirth), the first of duplicates by id as query.first() would find
+        self.runners = {}
+        for runner in Runner.query.filter_by(club_id=club_id).order_by(Runner.id).all():
+            self.runners.setdefault((runner.name, runner.dateofbirth), runner)
+
+        # result names are compared without case, as the database does
+        exclusions = db.session.query(Exclusion.foundname, Exclusion.runnerid).filter_by(club_id=club_id).all()
+        self.exclusions = {(foundname.lower(), runnerid) for foundname, runnerid in exclusions if foundname}
+
+        # earliest race date for each runner without date of birth, and the age recorded for that result
+        earliest = db.session.query(
+                RaceResult.runnerid.label('runnerid'), func.min(Race.date).label('date')
+            ).join(Race, Race.id == RaceResult.raceid
+            ).join(Runner, Runner.id == RaceResult.runnerid
+            ).filter(RaceResult.club_id == club_id, or_(Runner.dateofbirth == '', Runner.dateofbirth == None)
+            ).group_by(RaceResult.runnerid
+            ).subquery()
+        earlyresults = db.session.query(
+                earliest.c.runnerid, earliest.c.date, RaceResult.agage
+            ).join(RaceResult, and_(RaceResult.runnerid == earliest.c.runnerid, RaceResult.club_id == club_id)
+            ).join(Race, and_(Race.id == RaceResult.raceid, Race.date == earliest.c.date)
+            ).order_by(RaceResult.id
+            ).all()
+        self.earlyresults = {}
+        for runnerid, date, agage in earlyresults:
+            self.earlyresults.setdefault(runnerid, (date, agage))
+
+    def getrunner(self, name, dateofbirth):
+        """
+        returns runner with name and dateofbirth, or None if not found
+        """
+        key = (name, dateofbirth)
+        # names which only match without case or trailing spaces are left to the database to find
+        if key not in self.runners:
+            self.runners[key] = Runner.query.filter_by(club_id=self.club_id, name=name, dateofbirth=dateofbirth).first()
+        return self.runners[key]
+
+    def isexcluded(self, foundname, runnerid):
+        """
+        returns True if foundname was excluded from matching runnerid
+        """
+        return bool(foundname) and (foundname.lower(), runnerid) in self.exclusions
+
+    def earlyresult(self, runnerid):
+        """
+        returns (race date, age) for runner's earliest result, or None if runner has date of birth or no results
+        """
+        return self.earlyresults.get(runnerid)
+
 def normname(name):
     """normalize name capitalization
 
@@ -302,11 +447,20 @@ class ImportResults():
     dbmetaattrs = 'initialdisposition'.split(',')   
     defaultmapping = dict(list(zip(dbattrs+dbmetaattrs,dbattrs+dbmetaattrs)))
 
+    # number of results add_dbresult() collects before inserting them
+    BATCHSIZE = 500
+    # number of results a worker process matches before sending them, see add_dbresults_parallel()
+    CHUNKSIZE = 200
+
     def __init__(self, club_id, raceid, mapping=defaultmapping):
 
         # remember what we need later
         self.club_id = club_id
 
+        # results collected by add_dbresult(), as managedresult rows
+        self.pending = []
+        self.columns = [column.key for column in ManagedResult.__table__.columns if column.key != 'id']
+
         # mapping method for each database field from input row
         self.map = MapDict(mapping)
 
@@ -318,6 +472,9 @@ class ImportResults():
         if len(self.race.series) == 0:
             raise ParameterError('Race needs to be included in at least one series to import results')
 
+        # runners, exclusions and past results needed to set dispositions, so results are matched without queries
+        self.lookup = ImportLookup(club_id)
+
         # determine candidate pool based on membersonly
         membersonly = self.race.series[0].membersonly
         if membersonly:
@@ -390,7 +547,7 @@ class ImportResults():
             runnername,ascdob = candidate
             
             # set active or inactive member's id
-            runner = Runner.query.filter_by(club_id=club_id,name=runnername,dateofbirth=ascdob).first()
+            runner = self.lookup.getrunner(runnername, ascdob)
             dbresult.runnerid = runner.id
         
             # if candidate has renewdate and did not join in time for member's only race, indicate this result isn't used
@@ -411,11 +568,11 @@ class ImportResults():
                 else:
                     # must check current result age against any previous result age
                     thisresultage = dbresult.age
-                    if thisresultage:
+                    earlyresult = self.lookup.earlyresult(runner.id)
+                    if thisresultage and earlyresult:
                         thisracedate = tYmd.asc2dt(self.race.date)
-                        pastresult = RaceResult.query.filter_by(club_id=club_id,runnerid=runner.id).first()
-                        pastresultage = pastresult.agage
-                        pastracedate = tYmd.asc2dt(pastresult.race.date)
+                        pastracedate, pastresultage = earlyresult
+                        pastracedate = tYmd.asc2dt(pastracedate)
                         
                         # make sure this result age is consistent with previous result +/- 1 year
                         deltayears = abs((thisracedate - pastracedate).days / 365.25)
@@ -429,7 +586,7 @@ class ImportResults():
                         else:
                             candidate = None
 
-                    # ignore candidates when we do not have age in result
+                    # ignore candidates when we do not have age in result, or a past result to check it against
                     else:
                         candidate = None
                         dbresult.runnerid = None
@@ -437,7 +594,7 @@ class ImportResults():
             # runner joined in time for race, or not member's only race, but match wasn't exact
             # check for exclusions
             else:
-                exclusion = Exclusion.query.filter_by(club_id=club_id,foundname=dbresult.name,runnerid=dbresult.runnerid).first()
+                exclusion = self.lookup.isexcluded(dbresult.name, dbresult.runnerid)
                 
                 # if results name not found against this runner id in exclusions table, indicate we found close match
                 if not exclusion:
@@ -461,7 +618,7 @@ class ImportResults():
             
             # don't consider 'missed matches' where age difference from result is too large, or excluded
             # current_app.logger.debug('  missed before filter = {}'.format(missed))
-            missed = filtermissed(club_id,missed,race.date,dbresult.age)
+            missed = filtermissed(club_id,missed,race.date,dbresult.age,lookup=self.lookup)
             # current_app.logger.debug('  missed after filter = {}'.format(missed))
 
             # if there remain are any missed results, indicate close age
@@ -484,14 +641,12 @@ class ImportResults():
         # this needs to be the same as what was already stored in the record
         return dbresult.initialdisposition
     
-    def update_dbresult(self, inresult, dbresult):
+    def set_dbresult(self, inresult, dbresult):
         '''
-        updates dbresult based on inresult
+        updates dbresult based on inresult, without determining runner choices
 
         :param inresult: dict-like object which has keys per mapping defined at instantiation
         :param dbresult: ManagedResult instance to be initialized or updated
-
-        :rtype: missed - list of missed matches if not exact match
         '''
 
         # convert inresult keys
@@ -504,11 +659,139 @@ class ImportResults():
         # update dbresult - this executes dbmapping function for each dbresult attribute
         self.dte.set_dbrow(thisinresult, dbresult)
 
+    def update_dbresult(self, inresult, dbresult):
+        '''
+        updates dbresult based on inresult
+
+        :param inresult: dict-like object which has keys per mapping defined at instantiation
+        :param dbresult: ManagedResult instance to be initialized or updated
+
+        :rtype: missed - list of missed matches if not exact match
+        '''
+
+        self.set_dbresult(inresult, dbresult)
+
         # return missed matches for select rendering
         runner_choices = getrunnerchoices(self.club_id, self.race, self.pool, dbresult)
 
         return runner_choices
 
+    def add_dbresult(self, inresult):
+        '''
+        create a managedresult row for inresult. Rows are inserted BATCHSIZE at a time, so
+        flush_dbresults() must be called after the last result is added
+
+        the ManagedResult isn't added to the session, so it isn't flushed by each query made while
+        matching later results, and isn't kept in the session's identity map
+
+        :param inresult: dict-like object which has keys per mapping defined at instantiation
+        '''
+        self.pending.append(self.match_dbresult(inresult))
+        if len(self.pending) >= self.BATCHSIZE:
+            self.flush_dbresults()
+
+    def match_dbresult(self, inresult):
+        '''
+        match inresult to the club's runners
+
+        :param inresult: dict-like object which has keys per mapping defined at instantiation
+        :rtype: managedresult row, {column: value, ...} without id
+        '''
+        dbresult = ManagedResult(self.club_id, self.race.id)
+        self.set_dbresult(inresult, dbresult)
+        return {column: getattr(dbresult, column) for column in self.columns}
+
+    def add_dbresults_parallel(self, inresults, processes, progress=None):
+        '''
+        match inresults in worker processes, and insert their managedresult rows in the same order
+        as add_dbresult() would. flush_dbresults() must be called afterwards
+
+        the results are partitioned among the workers, which are forked from this process so they
+        share this importer's member pool and lookups as they are, and only send back the rows. The
+        session is closed before the workers are started, so the caller must not have uncommitted changes
+
+        :param inresults: list of dict-like objects which have keys per mapping defined at instantiation
+        :param processes: number of worker processes
+        :param progress: (optional) function(current, total) called as results are matched
+        '''
+        total = len(inresults)
+        partsize = max(1, -(-total // processes))
+        parts = [inresults[i:i+partsize] for i in range(0, total, partsize)]
+
+        # workers mustn't share the session's connection
+        db.session.close()
+
+        context = get_context('fork')
+        queue = context.Queue()
+        workers = [context.Process(target=_matchresults, args=(self, queue, partno, part))
+                   for partno, part in enumerate(parts)]
+        for worker in workers:
+            worker.start()
+
+        matched = [[] for part in parts]
+        current = 0
+        numdone = 0
+        try:
+            while numdone < len(workers):
+                try:
+                    partno, rows, error = queue.get(timeout=1)
+                except Empty:
+                    for worker in workers:
+                        if worker.exitcode:
+                            raise matchError('match worker exited with {}'.format(worker.exitcode))
+                    continue
+
+                if error:
+                    raise matchError('match worker failed\n{}'.format(error))
+                if rows is None:
+                    numdone += 1
+                    continue
+
+                matched[partno] += rows
+                current += len(rows)
+                if progress:
+                    progress(current, total)
+
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+        for rows in matched:
+            self.pending += rows
+            if len(self.pending) >= self.BATCHSIZE:
+                self.flush_dbresults()
+
+    def flush_dbresults(self):
+        '''
+        insert the rows collected by add_dbresult(), with a single executemany
+        '''
+        if self.pending:
+            db.session.execute(insert(ManagedResult.__table__), self.pending)
+            self.pending = []
+
+def _matchresults(importer, queue, partno, inresults):
+    '''
+    match a partition of results in a worker process forked by ImportResults.add_dbresults_parallel()
+
+    rows are sent CHUNKSIZE at a time as (partno, rows, None), followed by (partno, None, None) when
+    done, or by (partno, None, traceback) if matching fails
+
+    :param importer: ImportResults instance
+    :param queue: queue for sending rows to the parent process
+    :param partno: index of this partition
+    :param inresults: list of dict-like objects
+    '''
+    try:
+        # connections inherited from the parent process are left to it, the worker opens its own if needed
+        db.engine.dispose(close=False)
+        for i in range(0, len(inresults), importer.CHUNKSIZE):
+            queue.put((partno, [importer.match_dbresult(inresult) for inresult in inresults[i:i+importer.CHUNKSIZE]], None))
+        queue.put((partno, None, None))
+    except Exception:
+        queue.put((partno, None, traceback.format_exc()))
+
 class StoreServiceResults():
     '''
     store results retrieved from a service, using service's file access class
@@ -0,0 +1,208 @@
+'''
+seasonarchive - snapshots of finalized seasons
+================================================
+
+standings and series results for a closed season don't change, so finalizeseason() stores them as
+compressed snapshots, which the views and the standings export serve as is rather than rendering the standings
+
+snapshots are not affected by standingscache.invalidatestandings(), if a finalized season needs to be
+corrected, reopenseason() removes its snapshots
+'''
+
+# standard
+import zlib
+from datetime import datetime
+from json import dumps, loads
+from collections import namedtuple
+
+# home grown
+from .model import db, Race, RaceSeries, Series, StandingsArchive, SeriesResultsArchive
+from .renderstandings import JsonStandingsHandler, XlsxStandingsHandler
+from .standingscache import renderstandings, seriesraces, seriesresultsrows, slicestandings, GENDERS
+
+# race fields used by the views, in place of Race
+ArchivedRace = namedtuple('ArchivedRace', ['id', 'name', 'date'])
+
+#----------------------------------------------------------------------
+def compress(data):
+#----------------------------------------------------------------------
+    '''
+    compress json serializable data for a snapshot
+
+    :param data: json serializable data
+    :rtype: bytes
+    '''
+    return zlib.compress(dumps(data).encode())
+
+#----------------------------------------------------------------------
+def decompress(snapshot):
+#----------------------------------------------------------------------
+    '''
+    decompress snapshot created by compress()
+
+    :param snapshot: bytes
+    :rtype: data
+    '''
+    return loads(zlib.decompress(snapshot).decode())
+
+########################################################################
+class StandingsSnapshot():
+########################################################################
+    '''
+    standings snapshot for a series of a finalized season
+
+    :param archive: StandingsArchive instance
+    '''
+    #----------------------------------------------------------------------
+    def __init__(self, archive):
+    #----------------------------------------------------------------------
+        self.archived_at = archive.archived_at
+        data = decompress(archive.snapshot)
+        self.races = [ArchivedRace(*race) for race in data['races']]
+        self.bydivision = data['standings']
+        self.json = data['json']
+        self.xlsx = data['xlsx']
+
+    #----------------------------------------------------------------------
+    def standings(self, gender=None, division=None):
+    #----------------------------------------------------------------------
+        '''
+        standings rows, sliced as standingscache.getstandings() does
+
+        :param gender: (optional) only return standings for this gender
+        :param division: (optional) only return standings for this division
+        :rtype: {'F': [pline, ...], 'M': [pline, ...], 'X': [pline, ...]}, plines as from HtmlStandingsHandler.iter()
+        '''
+        return slicestandings(self.bydivision, gender, division)
+
+    #----------------------------------------------------------------------
+    def jsonrows(self, genders, division=None):
+    #----------------------------------------------------------------------
+        '''
+        standings rows as rendered by JsonStandingsHandler
+
+        :param genders: list of genders to return
+        :param division: (optional) only return rows for this division
+        :rtype: [row, ...]
+        '''
+        return [row for gen in genders for row in self.json[gen] if not division or row['division'] == division]
+
+    #----------------------------------------------------------------------
+    def writexlsx(self, fh):
+    #----------------------------------------------------------------------
+        '''
+        write the worksheets as rendered by XlsxStandingsHandler
+
+        :param fh: XlsxStandingsHandler
+        '''
+        for gen, sheet in self.xlsx.items():
+            fh.writesheet(gen, sheet)
+
+#----------------------------------------------------------------------
+def getstandingssnapshot(club_id, series):
+#----------------------------------------------------------------------
+    '''
+    get the standings snapshot for a series, if its season has been finalized
+
+    :param club_id: club.id
+    :param series: Series instance
+    :rtype: StandingsSnapshot, or None if series isn't archived
+    '''
+    archive = StandingsArchive.query.filter_by(club_id=club_id, seriesid=series.id).one_or_none()
+    return StandingsSnapshot(archive) if archive else None
+
+#----------------------------------------------------------------------
+def getseriesresultssnapshot(club_id, race):
+#----------------------------------------------------------------------
+    '''
+    get the series results snapshot for a race, if its season has been finalized
+
+    :param club_id: club.id
+    :param race: Race instance
+    :rtype: (rows as from standingscache.seriesresultsrows(), archived_at), or None if race isn't archived
+    '''
+    archive = SeriesResultsArchive.query.filter_by(club_id=club_id, raceid=race.id).one_or_none()
+    return (decompress(archive.snapshot), archive.archived_at) if archive else None
+
+#----------------------------------------------------------------------
+def untabulatedraces(club_id, year):
+#----------------------------------------------------------------------
+    '''
+    get the races of the club's active series for the year which have no series results, which would be
+    left out of the snapshots if the season were finalized
+
+    :param club_id: club.id
+    :param year: year of season
+    :rtype: [Race, ...] in date order
+    '''
+    return (Race.query
+            .join(RaceSeries, RaceSeries.raceid == Race.id)
+            .join(Series, Series.id == RaceSeries.seriesid)
+            .filter(Series.club_id == club_id, Series.year == int(year), Series.active == True, ~Race.results.any())
+            .order_by(Race.date)
+            .distinct()
+            .all())
+
+#----------------------------------------------------------------------
+def finalizeseason(club_id, year):
+#----------------------------------------------------------------------
+    '''
+    store snapshots of the standings of the club's active series for the year, and of the series
+    results of their races. Snapshots which were already stored are kept as is
+
+    caller is responsible for committing the session. HtmlStandingsHandler links runner names with
+    url_for(), so outside of a request a request context is needed
+
+    :param club_id: club.id
+    :param year: year of season
+    :rtype: number of series snapshots stored
+    '''
+    year = int(year)
+    archived_at = datetime.now()
+    archivedseries = {a.seriesid for a in StandingsArchive.query.filter_by(club_id=club_id, year=year).all()}
+    archivedraces = {a.raceid for a in SeriesResultsArchive.query.filter_by(club_id=club_id, year=year).all()}
+
+    numseries = 0
+    for series in Series.query.filter_by(club_id=club_id, year=year, active=True).all():
+        races, racenums = seriesraces(series)
+
+        if series.id not in archivedseries:
+            # the json and xlsx renderings use the standings collected for the html rendering
+            fh, columns = renderstandings(club_id, year, series, races, racenums)
+            jsonfh, columns = renderstandings(club_id, year, series, races, racenums, columns=columns,
+                                              fh=JsonStandingsHandler())
+            xlsxfh = XlsxStandingsHandler(record=True)
+            xlsxfh.setraces(races, racenums)
+            xlsxfh, columns = renderstandings(club_id, year, series, races, racenums, columns=columns, fh=xlsxfh)
+            snapshot = {
+                'races': [[race.id, race.name, race.date] for race in races],
+                'standings': fh.bydivision,
+                'json': {gen:list(jsonfh.iter(gen)) for gen in GENDERS},
+                'xlsx': xlsxfh.sheets,
+            }
+            db.session.add(StandingsArchive(club_id=club_id, seriesid=series.id, year=year,
+                                            snapshot=compress(snapshot), archived_at=archived_at))
+            numseries += 1
+
+        for race in races:
+            if race.id in archivedraces: continue
+            db.session.add(SeriesResultsArchive(club_id=club_id, raceid=race.id, year=year,
+                                                snapshot=compress(seriesresultsrows(race)), archived_at=archived_at))
+            archivedraces.add(race.id)
+
+    return numseries
+
+#----------------------------------------------------------------------
+def reopenseason(club_id, year):
+#----------------------------------------------------------------------
+    '''
+    remove the snapshots for a finalized season, so standings and series results are rendered again
+
+    caller is responsible for committing the session
+
+    :param club_id: club.id
+    :param year: year of season
+    :rtype: number of series snapshots removed
+    '''
+    SeriesResultsArchive.query.filter_by(club_id=club_id, year=int(year)).delete()
+    return StandingsArchive.query.filter_by(club_id=club_id, year=int(year)).delete()
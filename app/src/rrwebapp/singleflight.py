@@ -0,0 +1,139 @@
+'''
+singleflight - coalesce concurrent identical computations
+===========================================================
+
+while a computation is in progress, identical requests wait for it and share its result rather than
+computing it again
+
+within a process, waiting threads get a copy of the leader's result. Optionally a lock file per key is
+also used, in which case the leader writes its result next to the lock file before releasing the lock,
+and processes which waited for the lock read the result from there
+'''
+
+# standard
+import os
+import os.path
+import fcntl
+import time
+import copy
+from json import dumps, loads
+from hashlib import sha1
+from threading import Lock, Event
+
+########################################################################
+class Flight():
+########################################################################
+    '''
+    computation in progress within this process, see SingleFlight
+    '''
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+########################################################################
+class SingleFlight():
+########################################################################
+    '''
+    coalesce concurrent computations with the same key
+
+    :param lockdir: (optional) directory for lock files, to also coalesce across processes, results
+        must be json serializable
+    :param timeout: (optional) seconds to wait for another computation, after which the result is computed
+        without waiting further
+    '''
+    # interval for polling the lock file
+    POLL = 0.05
+
+    #----------------------------------------------------------------------
+    def __init__(self, lockdir=None, timeout=60):
+    #----------------------------------------------------------------------
+        self.lockdir = lockdir
+        self.timeout = timeout
+        self.lock = Lock()
+        self.flights = {}
+
+    #----------------------------------------------------------------------
+    def do(self, key, fn):
+    #----------------------------------------------------------------------
+        '''
+        return fn(), or a copy of the result of the identical computation already in progress
+
+        if fn() raises an exception, the threads waiting for it raise the same exception
+
+        :param key: hashable key identifying the computation
+        :param fn: function() which computes the result
+        :rtype: result of fn()
+        '''
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if not leader:
+            if flight.done.wait(self.timeout):
+                if flight.error:
+                    raise flight.error
+                return copy.deepcopy(flight.result)
+            return fn()
+
+        try:
+            if self.lockdir:
+                flight.result = self.dolocked(key, fn)
+            else:
+                flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    #----------------------------------------------------------------------
+    def dolocked(self, key, fn):
+    #----------------------------------------------------------------------
+        '''
+        return fn() while holding the lock file for key, or the result another process wrote while this
+        process waited for the lock
+
+        :param key: key identifying the computation, its repr() names the lock file
+        :param fn: function() which computes the result
+        :rtype: result of fn()
+        '''
+        name = os.path.join(self.lockdir, sha1(repr(key).encode()).hexdigest())
+        lockfile = open(name + '.lock', 'w')
+        try:
+            # a result written after waiting started came from the process which held the lock
+            started = time.time()
+            waited = False
+            while True:
+                try:
+                    fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.time() - started > self.timeout:
+                        return fn()
+                    waited = True
+                    time.sleep(self.POLL)
+
+            try:
+                if waited and os.path.exists(name + '.json') and os.path.getmtime(name + '.json') >= started:
+                    with open(name + '.json') as resultfile:
+                        return loads(resultfile.read())
+
+                result = fn()
+
+                # write to temporary file and rename, so readers never see a partial result
+                with open(name + '.tmp', 'w') as resultfile:
+                    resultfile.write(dumps(result))
+                os.replace(name + '.tmp', name + '.json')
+                return result
+
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+        finally:
+            lockfile.close()
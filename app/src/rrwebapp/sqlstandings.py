@@ -0,0 +1,188 @@
+'''
+sqlstandings - standings engine which computes series points in the database
+==============================================================================
+
+SqlStandingsRenderer computes each result's points, each runner's best-N race
+ranking and point totals with a single query using window functions, so the
+python side only assembles the rows and handles ties
+
+window functions require MySQL 8.0 or SQLite 3.25
+'''
+
+# pypi
+from sqlalchemy import select, func, case, literal
+
+# home grown
+from .model import db, RaceResult, Runner, ClubAffiliation
+from .renderstandings import StandingsRenderer, RaceStanding, Points, parameterError
+
+#----------------------------------------------------------------------
+def roundhalfeven(expr):
+#----------------------------------------------------------------------
+    '''
+    round sql expression as python round() does, i.e., halves are rounded to even, where the
+    database rounds halves away from zero
+
+    :param expr: sql expression to round
+    :rtype: sql expression
+    '''
+    rounded = func.round(expr)
+    return case(
+        ((rounded - expr == 0.5) & (rounded % 2 != 0), rounded - 1),
+        ((expr - rounded == 0.5) & (rounded % 2 != 0), rounded + 1),
+        else_=rounded)
+
+########################################################################
+class SqlStandingsRenderer(StandingsRenderer):
+########################################################################
+    '''
+    StandingsRenderer which computes points and best-N totals in the database
+
+    see StandingsRenderer for parameters
+    '''
+    #----------------------------------------------------------------------
+    def __init__(self,*args,**kwargs):
+    #----------------------------------------------------------------------
+        StandingsRenderer.__init__(self,*args,**kwargs)
+        # set by loadpoints(), {gen: {selector: {runnerid: (totpoints, numraces), ...}, ...}, ...}
+        self.totals = None
+
+    #----------------------------------------------------------------------
+    def pointsquery(self):
+    #----------------------------------------------------------------------
+        '''
+        build query for points, race rank by points and totals for each result in the series
+
+        :rtype: Select with columns for RaceStanding fields plus raceid, gender, genrank, divrank,
+            gentotal, genraces, divtotal, divraces
+        '''
+        byraceandgen = [RaceResult.raceid, RaceResult.gender]
+        byracegenanddiv = byraceandgen + [RaceResult.divisionlow, RaceResult.divisionhigh]
+        divpoints = literal(None)
+
+        # points for each result, see renderstandings.scoreresults()
+        if self.orderby in ['time', 'overallplace']:
+            if self.maxbynumrunners:
+                genpoints = self.multiplier * (func.count().over(partition_by=byraceandgen) + 1 - RaceResult.genderplace)
+            elif self.maxgenpoints:
+                genpoints = self.multiplier * (self.maxgenpoints + 1 - RaceResult.genderplace)
+            elif self.proportional_scoring:
+                genpoints = roundhalfeven(self.multiplier * (func.min(RaceResult.time).over(partition_by=byraceandgen) / RaceResult.time))
+            else:
+                genpoints = self.multiplier * RaceResult.genderplace
+
+            if self.bydiv:
+                if not self.proportional_scoring:
+                    divpoints = self.multiplier * (self.maxdivpoints + 1 - RaceResult.divisionplace)
+                else:
+                    divpoints = roundhalfeven(self.multiplier * (func.min(RaceResult.time).over(partition_by=byracegenanddiv) / RaceResult.time))
+                divpoints = func.coalesce(RaceResult.divisionpoints, case((divpoints < 0, 0), else_=divpoints))
+
+        elif self.orderby == 'agpercent':
+            genpoints = roundhalfeven(self.multiplier * RaceResult.agpercent)
+
+        elif self.orderby == 'agtime':
+            # agtime points always start at the number of runners in this race and gender
+            genpoints = self.multiplier * (func.count().over(partition_by=byraceandgen) + 1 - RaceResult.agtimeplace)
+
+        else:
+            raise parameterError("series '{}' results must be ordered by time, overallplace, agtime or agpercent".format(self.series.name))
+
+        # points stored at tabulation are used if available
+        genpoints = func.coalesce(RaceResult.genderpoints, case((genpoints < 0, 0), else_=genpoints))
+
+        raceids = [race.id for race in self.races]
+        points = (select(RaceResult.raceid, RaceResult.gender, RaceResult.runnerid, Runner.name, RaceResult.agage,
+                         RaceResult.divisionlow, RaceResult.divisionhigh,
+                         ClubAffiliation.shortname.label('clubshortname'), ClubAffiliation.title.label('clubtitle'),
+                         getattr(RaceResult, self.orderby).label('orderby'),
+                         genpoints.label('genpoints'), divpoints.label('divpoints'))
+                  .join(Runner, Runner.id == RaceResult.runnerid)
+                  .outerjoin(ClubAffiliation, ClubAffiliation.id == RaceResult.clubaffiliation_id)
+                  .where(RaceResult.club_id == self.club_id, RaceResult.seriesid == self.series.id,
+                         RaceResult.raceid.in_(raceids), RaceResult.gender.in_(self.genders))
+                  .subquery('points'))
+
+        # rank each runner's races by points, best first
+        byrunner = [points.c.gender, points.c.runnerid]
+        ranked = (select(points,
+                         func.row_number().over(partition_by=byrunner, order_by=points.c.genpoints.desc()).label('genrank'),
+                         func.row_number().over(partition_by=byrunner, order_by=points.c.divpoints.desc()).label('divrank'))
+                  .subquery('ranked'))
+
+        # total the best maxraces races for each runner
+        def used(rank, thesepoints):
+            if self.maxraces:
+                return case((rank <= self.maxraces, thesepoints), else_=0)
+            return func.coalesce(thesepoints, 0)
+
+        byrunner = [ranked.c.gender, ranked.c.runnerid]
+        return (select(ranked,
+                       func.sum(used(ranked.c.genrank, ranked.c.genpoints)).over(partition_by=byrunner).label('gentotal'),
+                       func.count(ranked.c.genpoints).over(partition_by=byrunner).label('genraces'),
+                       func.sum(used(ranked.c.divrank, ranked.c.divpoints)).over(partition_by=byrunner).label('divtotal'),
+                       func.count(ranked.c.divpoints).over(partition_by=byrunner).label('divraces'))
+                .order_by(ranked.c.orderby))
+
+    #----------------------------------------------------------------------
+    def loadpoints(self):
+    #----------------------------------------------------------------------
+        '''
+        load points for all the series results, setting self.columns for use by collectstandings()
+        and self.totals for use by calcpoints()
+        '''
+        racebyid = {race.id:race for race in self.races}
+        self.columns = {(gen, race.id):[] for gen in self.genders for race in self.races}
+        self.totals = {gen:{'bygender':{}, 'bydivision':{}} for gen in self.genders}
+
+        for row in db.session.execute(self.pointsquery()):
+            self.columns[row.gender, row.raceid].append(
+                RaceStanding(racebyid[row.raceid], runnerid=row.runnerid, name=row.name, agage=row.agage,
+                             divisionlow=row.divisionlow, divisionhigh=row.divisionhigh,
+                             genpoints=row.genpoints, divpoints=row.divpoints if self.bydiv else None,
+                             clubshortname=row.clubshortname, clubtitle=row.clubtitle))
+
+            for selector, total, numraces in [('bygender', row.gentotal, row.genraces),
+                                              ('bydivision', row.divtotal, row.divraces)]:
+                self.totals[row.gender][selector][row.runnerid] = (total or 0, numraces)
+
+        # results are in ascending order, reverse them for high to low series as collectrace() does
+        if self.hightolow:
+            for standings in self.columns.values():
+                standings.reverse()
+
+    #----------------------------------------------------------------------
+    def calcpoints(self, gen, byrunner, runnerpool, selector):
+    #----------------------------------------------------------------------
+        '''
+        calculate list of runner results from totals loaded by loadpoints(), sorted by (total points, numraces) (max to min)
+
+        :param gen: gender M or F
+        :param byrunner: full data structure by runner
+        :param runnerpool: pool of runners to use for this set of results
+        :param selector: selector from point to pull results, either 'bygender' or 'bydivision'
+        '''
+        bypoints = []
+        for thisrunner in runnerpool:
+            runner = byrunner[thisrunner]
+            # totals come from the database, best() determines which races are shown as dropped
+            runner.best(selector, self.maxraces)
+            totpoints, numraces = self.totals[gen][selector][runner.runnerid]
+            totpoints = int(totpoints) if totpoints == int(totpoints) else totpoints
+            # tied=False may be updated in resultsiterator.tiesort()
+            bypoints.append(Points(totpoints=totpoints, runnerid=runner.runnerid, name=runner.name, age=runner.age,
+                                   numraces=numraces, tied=False))
+
+        bypoints.sort(key=lambda i: (i.totpoints, i.numraces), reverse=True)
+        return bypoints
+
+    #----------------------------------------------------------------------
+    def renderseries(self,fh):
+    #----------------------------------------------------------------------
+        '''
+        render standings for a single series, with points computed by the database
+
+        :param fh: StandingsHandler object-like
+        '''
+        self.loadpoints()
+        StandingsRenderer.renderseries(self,fh)
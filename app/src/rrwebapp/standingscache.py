@@ -0,0 +1,482 @@
+'''
+standingscache - materialized standings for standings views
+=============================================================
+
+standings only change when results are tabulated or when series, division, club affiliation, race
+or member data is updated, so the rendered rows are stored in the standingscache table and served
+from there until invalidatestandings() is called for the affected club / year / series
+
+the standings collected for each race are also stored, in the standingscolumn table, so that when a
+single race is retabulated (see invalidaterace()) only that race is collected again before the
+series totals and ties are recalculated
+
+concurrent identical requests for standings which aren't cached wait for the first request's rendering
+rather than rendering the standings again, see standingsflight()
+
+the rendered series results for each race are similarly stored in the seriesresultscache table, and
+prewarm() renders and stores standings and series results ahead of the first view, e.g., after tabulation
+'''
+
+# standard
+from datetime import datetime
+from json import dumps, loads
+
+# pypi
+from flask import current_app
+from sqlalchemy import func
+from loutilities import renderrun
+from sqlalchemy.exc import IntegrityError
+
+# home grown
+from .model import db, StandingsCache, StandingsColumn, SeriesResultsCache
+from .model import Race, RaceSeries, Series, RaceResult, Runner
+from .renderstandings import HtmlStandingsHandler, StandingsRenderer, RaceStanding
+from .sqlstandings import SqlStandingsRenderer
+from .singleflight import SingleFlight
+from .resultsutils import clubaffiliationelement
+
+GENDERS = ['F', 'M', 'X']
+
+# division text for the column headings rendered by HtmlStandingsHandler.prepare() for each gender
+HEADINGS = 'Division'
+
+# standings engines which can be requested from getstandings()
+STANDINGS_ENGINES = {
+    'python': StandingsRenderer,
+    'sql': SqlStandingsRenderer,
+}
+
+# SingleFlight for each lock directory, see standingsflight()
+flights = {}
+
+########################################################################
+class CachingStandingsHandler(HtmlStandingsHandler):
+########################################################################
+    '''
+    HtmlStandingsHandler which also groups rendered rows by division, for storage in standingscache
+
+    :param racelist: list of race numbers in series
+    '''
+    #----------------------------------------------------------------------
+    def __init__(self,racelist):
+    #----------------------------------------------------------------------
+        HtmlStandingsHandler.__init__(self,racelist)
+        self.divtext = {gen:None for gen in GENDERS}
+        self.bydivision = {gen:[] for gen in GENDERS}     # [(divtext, [pline, ...]), ...]
+
+    #----------------------------------------------------------------------
+    def setdivision(self,gen,division,stylename='division'):
+    #----------------------------------------------------------------------
+        '''
+        put value in 'division' column for output, remembering the unstyled division text
+
+        :param gen: gender M or F
+        :param division: value for division column
+        :param stylename: name of style for field display
+        '''
+        HtmlStandingsHandler.setdivision(self,gen,division,stylename)
+        self.divtext[gen] = str(division)
+
+    #----------------------------------------------------------------------
+    def render(self,gen):
+    #----------------------------------------------------------------------
+        '''
+        output current line to gender file, and to the current division group
+
+        :param gen: gender M or F
+        '''
+        pline = self.pline[gen]
+        HtmlStandingsHandler.render(self,gen)
+
+        groups = self.bydivision[gen]
+        if not groups or groups[-1][0] != self.divtext[gen]:
+            groups.append((self.divtext[gen], []))
+        groups[-1][1].append(pline)
+
+#----------------------------------------------------------------------
+def loadcolumns(club_id, series, races):
+#----------------------------------------------------------------------
+    '''
+    load the stored standings columns for a series
+
+    :param club_id: club.id
+    :param series: Series instance
+    :param races: list of Race instances for series
+    :rtype: {(gen, raceid): [RaceStanding, ...], ...}
+    '''
+    racebyid = {race.id:race for race in races}
+    columns = {}
+    for column in StandingsColumn.query.filter_by(club_id=club_id, seriesid=series.id).all():
+        # ignore races which are no longer in the series
+        if column.raceid not in racebyid:
+            continue
+        race = racebyid[column.raceid]
+        columns[column.gender, column.raceid] = [RaceStanding.fromdict(race, d) for d in loads(column.standings)]
+    return columns
+
+#----------------------------------------------------------------------
+def renderstandings(club_id, year, series, races, racenums, columns=None, engine='python', genders=None, division=None,
+                    fh=None):
+#----------------------------------------------------------------------
+    '''
+    render standings rows for a series
+
+    :param club_id: club.id
+    :param year: year of standings
+    :param series: Series instance
+    :param races: list of Race instances for series, in date order
+    :param racenums: list of race numbers, same order as races
+    :param columns: (optional) previously collected standings, see StandingsRenderer
+    :param engine: (optional) key of STANDINGS_ENGINES used to render the standings
+    :param genders: (optional) list of genders to render, default all
+    :param division: (optional) only render this division, see StandingsRenderer
+    :param fh: (optional) StandingsHandler object-like to render to, default CachingStandingsHandler
+    :rtype: fh, {(gen, raceid): [RaceStanding, ...], ...}
+    '''
+    rr = STANDINGS_ENGINES[engine](club_id, year, series, races, racenums, bulkload=True, columns=columns,
+                                   genders=genders, division=division)
+    if fh is None:
+        fh = CachingStandingsHandler(racenums)
+    rr.renderseries(fh)
+    return fh, rr.columns
+
+#----------------------------------------------------------------------
+def standingsrows(fh, genders):
+#----------------------------------------------------------------------
+    '''
+    rendered standings rows by gender, empty for genders which weren't rendered
+
+    :param fh: CachingStandingsHandler which has been rendered
+    :param genders: list of genders which were rendered
+    :rtype: {'F': [pline, ...], 'M': [pline, ...], 'X': [pline, ...]}
+    '''
+    return {gen:list(fh.iter(gen)) if gen in genders else [] for gen in GENDERS}
+
+#----------------------------------------------------------------------
+def slicestandings(bydivision, gender=None, division=None):
+#----------------------------------------------------------------------
+    '''
+    standings rows by gender for a slice of the standings
+
+    :param bydivision: {gen: [(divtext, [pline, ...]), ...], ...} as from CachingStandingsHandler.bydivision
+    :param gender: (optional) only return standings for this gender
+    :param division: (optional) only return standings for this division
+    :rtype: {'F': [pline, ...], 'M': [pline, ...], 'X': [pline, ...]}
+    '''
+    standings = {gen:[] for gen in GENDERS}
+    for gen in GENDERS:
+        if gender and gen != gender: continue
+        for divtext, plines in bydivision[gen]:
+            # column headings are needed with a division
+            if division and divtext not in [HEADINGS, division]: continue
+            standings[gen] += plines
+    return standings
+
+#----------------------------------------------------------------------
+def standingsflight():
+#----------------------------------------------------------------------
+    '''
+    SingleFlight used to coalesce standings rendering
+
+    renders are coalesced across threads, and across processes if STANDINGS_SINGLEFLIGHT_LOCKDIR is
+    configured, STANDINGS_SINGLEFLIGHT_TIMEOUT is the maximum seconds to wait for another render
+
+    :rtype: SingleFlight
+    '''
+    lockdir = current_app.config.get('STANDINGS_SINGLEFLIGHT_LOCKDIR')
+    return flights.setdefault(lockdir, SingleFlight(lockdir=lockdir,
+                                                    timeout=current_app.config.get('STANDINGS_SINGLEFLIGHT_TIMEOUT', 60)))
+
+#----------------------------------------------------------------------
+def getstandings(club_id, year, series, races, racenums, verify=False, engine=None, gender=None, division=None):
+#----------------------------------------------------------------------
+    '''
+    get rendered standings rows for a series, from standingscache if available, otherwise
+    render the standings, using any stored standings columns, and store them in standingscache
+
+    if gender or division is requested, only that slice of the standings is returned. If the standings
+    aren't cached the full standings are still rendered and stored, and the slice is taken from them
+
+    while standings are being rendered, identical requests wait for them rather than rendering them
+    again, see standingsflight()
+
+    caller is responsible for committing the session
+
+    :param club_id: club.id
+    :param year: year of standings
+    :param series: Series instance
+    :param races: list of Race instances for series, in date order
+    :param racenums: list of race numbers, same order as races
+    :param verify: (optional) if True, standings rendered from stored columns are compared against a
+        full rebuild, and the full rebuild is used if they differ
+    :param engine: (optional) key of STANDINGS_ENGINES, if supplied the standings are rendered by this
+        engine without using or updating standingscache, for comparison between engines
+    :param gender: (optional) only return standings for this gender
+    :param division: (optional) only return standings for this division, OVERALL or division text as
+        rendered in the division column, e.g., '40 to 49'
+    :rtype: {'F': [pline, ...], 'M': [pline, ...], 'X': [pline, ...]}, plines as from HtmlStandingsHandler.iter()
+    '''
+    year = int(year)
+    if engine:
+        genders = [gender] if gender else GENDERS
+        fh, columns = renderstandings(club_id, year, series, races, racenums, engine=engine, genders=genders, division=division)
+        return standingsrows(fh, genders)
+
+    query = StandingsCache.query.filter_by(club_id=club_id, seriesid=series.id, year=year)
+    if gender:
+        query = query.filter_by(gender=gender)
+    # column headings are needed with a division
+    if division:
+        query = query.filter(StandingsCache.division.in_([HEADINGS, division]))
+    cached = query.order_by(StandingsCache.gender, StandingsCache.position).all()
+    if cached:
+        standings = {gen:[] for gen in GENDERS}
+        for entry in cached:
+            standings[entry.gender] += loads(entry.rows)
+        return standings
+
+    # render the full standings, storing them in standingscache, so every slice is served by one render
+    def render():
+        storedcolumns = loadcolumns(club_id, series, races)
+        fh, columns = renderstandings(club_id, year, series, races, racenums, columns=dict(storedcolumns))
+
+        if verify and storedcolumns:
+            fullfh, columns = renderstandings(club_id, year, series, races, racenums)
+            if fullfh.bydivision != fh.bydivision:
+                current_app.logger.error(f'standings from stored columns differ from full rebuild: club_id={club_id} '
+                                         f'series={series.name} year={year}, using full rebuild')
+                fh = fullfh
+                storedcolumns = {}
+                StandingsColumn.query.filter_by(club_id=club_id, seriesid=series.id).delete()
+
+        # another request may have stored the same standings concurrently, in which case theirs are kept
+        cached_at = datetime.now()
+        try:
+            with db.session.begin_nested():
+                for gen in GENDERS:
+                    for position, (divtext, plines) in enumerate(fh.bydivision[gen]):
+                        db.session.add(StandingsCache(club_id=club_id, seriesid=series.id, year=year, gender=gen,
+                                                      division=divtext, position=position, rows=dumps(plines),
+                                                      cached_at=cached_at))
+                for (gen, raceid), standings in columns.items():
+                    if (gen, raceid) in storedcolumns: continue
+                    db.session.add(StandingsColumn(club_id=club_id, seriesid=series.id, raceid=raceid, year=year,
+                                                   gender=gen, standings=dumps([s.asdict() for s in standings])))
+        except IntegrityError:
+            pass
+
+        return fh.bydivision
+
+    bydivision = standingsflight().do((club_id, series.id, year, verify), render)
+    return slicestandings(bydivision, gender, division)
+
+#----------------------------------------------------------------------
+def standingsversion(club_id, year, series, races, racenums):
+#----------------------------------------------------------------------
+    '''
+    get the time the series standings were stored in standingscache, rendering and storing them if
+    they aren't cached
+
+    standingscache is cleared whenever results are tabulated or anything else which affects the
+    standings is changed, so the version only changes when the standings may have changed
+
+    if the rendering was coalesced with another request's (see standingsflight()), or another request
+    stored the standings first, the stored standings may not be visible to this session yet. The current
+    time is used in that case, which doesn't match any earlier version
+
+    caller is responsible for committing the session
+
+    :param club_id: club.id
+    :param year: year of standings
+    :param series: Series instance
+    :param races: list of Race instances for series, in date order
+    :param racenums: list of race numbers, same order as races
+    :rtype: datetime
+    '''
+    year = int(year)
+    query = (db.session.query(func.max(StandingsCache.cached_at))
+             .filter_by(club_id=club_id, seriesid=series.id, year=year))
+    version = query.scalar()
+    if version is None:
+        getstandings(club_id, year, series, races, racenums)
+        version = query.scalar() or datetime.now()
+    return version
+
+#----------------------------------------------------------------------
+def seriesraces(series):
+#----------------------------------------------------------------------
+    '''
+    races for a series, as used for the standings
+
+    :param series: Series instance
+    :rtype: [Race, ...] in date order, [racenum, ...] in same order
+    '''
+    races = Race.query.join(RaceSeries).join(Series).filter(Series.id==series.id,Series.active==True).order_by(Race.date).all()
+    return races, list(range(1,len(races)+1))
+
+#----------------------------------------------------------------------
+def seriesresultsrows(race):
+#----------------------------------------------------------------------
+    '''
+    render series results rows for a race
+
+    :param race: Race instance
+    :rtype: [[result, seriesname, place, name, time, division, club, agtime, pace], ...] where result is
+        {'gender', 'agage', 'divisionplace', 'agpercent'}, in the order expected by seriesresults.html
+    '''
+    # determine precision for rendered output
+    timeprecision,agtimeprecision = renderrun.getprecision(race.distance,surface=race.surface)
+
+    # get all the results, ordered for each series
+    results = []
+    for series in race.series:
+        seriesresults = RaceResult.query.filter_by(raceid=race.id,seriesid=series.id).order_by(series.orderby).all()
+        # this is easier, code-wise, than using sqlalchemy desc() function
+        if series.hightolow:
+            seriesresults.reverse()
+        results += [(series, result) for result in seriesresults]
+
+    names = {runner.id:runner.name for runner in
+             Runner.query.filter(Runner.id.in_({result.runnerid for series, result in results})).all()}
+
+    rows = []
+    for series, result in results:
+        thistime = renderrun.rendertime(result.time,timeprecision)
+        thisagtime = renderrun.rendertime(result.agtime,agtimeprecision)
+        thispace = renderrun.rendertime(result.time / race.distance, 0, useceiling=False)
+        if not result.divisionlow and not result.divisionhigh:
+            thisdiv=''
+        elif not result.divisionlow or result.divisionlow <= 1:
+            thisdiv = '{} and under'.format(result.divisionhigh)
+        elif result.divisionhigh == 99 or not result.divisionhigh:
+            thisdiv = '{} and up'.format(result.divisionlow)
+        else:
+            thisdiv = '{} - {}'.format(result.divisionlow,result.divisionhigh)
+
+        clubaffiliation = clubaffiliationelement(result)
+        clubaffiliation = clubaffiliation.render() if clubaffiliation else ''
+
+        if result.genderplace:
+            thisplace = result.genderplace
+        elif result.agtimeplace:
+            thisplace = result.agtimeplace
+        else:
+            thisplace = None
+
+        thisresult = {'gender': result.gender, 'agage': result.agage, 'divisionplace': result.divisionplace,
+                      'agpercent': result.agpercent}
+        rows.append([thisresult,series.name,thisplace,names[result.runnerid],thistime,thisdiv,clubaffiliation,thisagtime,thispace])
+
+    return rows
+
+#----------------------------------------------------------------------
+def getseriesresults(club_id, race):
+#----------------------------------------------------------------------
+    '''
+    get rendered series results rows for a race, from seriesresultscache if available, otherwise
+    render and store them
+
+    caller is responsible for committing the session
+
+    :param club_id: club.id
+    :param race: Race instance
+    :rtype: rows as from seriesresultsrows()
+    '''
+    cached = SeriesResultsCache.query.filter_by(club_id=club_id, raceid=race.id).one_or_none()
+    if cached:
+        return loads(cached.rows)
+
+    rows = seriesresultsrows(race)
+
+    # another request may have stored the same results concurrently, in which case theirs are kept
+    try:
+        with db.session.begin_nested():
+            db.session.add(SeriesResultsCache(club_id=club_id, raceid=race.id, year=race.year, rows=dumps(rows),
+                                              cached_at=datetime.now()))
+    except IntegrityError:
+        pass
+
+    return rows
+
+#----------------------------------------------------------------------
+def prewarm(club_id, race=None, year=None):
+#----------------------------------------------------------------------
+    '''
+    render and store the standings and series results which aren't already cached, so the public
+    views are served from the caches
+
+    caller is responsible for committing the session. HtmlStandingsHandler links runner names with
+    url_for(), so outside of a request a request context is needed
+
+    :param club_id: club.id
+    :param race: (optional) prewarm this race's series results and the standings of the race's series
+    :param year: (optional) prewarm the standings of the club's active series for the year, and the
+        series results of their races
+    :rtype: number of series prewarmed
+    '''
+    if race:
+        allseries = [series for series in race.series if series.active]
+    else:
+        allseries = Series.query.filter_by(club_id=club_id, year=int(year), active=True).all()
+
+    prewarmed = set()
+    for series in allseries:
+        races, racenums = seriesraces(series)
+        getstandings(club_id, series.year, series, races, racenums)
+        for thisrace in races if not race else [race]:
+            if thisrace.id in prewarmed: continue
+            getseriesresults(club_id, thisrace)
+            prewarmed.add(thisrace.id)
+
+    return len(allseries)
+
+#----------------------------------------------------------------------
+def invalidatestandings(club_id, year=None, seriesid=None):
+#----------------------------------------------------------------------
+    '''
+    remove cached standings, standings columns and series results affected by a change, so they get
+    collected and rendered again on next view
+
+    caller is responsible for committing the session
+
+    :param club_id: club.id
+    :param year: (optional) limit to this year
+    :param seriesid: (optional) limit to this series.id
+    :rtype: number of standingscache rows deleted
+    '''
+    # series results are displayed for all of a race's series, so a race's are removed if any of its series is affected
+    query = SeriesResultsCache.query.filter_by(club_id=club_id)
+    if year:
+        query = query.filter_by(year=int(year))
+    if seriesid:
+        query = query.filter(SeriesResultsCache.raceid.in_(db.session.query(RaceSeries.raceid).filter_by(seriesid=seriesid)))
+    query.delete(synchronize_session=False)
+
+    for model in [StandingsColumn, StandingsCache]:
+        query = model.query.filter_by(club_id=club_id)
+        if year:
+            query = query.filter_by(year=int(year))
+        if seriesid:
+            query = query.filter_by(seriesid=seriesid)
+        numdeleted = query.delete()
+    return numdeleted
+
+#----------------------------------------------------------------------
+def invalidaterace(club_id, race):
+#----------------------------------------------------------------------
+    '''
+    remove cached standings and series results affected by a change to a race's results, keeping the
+    standings columns for the other races in the race's series
+
+    caller is responsible for committing the session
+
+    :param club_id: club.id
+    :param race: Race instance
+    :rtype: number of standingscache rows deleted
+    '''
+    StandingsColumn.query.filter_by(club_id=club_id, raceid=race.id).delete()
+    SeriesResultsCache.query.filter_by(club_id=club_id, raceid=race.id).delete()
+    numdeleted = 0
+    for series in race.series:
+        numdeleted += StandingsCache.query.filter_by(club_id=club_id, seriesid=series.id).delete()
+    return numdeleted
@@ -526,7 +526,7 @@
                             click: function() {
                                 $( this ).dialog('destroy');
                             }
-                        },{ text:  'Overwrite',
+                        },{ text:  data.confirmbutton || 'Overwrite',
                             click: function(){
                                 ajax_update_db_noform(url,addparms,sel,true,callback,showprogress);
                                 $( this ).dialog('destroy');
@@ -696,29 +696,33 @@
         });
     }
 
+    function ajax_start_progress(data) {
+        // show we're doing something and start updating progress of background task
+        // data is response from request which started the task
+        $('#progressbar-container').after('<div id="progressbar"><div class="progress-label">Initializing...</div></div>');
+        var status_url = data.location;
+        var current = data.current;
+        var total = data.total;
+        var percent = current * 100 / total;
+        var progressbar = $('#progressbar'),
+            progressLabel = $('.progress-label');
+        progressbar.progressbar({
+            value: percent,
+            // progressLabel needs style - see https://jqueryui.com/progressbar/#label
+            change: function () {
+                progressLabel.text( progressbar.progressbar( 'value') + '%' )
+            },
+            complete: function () {
+                progressLabel.text( 'Complete!' )
+            }
+        });
+        ajax_update_progress(status_url, progressbar);
+    }
+
     function ajax_import_file_background_resp(urlpath,formsel,data) {
         window.console && console.log(data);
         if (data.success) {
-
-            // show we're doing something and start updating progress
-            $('#progressbar-container').after('<div id="progressbar"><div class="progress-label">Initializing...</div></div>');
-            var status_url = data.location;
-            var current = data.current;
-            var total = data.total;
-            var percent = current * 100 / total;
-            var progressbar = $('#progressbar'),
-                progressLabel = $('.progress-label');
-            progressbar.progressbar({
-                value: percent,
-                // progressLabel needs style - see https://jqueryui.com/progressbar/#label
-                change: function () {
-                    progressLabel.text( progressbar.progressbar( 'value') + '%' )
-                },
-                complete: function () {
-                    progressLabel.text( 'Complete!' )
-                }
-            });
-            ajax_update_progress(status_url, progressbar);
+            ajax_start_progress(data);
         } else {
             window.console && console.log('FAILURE: ' + data.cause);
             // if overwrite requested, force the overwrite
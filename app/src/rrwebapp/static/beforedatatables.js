@@ -344,6 +344,39 @@ var series_copy_button = function(url) {
     return series_copy_saeditor.edit_button_hook(url);
 }
 
+// retabulate the races of the selected series, or of all the series if none is selected, in the background
+// also see RaceResults.ajax_start_progress()
+var series_retabulate_button = function(url) {
+    return function(e, dt, node, config) {
+        var rows = dt.rows({selected: true}).data();
+        var addparms = rows.length == 1 ? {seriesid: rows[0].rowid} : {};
+        ajax_update_db_noform(url, addparms, node, false, function(sel, data) {
+            ajax_start_progress(data);
+        });
+    }
+}
+
+// finalize the season, or reopen it if reopen is true, after the user confirms
+// also see AjaxFinalizeSeason
+var series_finalize_button = function(url, reopen) {
+    return function(e, dt, node, config) {
+        var addparms = reopen ? {reopen: true} : {};
+        ajax_update_db_noform(url, addparms, node, false, function(sel, data) {
+            $("<div>" + data.numseries + " series " + (reopen ? "reopened" : "finalized") + "</div>").dialog({
+                dialogClass: 'no-titlebar',
+                height: "auto",
+                buttons: [
+                    {   text:  'OK',
+                        click: function(){
+                            $( this ).dialog('destroy');
+                        }
+                    }
+                ],
+            });
+        });
+    }
+}
+
 // render upload filename upon upload complete
 // return anonymous function as this gets eval'd at initialization
 function renderfileid() {
@@ -31,13 +31,18 @@ function editparticipants(raceid, readallowed, writeallowed, membersonly) {
                 event.preventDefault();
                 $(this).button('disable');
                 url = $('#_rrwebapp-button-tabulate').attr('_rrwebapp-tabulate-url')
-                ajax_update_db_noform(url,{},'#_rrwebapp-button-tabulate',false)
+                // tabulation runs in the background, poll for its progress
+                ajax_update_db_noform(url,{},'#_rrwebapp-button-tabulate',false,
+                    function(sel, data) {
+                        ajax_start_progress(data);
+                    });
             });
 
-        // re-enable the tabulate button once its request completes; success redirects away
-        // from this page, so this mainly re-enables after a failure or overwrite-confirmation
+        // re-enable the tabulate button if its request fails or needs overwrite-confirmation; once the
+        // tabulation has started, the page is redirected or reloaded when it completes
         $(document).on('ajaxComplete', function(event, xhr, settings) {
-            if (settings.url && settings.url.indexOf('_tabulateresults') !== -1) {
+            if (settings.url && settings.url.indexOf('_tabulateresults') !== -1
+                    && !(xhr.responseJSON && xhr.responseJSON.success)) {
                 $('#_rrwebapp-button-tabulate').button('enable');
             }
         });
@@ -0,0 +1,429 @@
+'''
+tabulation - tabulate a race's results into series results
+=============================================================
+
+a race's managed results, i.e., the imported results matched to runners, are tabulated into a RaceResult
+for each of the race's series, with age grade, division, places and points set
+
+results are built and placed in memory, then inserted in bulk. For large races this still takes a while,
+so tasks.tabulateresultstask runs it in the background, reporting progress as it goes
+
+when series options or divisions change, tasks.retabulateresults() retabulates all the races from
+retabulationraces() in parallel
+'''
+
+# standard
+from bisect import bisect_right
+from collections import namedtuple
+
+# pypi
+from flask import current_app
+from sqlalchemy import insert, select
+from sqlalchemy.orm import selectinload
+from dominate.tags import div, p, ul, li
+import loutilities.renderrun as render
+from loutilities import timeu
+from loutilities.agegrade import AgeGrade
+
+# home grown
+from .model import db, dbdate
+from .model import Runner, ManagedResult, RaceResult, Club, AgeGradeTable, AgeGradeCategory
+from .model import Race, RaceSeries, Series
+from .model import SERIES_OPTION_REQUIRES_CLUB, SERIES_OPTION_DISPLAY_CLUB
+from .settings import productname
+from .resultsutils import ClubAffiliationLookup, DivisionAgeLookup
+from .renderstandings import scoreresults
+from .helpers import getagfactors
+
+class tabulationError(Exception): pass
+
+# genders which are placed
+GENDERS = ['F', 'M', 'X']
+
+# managed result with the runner information needed for each series, which doesn't depend on the series
+Entrant = namedtuple('Entrant', ['result', 'runnerid', 'gender', 'agegradeage', 'divage', 'agpercent', 'agtime', 'agfactor'])
+
+#----------------------------------------------------------------------
+def nullsfirst(value):
+#----------------------------------------------------------------------
+    '''
+    sort key which orders None before any value, as the database does for ascending order
+
+    :param value: value to sort by, or None
+    :rtype: sort key
+    '''
+    return (value is not None, value if value is not None else 0)
+
+#----------------------------------------------------------------------
+def placeresults(ordered, placeattr, tiekeys=None):
+#----------------------------------------------------------------------
+    '''
+    set place for results which are in place order. Consecutive results with the same tie key share the
+    average of their places
+
+    :param ordered: list of RaceResult in place order
+    :param placeattr: RaceResult attribute to set, e.g., 'genderplace'
+    :param tiekeys: (optional) {id(result): key, ...} for averaging ties, keys are results' rendered times
+    '''
+    numresults = len(ordered)
+    rrndx = 0
+    while rrndx < numresults:
+        lasttie = rrndx + 1
+        if tiekeys:
+            tiekey = tiekeys[id(ordered[rrndx])]
+            while lasttie < numresults and tiekeys[id(ordered[lasttie])] == tiekey:
+                lasttie += 1
+        thisplace = rrndx + 1
+        place = (thisplace + lasttie) / 2.0 if lasttie - rrndx > 1 else thisplace
+        for raceresult in ordered[rrndx:lasttie]:
+            setattr(raceresult, placeattr, place)
+        rrndx = lasttie
+
+#----------------------------------------------------------------------
+def retabulationraces(club_id, year, seriesid=None):
+#----------------------------------------------------------------------
+    '''
+    races to retabulate after a change to a series, i.e., the races in the club's active series for the year
+    which have already been tabulated
+
+    :param club_id: club.id
+    :param year: year of series
+    :param seriesid: (optional) only races in this series
+    :rtype: list of Race, in date order
+    '''
+    tabulated = select(RaceResult.raceid).where(RaceResult.club_id == club_id)
+    query = (Race.query.join(RaceSeries).join(Series)
+             .filter(Series.club_id == club_id, Series.year == int(year), Series.active == True,
+                     Race.id.in_(tabulated)))
+    if seriesid:
+        query = query.filter(Series.id == seriesid)
+    return query.distinct().order_by(Race.date).all()
+
+########################################################################
+class TabulateResults():
+########################################################################
+    '''
+    tabulate a race's results into series results
+
+    :param club_id: club.id
+    :param year: year for club affiliations
+    :param race: Race instance
+    :param progress: (optional) function(current, total) called as the tabulation progresses
+    '''
+    #----------------------------------------------------------------------
+    def __init__(self, club_id, year, race, progress=None):
+    #----------------------------------------------------------------------
+        self.club_id = club_id
+        self.year = year
+        self.race = race
+        self.progress = progress
+
+        # each result in each series is a step, as is the placing and points for each series
+        self.current = 0
+        self.total = 0
+
+        # only report progress max 100 times over course of tabulation
+        self.statemod = 1
+
+        # get precision for time rendering
+        self.timeprecision, self.agtimeprecision = render.getprecision(race.distance, surface=race.surface)
+
+        # set by getentrants(), {runnerid: Runner, ...} for the runners in the race's results
+        self.runners = {}
+
+    #----------------------------------------------------------------------
+    def step(self):
+    #----------------------------------------------------------------------
+        '''
+        count a step of the tabulation, reporting progress if needed
+        '''
+        self.current += 1
+        if self.progress and self.current % self.statemod == 0:
+            self.progress(self.current, self.total)
+
+    #----------------------------------------------------------------------
+    def getentrants(self, results):
+    #----------------------------------------------------------------------
+        '''
+        collect the runner information and age grade for each result
+
+        :param results: list of ManagedResult with runnerid set
+        :rtype: list of Entrant
+        '''
+        race = self.race
+
+        # need race date division date later for age calculation
+        racedate = dbdate.asc2dt(race.date)
+
+        # get club based age grade factors table, loading the factors with a query per level rather than per category
+        club = (Club.query
+                .options(selectinload(Club.agegradetable)
+                         .selectinload(AgeGradeTable.categories)
+                         .selectinload(AgeGradeCategory.factors))
+                .filter_by(id=self.club_id).one())
+        ag = AgeGrade(agegradedata=getagfactors(club.agegradetable))
+
+        # division age for each runner
+        divages = DivisionAgeLookup(self.club_id, racedate.year)
+
+        # all the runners with results, in one query
+        runnerids = {r.runnerid for r in results}
+        self.runners = {r.id: r for r in Runner.query.filter(Runner.club_id==self.club_id, Runner.id.in_(runnerids)).all()}
+
+        entrants = []
+        for thisresult in results:
+            runner = self.runners[thisresult.runnerid]
+
+            # we may not have dateofbirth for some non-members; for other non-members it's been estimated
+            if runner.dateofbirth:
+                try:
+                    dob = dbdate.asc2dt(runner.dateofbirth)
+                except ValueError:
+                    dob = None      # should not really happen, but this runner does not get division placement
+            else:
+                dob = None
+
+            # set agegrade age (race date based)
+            if dob:
+                agegradeage = timeu.age(racedate,dob)
+            else:
+                try:
+                    agegradeage = int(thisresult.age)
+                except:
+                    agegradeage = None
+
+            # always add age grade to result if we know the age
+            # we will decide whether to render, later based on series.agegrade, in another script
+            agpercent = agtime = agfactor = None
+            if agegradeage:
+                adjtime = render.adjusttime(thisresult.time,self.timeprecision)    # ceiling for adjtime
+                agpercent,agtime,agfactor = ag.agegrade(agegradeage,runner.gender,race.distance,adjtime,surface=race.surface)
+
+            # division age is based on Jan 1 if we know dob, based on earliest race this year if we don't
+            entrants.append(Entrant(thisresult, runner.id, runner.gender, agegradeage, divages.divisionage(runner.id),
+                                    agpercent, agtime, agfactor))
+
+        return entrants
+
+    #----------------------------------------------------------------------
+    def buildseries(self, series, entrants):
+    #----------------------------------------------------------------------
+        '''
+        build the series results for a series, without places or points
+
+        :param series: Series instance
+        :param entrants: list of Entrant, from getentrants()
+        :rtype: list of RaceResult, not added to the session
+        '''
+        club_id = self.club_id
+        race = self.race
+        requiresclub = series.has_series_option(SERIES_OPTION_REQUIRES_CLUB)
+        displayclub = series.has_series_option(SERIES_OPTION_DISPLAY_CLUB)
+
+        # get divisions for this series, if appropriate, sorted by low age for bisect
+        if series.divisions:
+            alldivs = [thisdiv for thisdiv in series.divisions if thisdiv.active]
+
+            if len(alldivs) == 0:
+                cause = "Series '{0}' indicates divisions to be calculated, but no divisions found".format(series.name)
+                current_app.logger.error(cause)
+                raise tabulationError(cause)
+
+            divisions = sorted((thisdiv.divisionlow, thisdiv.divisionhigh) for thisdiv in alldivs)
+            divlows = [divlow for divlow, divhigh in divisions]
+
+        # if series displays club, collect club alternatives
+        if displayclub:
+            # make hashed lookup for known clubs
+            clubaff = ClubAffiliationLookup(club_id, self.year)
+
+            # maybe some clubs are unknown
+            unknownclubs = set()
+
+        # check for duplicate RaceResult entries
+        rrentries = set()
+        rrduplicates = set()
+
+        # loop through result entries, collecting overall, bygender, division and agegrade results
+        raceresults = []
+        for entrant in entrants:
+            self.step()
+            thisresult = entrant.result
+
+            # skip results which should not be tallied due to missing club
+            if requiresclub and not thisresult.club:
+                continue
+            if (requiresclub and clubaff.knownclub(thisresult.club)
+                             and not clubaff.clubaffiliation(thisresult.club).shortname):
+                continue
+
+            # at this point, there should always be a runnerid in the database, even if non-member
+            # create RaceResult entry
+            # save overallplace for possible sort later (series.orderby)
+            runnerid = entrant.runnerid
+            raceresult = RaceResult(club_id, runnerid, race.id, series.id, thisresult.time, entrant.gender, entrant.agegradeage,
+                                    overallplace=thisresult.place, agpercent=entrant.agpercent, agtime=entrant.agtime,
+                                    agfactor=entrant.agfactor, source=productname(), sourceid=runnerid)
+
+            # save club affiliation if needed, by id as results are inserted in bulk
+            if requiresclub:
+                thisclubaff = clubaff.clubaffiliation(thisresult.club)
+                if thisclubaff:
+                    raceresult.clubaffiliation_id = thisclubaff.id
+                else:
+                    unknownclubs.add(thisresult.club)
+
+            # check for duplicates
+            if runnerid in rrentries:
+                rrduplicates.add(runnerid)
+            rrentries.add(runnerid)
+
+            if series.divisions:
+                # member's age to determine division is the member's age on Jan 1
+                # if member doesn't give date of birth for membership list, member is not eligible for division awards
+                # if non-member, also no division awards, because age as of Jan 1 is not known
+                age = entrant.divage    # None if not available
+                if age:
+                    # division with highest low age not above age, if age is within it
+                    divndx = bisect_right(divlows, age) - 1
+                    if divndx >= 0 and age <= divisions[divndx][1]:
+                        raceresult.divisionlow, raceresult.divisionhigh = divisions[divndx]
+
+            raceresults.append(raceresult)
+
+        # if duplicate entries found, complain to the admin
+        if rrduplicates:
+            causedom = div()
+            with causedom:
+                p('Duplicate entries found for the following runners. Please correct and retabulate.')
+                with ul():
+                    for rid in rrduplicates:
+                        li(self.runners[rid].name)
+            cause = causedom.render()
+            raise tabulationError(cause)
+
+        # if unknown clubs seen in the results, complain to the admin
+        if displayclub and unknownclubs:
+            causedom = div()
+            with causedom:
+                p('Unknown club names found. Please correct and retabulate.')
+                with ul():
+                    for unknownclub in unknownclubs:
+                        li(unknownclub)
+            cause = causedom.render()
+            raise tabulationError(cause)
+
+        return raceresults
+
+    #----------------------------------------------------------------------
+    def placeseries(self, series, raceresults):
+    #----------------------------------------------------------------------
+        '''
+        set places and points for a series' results
+
+        the results are sorted once, then split by gender, and by gender and division, in a single pass
+
+        :param series: Series instance
+        :param raceresults: list of RaceResult, from buildseries()
+        '''
+        # TODO: is series.overall vs. series.orderby=='time' redundant?  same question for series.agegrade vs. series.orderby=='agtime'
+        orderby = series.orderby
+        if orderby in ['time', 'overallplace']:
+            genplace = 'genderplace'
+            bydiv = series.divisions
+            tieattr, tieprecision = 'time', self.timeprecision
+        elif orderby == 'agtime':
+            genplace = 'agtimeplace'
+            bydiv = False
+            tieattr, tieprecision = 'agtime', self.agtimeprecision
+        elif orderby == 'agpercent':
+            genplace = 'agtimeplace'
+            bydiv = False
+            tieattr, tieprecision = None, None
+        else:
+            genplace = None
+            bydiv = False
+            tieattr, tieprecision = None, None
+
+        # results ordered as for the series
+        ordered = sorted(raceresults, key=lambda raceresult: nullsfirst(getattr(raceresult, orderby)))
+        if series.hightolow:
+            ordered.reverse()
+
+        # split into gender and division results, keeping the series order
+        bygender = {gender: [] for gender in GENDERS}
+        bydivision = {}
+        for raceresult in ordered:
+            if raceresult.gender not in bygender: continue
+            bygender[raceresult.gender].append(raceresult)
+            if bydiv and raceresult.divisionlow is not None:
+                bydivision.setdefault((raceresult.gender, raceresult.divisionlow, raceresult.divisionhigh), []).append(raceresult)
+
+        # detect ties based on rendering, which rounds to a specific precision based on distance
+        # but do this only if averaging ties
+        # TODO: need to change this code to support orderby=='overallplace' and averagetie==True
+        tiekeys = None
+        if series.averagetie and tieattr:
+            tiekeys = {}
+            for raceresult in ordered:
+                tietime = getattr(raceresult, tieattr)
+                tiekeys[id(raceresult)] = render.rendertime(tietime, tieprecision) if tietime is not None else None
+
+        if genplace:
+            for genresults in bygender.values():
+                placeresults(genresults, genplace, tiekeys)
+            for divresults in bydivision.values():
+                placeresults(divresults, 'divisionplace', tiekeys)
+
+        # store points with the results, so standings don't need to score them
+        for genresults in bygender.values():
+            for raceresult, (genpoints, divpoints) in zip(genresults, scoreresults(series, genresults)):
+                raceresult.genderpoints = genpoints
+                raceresult.divisionpoints = divpoints
+
+    #----------------------------------------------------------------------
+    def tabulate(self):
+    #----------------------------------------------------------------------
+        '''
+        replace the race's series results with newly tabulated ones
+
+        caller is responsible for committing the session, or rolling it back if tabulationError is raised
+
+        :rtype: number of steps tabulated
+        '''
+        club_id = self.club_id
+        race = self.race
+        if len(race.series) == 0:
+            raise tabulationError("Race '{}' is not included in any series".format(race.name))
+
+        # delete all the current results for this race
+        RaceResult.query.filter_by(club_id=club_id,raceid=race.id).delete()
+
+        # collect results from database, these are the same for each series
+        results = ManagedResult.query.filter(ManagedResult.club_id==club_id, ManagedResult.raceid==race.id, ManagedResult.runnerid!=None).order_by('time').all()
+        entrants = self.getentrants(results)
+
+        self.total = len(race.series) * (len(results) + 1)
+        self.statemod = max(self.total // 100, 1)
+
+        # for each series for this race - 'series' describes how to tabulate the results
+        raceresults = []
+        for series in race.series:
+            seriesresults = self.buildseries(series, entrants)
+            self.placeseries(series, seriesresults)
+            raceresults += seriesresults
+
+            # placing and points for the series count as one step
+            self.step()
+
+        # insert all the results at once, without fetching their ids
+        # every row has all the columns, so they're inserted with a single executemany
+        if raceresults:
+            columns = [column.key for column in RaceResult.__table__.columns if column.key != 'id']
+            db.session.execute(insert(RaceResult.__table__),
+                               [{column: getattr(raceresult, column) for column in columns} for raceresult in raceresults])
+
+        # final progress update
+        if self.progress:
+            self.progress(self.current, self.total)
+        return self.total
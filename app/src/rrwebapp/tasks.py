@@ -9,23 +9,27 @@ import os
 import traceback
 from flask.globals import current_app
 from time import time
+from datetime import date
 from platform import system
 from difflib import SequenceMatcher
 
 # pypi
+from celery import chord, group
 from loutilities.timeu import timesecs, epoch2dt, asctime, age as ageasof
 from loutilities.flask_helpers.mailer import sendmail
 from celery.utils.log import get_task_logger
 
 # home grown
 from .celery import celeryapp
-from .model import ManagedResult, Race, Runner, RaceResult
+from .model import ManagedResult, Race, Runner, RaceResult, Club
 from .model import db, ApiCredentials, RaceResultService
 from .model import getunique, update, insert_or_update
 from .settings import productname
 from .resultsutils import StoreServiceResults
 from .resultssummarize import summarize
 from .resultsutils import ImportResults
+from .standingscache import invalidatestandings, invalidaterace, prewarm
+from .tabulation import TabulateResults, tabulationError, retabulationraces
 from .raceresults import RaceResults
 from . import clubmember
 
@@ -104,52 +108,45 @@ def importresultstask(self, club_id, raceid, resultpathname):
         race = Race.query.filter_by(club_id=club_id,id=raceid).first()
         rr = RaceResults(resultpathname,race.distance)
 
-        # count rows, inefficiently. TODO: add count() method to RaceResults class
-        try:
-            total = 0
-            while True:
-                next(rr)
-                total += 1
-        except StopIteration:
-            pass
+        # the file is read only once, so total is the number of rows after the header, some of which may be skipped
+        total = rr.count()
 
         # only update state max 100 times over course of file, but don't make it too small
         statemod = total // 100
         if statemod == 0:
             statemod = 1
 
-        # start over
-        rr.close()
-        rr = RaceResults(resultpathname,race.distance)
-
         # create importer
         importresults = ImportResults(club_id, raceid)
         
-        # collect results from resultsfile
-        numentries = 0
-        dbresults = []
-        logfirst = True
-        while True:
-            try:
+        # very large files are matched in parallel, as matching is cpu bound
+        processes = current_app.config.get('IMPORT_PROCESSES', 1)
+        if processes > 1 and total >= current_app.config.get('IMPORT_PARALLEL_MIN', 2000):
+            fileresults = list(rr)
+            logger.debug('matching {} file results in {} processes'.format(len(fileresults), processes))
+            importresults.add_dbresults_parallel(fileresults, processes,
+                                                 progress=lambda current, total: self.update_state(state='PROGRESS', meta={'current': current, 'total': total}))
+            numentries = len(fileresults)
+
+        # collect results from resultsfile, rows are inserted in batches
+        else:
+            numentries = 0
+            logfirst = True
+            for fileresult in rr:
                 if numentries % statemod == 0:
                     self.update_state(state='PROGRESS', meta={'current': numentries, 'total': total})
-                fileresult = next(rr)
                 if logfirst:
                     logger.debug('first file result {}'.format(fileresult))
                     logfirst = False
-                dbresult   = ManagedResult(club_id,raceid)
 
                 # update database entry
-                runner_choices = importresults.update_dbresult(fileresult, dbresult)
+                importresults.add_dbresult(fileresult)
+                numentries += 1
 
-                # add to database
-                db.session.add(dbresult)
-                dbresults.append(dbresult)
-            except StopIteration:
-                break
-            numentries += 1
+        importresults.flush_dbresults()
 
-        # not sure this is necessary, but final state update
+        # final state update, now that the number of results is known
+        total = numentries
         self.update_state(state='PROGRESS', meta={'current': numentries, 'total': total})
 
         # remove file and temporary directory
@@ -172,6 +169,136 @@ def importresultstask(self, club_id, raceid, resultpathname):
         # report this as success, but since traceback is present, server will tell user
         return {'current': 100, 'total': 100, 'traceback': traceback.format_exc()}
 
+@celeryapp.task(bind=True)
+def tabulateresultstask(self, club_id, year, raceid):
+    '''
+    background task to tabulate results
+
+    :param club_id: club identifier
+    :param year: year for club affiliations
+    :param raceid: race identifier
+    '''
+    try:
+        race = Race.query.filter_by(club_id=club_id,id=raceid).first()
+        tabulator = TabulateResults(club_id, year, race,
+                                    progress=lambda current, total: self.update_state(state='PROGRESS', meta={'current': current, 'total': total}))
+        try:
+            total = tabulator.tabulate()
+        except tabulationError as e:
+            db.session.rollback()
+            # cause is reported to the user
+            return {'current': 100, 'total': 100, 'cause': str(e)}
+
+        # standings for this race's series need to be rendered again, collecting only this race
+        invalidaterace(club_id, race)
+
+        # we're done
+        db.session.commit()
+
+        # render the series results and standings in the background, so public views are served from the caches
+        prewarmtask.apply_async((club_id, raceid))
+        return {'current': total, 'total': total, 'raceid': raceid}
+
+    except:
+        # close database session and roll back
+        db.session.rollback()
+
+        # tell the admins that this happened
+        admins = current_app.config['APP_ADMINS']
+        sendmail('[scoretility] tabulateresultstask: exception occurred', 'noreply@scoretility.com', admins, '', text=traceback.format_exc())
+
+        # report this as success, but since traceback is present, server will tell user
+        return {'current': 100, 'total': 100, 'traceback': traceback.format_exc()}
+
+@celeryapp.task(bind=True)
+def retabulateracetask(self, club_id, year, raceid):
+    '''
+    background task to retabulate a race as part of a batch started by retabulateresults()
+
+    the race is tabulated in its own transaction. Standings are refreshed by retabulatedonetask() once all
+    the races are done, so this doesn't invalidate them
+
+    :param club_id: club identifier
+    :param year: year for club affiliations
+    :param raceid: race identifier
+    :rtype: {'raceid': raceid, 'race': race name, 'cause': html cause, 'traceback': traceback}, cause and
+        traceback are '' if the race was tabulated
+    '''
+    racename = raceid
+    try:
+        race = Race.query.filter_by(club_id=club_id,id=raceid).first()
+        racename = race.name
+        TabulateResults(club_id, year, race).tabulate()
+        db.session.commit()
+        return {'raceid': raceid, 'race': racename, 'cause': '', 'traceback': ''}
+
+    # failures are returned rather than raised so the batch finishes, and are reported together
+    except tabulationError as e:
+        db.session.rollback()
+        return {'raceid': raceid, 'race': racename, 'cause': str(e), 'traceback': ''}
+
+    except:
+        db.session.rollback()
+        logger.error(traceback.format_exc())
+        return {'raceid': raceid, 'race': racename, 'cause': '', 'traceback': traceback.format_exc()}
+
+@celeryapp.task(bind=True)
+def retabulatedonetask(self, raceresults, club_id, year):
+    '''
+    background task to refresh standings after a batch retabulation, called with the results of all the
+    retabulateracetask() tasks
+
+    :param raceresults: list of retabulateracetask() results
+    :param club_id: club identifier
+    :param year: year of series
+    '''
+    try:
+        # races may be in several series, so all the year's standings are refreshed
+        invalidatestandings(club_id, year=year)
+        db.session.commit()
+
+        # HtmlStandingsHandler links runner names using url_for(), which needs a request context
+        with current_app.test_request_context():
+            prewarm(club_id, year=year)
+            db.session.commit()
+
+        failures = [raceresult for raceresult in raceresults if raceresult['cause'] or raceresult['traceback']]
+        return {'current': len(raceresults), 'total': len(raceresults), 'failures': failures}
+
+    except:
+        # close database session and roll back
+        db.session.rollback()
+
+        # tell the admins that this happened
+        admins = current_app.config['APP_ADMINS']
+        sendmail('[scoretility] retabulatedonetask: exception occurred', 'noreply@scoretility.com', admins, '', text=traceback.format_exc())
+
+        # report this as success, but since traceback is present, server will tell user
+        return {'current': 100, 'total': 100, 'traceback': traceback.format_exc()}
+
+def retabulateresults(club_id, year, seriesid=None):
+    '''
+    start batch retabulation of the races in the club's series for the year, e.g., after series options or
+    divisions change. The races are retabulated in parallel by the workers for the tabulate queue, then
+    standings are refreshed once
+
+    :param club_id: club identifier
+    :param year: year of series
+    :param seriesid: (optional) only retabulate races in this series
+    :rtype: AsyncResult for retabulatedonetask(), whose parent is the saved GroupResult of the race tasks,
+        or None if there are no races to retabulate
+    '''
+    races = retabulationraces(club_id, year, seriesid)
+    if not races:
+        return None
+
+    header = group(retabulateracetask.signature((club_id, year, race.id), queue='tabulate') for race in races)
+    result = chord(header)(retabulatedonetask.s(club_id, year))
+
+    # saved so progress can be reported from the individual race tasks
+    result.parent.save()
+    return result
+
 @celeryapp.task(bind=True)
 def importmemberstask(self, club_id, tempdir, memberpathname, memberfilename):
     try:
@@ -382,6 +509,9 @@ def importmemberstask(self, club_id, tempdir, memberpathname, memberfilename):
             thisrunner = Runner.query.filter_by(club_id=club_id,name=name,dateofbirth=dateofbirth).first() # should be only one returned by filter
             thisrunner.active = False
     
+        # member ages feed into standings, so they need to be rendered again
+        invalidatestandings(club_id)
+
         # not sure this is necessary, but final state update
         self.update_state(state='PROGRESS', meta={'current': numentries, 'total': total})
 
@@ -496,4 +626,40 @@ def analyzeresultstask(self, club_id, action, resultsurl, memberfile, detailfile
         # report this as success, but since traceback is present, server will tell user
         return {'progress':status, 'traceback': traceback.format_exc()}
 
+@celeryapp.task(bind=True)
+def prewarmtask(self, club_id=None, raceid=None):
+    '''
+    background task to render and store standings and series results before they're viewed
+
+    with raceid, e.g., after the race is tabulated, the race's series results and the standings for the
+    race's series are prewarmed. Otherwise, e.g., nightly, the standings and series results for the current
+    year's active series are prewarmed, for club_id or for all clubs
+
+    :param club_id: (optional) club identifier
+    :param raceid: (optional) race identifier
+    '''
+    try:
+        # HtmlStandingsHandler links runner names using url_for(), which needs a request context
+        with current_app.test_request_context():
+            if raceid:
+                race = Race.query.filter_by(club_id=club_id,id=raceid).first()
+                numseries = prewarm(club_id, race=race)
+            else:
+                clubids = [club_id] if club_id else [club.id for club in Club.query.all()]
+                numseries = 0
+                for thisclub_id in clubids:
+                    numseries += prewarm(thisclub_id, year=date.today().year)
+
+            # we're done
+            db.session.commit()
+        return {'numseries': numseries}
+
+    except:
+        # close database session and roll back
+        db.session.rollback()
+
+        # tell the admins that this happened
+        admins = current_app.config['APP_ADMINS']
+        sendmail('[scoretility] prewarmtask: exception occurred', 'noreply@scoretility.com', admins, '', text=traceback.format_exc())
 
+        return {'traceback': traceback.format_exc()}
@@ -39,7 +39,7 @@ from ...model import Runner, Club, ApiCredentials
 from ...forms import MemberForm 
 from ...tasks import importmemberstask
 from ...clubmember import rsu_api2filemapping
-from ...crudapi import CrudApi
+from ...crudapi import StandingsCrudApi
 from ...datatables_utils import getDataTableParams
 from ...version import __docversion__
 
@@ -124,7 +124,7 @@ mm_formmapping = OrderedDict(list(zip(mm_formfields, mm_dbattrs)))
 mm_dbmapping['member'] = lambda form: 1 if form['member'] == 'is-member' or form['member'] == 'true' else 0
 mm_formmapping['member'] = lambda dbrow: 'is-member' if dbrow.member else 'non-member'
 
-class MembersView(CrudApi):
+class MembersView(StandingsCrudApi):
     def beforequery(self):
         '''
         add update query parameters based on ondate
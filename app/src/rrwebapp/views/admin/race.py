@@ -12,6 +12,7 @@
 # standard
 import traceback
 from traceback import format_exception_only, format_exc
+from datetime import date
 
 # pypi
 import flask
@@ -32,7 +33,10 @@ from ...model import Race, Series, Divisions, Club
 from ...model import getclubid, getyear
 from ...model import SERIES_OPTIONS, SERIES_OPTION_SEPARATOR, SERIES_TIE_OPTIONS, SERIES_TIE_OPTION_SEPARATOR
 from ...apicommon import failure_response, success_response, check_header
-from ...crudapi import CrudApi
+from ...crudapi import StandingsCrudApi
+from ...standingscache import invalidatestandings
+from ...seasonarchive import finalizeseason, reopenseason, untabulatedraces
+from ...renderstandings import scoreseries
 from ...resultsutils import race_fixeddist
 
 from ...forms import RaceForm, SeriesForm, RaceSettingsForm, DivisionForm
@@ -120,7 +124,7 @@ races_formmapping['results'] = races_results_to_form
 races_dbmapping['club_id'] = getclubid
 races_dbmapping['year'] = getyear
 
-races_view = CrudApi(
+races_view = StandingsCrudApi(
     app=bp,
     pagename='Races',
     template='manageraces.html',
@@ -313,6 +317,9 @@ class AjaxImportRaces(MethodView):
                 thisrace = Race.query.filter_by(club_id=club_id,name=name,year=year).first() # should be only one returned by filter
                 thisrace.active = False
                 
+            # standings for this year need to be rendered again
+            invalidatestandings(club_id, year=thisyear)
+
             # commit database updates and close transaction
             db.session.commit()
             return success_response()
@@ -376,7 +383,13 @@ series_formmapping = dict(list(zip(series_formfields, series_dbattrs)))
 series_dbmapping['club_id'] = getclubid
 series_dbmapping['year'] = getyear
 
-class SeriesView(CrudApi):
+class SeriesView(StandingsCrudApi):
+
+    def updaterow(self, thisid, formdata):
+        row = super().updaterow(thisid, formdata)
+        # points stored with the results depend on the series configuration
+        scoreseries(flask.session['club_id'], Series.query.filter_by(id=thisid).one())
+        return row
    
     def setbuttons(self):
         buttons = ['create', 'edit', 'remove', 'csv',
@@ -388,7 +401,28 @@ class SeriesView(CrudApi):
                         'action': {
                             'eval': f"series_copy_button(\"{url_for('admin._copyseries')}\")"
                         }
-                    }
+                    },
+                    {
+                        'text': 'Retabulate',
+                        'name': 'series-retabulate-button',
+                        'action': {
+                            'eval': f"series_retabulate_button(\"{url_for('admin._retabulateresults')}\")"
+                        }
+                    },
+                    {
+                        'text': 'Finalize Season',
+                        'name': 'series-finalize-button',
+                        'action': {
+                            'eval': f"series_finalize_button(\"{url_for('admin._finalizeseason')}\", false)"
+                        }
+                    },
+                    {
+                        'text': 'Reopen Season',
+                        'name': 'series-reopen-button',
+                        'action': {
+                            'eval': f"series_finalize_button(\"{url_for('admin._finalizeseason')}\", true)"
+                        }
+                    },
                   ]
 
         return buttons
@@ -611,6 +645,9 @@ class AjaxCopySeries(MethodView):
             for seriesname in obsoleteseries:
                 obsoleteseries[seriesname].active = False
                 
+            # standings for this year need to be rendered again
+            invalidatestandings(club_id, year=thisyear)
+
             # commit database updates and close transaction
             db.session.commit()
             return success_response()
@@ -621,6 +658,62 @@ class AjaxCopySeries(MethodView):
             raise
 bp.add_url_rule('/_copyseries',view_func=AjaxCopySeries.as_view('_copyseries'),methods=['GET', 'POST'])
 
+#######################################################################
+class AjaxFinalizeSeason(MethodView):
+#######################################################################
+    '''
+    store snapshots of this year's standings and series results, which are then served without
+    rendering the standings. With reopen=true, remove the snapshots so results can be corrected
+
+    the user is asked to confirm unless force=true, and a season which is still in progress can't be finalized
+    '''
+    decorators = [login_required]
+
+    def post(self):
+        try:
+            club_id = flask.session['club_id']
+            thisyear = flask.session['year']
+            force = request.args.get('force') == 'true'
+
+            # verify user can write the data, otherwise abort
+            writecheck = UpdateClubDataPermission(club_id)
+            if not writecheck.can():
+                db.session.rollback()
+                flask.abort(403)
+
+            if request.args.get('reopen') == 'true':
+                if not force:
+                    db.session.rollback()
+                    cause = 'Reopen the {} season? Standings will be rendered from the current results again.'.format(thisyear)
+                    return failure_response(cause=cause, confirm=True, confirmbutton='Reopen')
+                numseries = reopenseason(club_id, thisyear)
+
+            else:
+                # results may still be tabulated during the current year
+                if int(thisyear) >= date.today().year:
+                    db.session.rollback()
+                    return failure_response(cause='The {} season is in progress and can\'t be finalized.'.format(thisyear))
+
+                if not force:
+                    cause = ('Finalize the {} season? Standings will no longer change when results are tabulated, '
+                             'until the season is reopened.').format(thisyear)
+                    races = untabulatedraces(club_id, thisyear)
+                    if races:
+                        cause += ' These races have no results: {}.'.format(', '.join(['{} ({})'.format(r.name, r.date) for r in races]))
+                    db.session.rollback()
+                    return failure_response(cause=cause, confirm=True, confirmbutton='Finalize')
+                numseries = finalizeseason(club_id, thisyear)
+
+            # commit database updates and close transaction
+            db.session.commit()
+            return success_response(numseries=numseries)
+
+        except:
+            # roll back database updates and close transaction
+            db.session.rollback()
+            raise
+bp.add_url_rule('/_finalizeseason',view_func=AjaxFinalizeSeason.as_view('_finalizeseason'),methods=['POST'])
+
 ###########################################################################################
 # managedivisions endpoint
 ###########################################################################################
@@ -634,7 +727,7 @@ divisions_formmapping = dict(list(zip(divisions_formfields, divisions_dbattrs)))
 divisions_dbmapping['club_id'] = getclubid
 divisions_dbmapping['year'] = getyear
 
-class DivisionsView(CrudApi):
+class DivisionsView(StandingsCrudApi):
    
     def setbuttons(self):
         buttons = ['create', 'edit', 'remove', 'csv',
@@ -798,6 +891,9 @@ class AjaxCopyDivisions(MethodView):
             for (seriesid,divisionlow,divisionhigh) in obsoletedivisions:
                 db.session.delete(obsoletedivisions[(seriesid,divisionlow,divisionhigh)])
                 
+            # standings for this year need to be rendered again
+            invalidatestandings(club_id, year=thisyear)
+
             # commit database updates and close transaction
             db.session.commit()
             return success_response()
@@ -859,7 +955,7 @@ def clubaffiliations_validate(action, formdata):
     return results
 
 
-class ClubAffiliationsView(CrudApi):
+class ClubAffiliationsView(StandingsCrudApi):
     def update_alternates(self, formdata):
         """
         make sure title, shortname are in alternates
@@ -1017,6 +1113,9 @@ class AjaxCopyClubAffiliations(MethodView):
             for shortname in obsoleteitems:
                 db.session.delete(obsoleteitems[shortname])
                 
+            # standings for this year need to be rendered again
+            invalidatestandings(club_id, year=thisyear)
+
             # commit database updates and close transaction
             db.session.commit()
             return success_response()
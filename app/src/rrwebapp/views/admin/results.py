@@ -25,11 +25,12 @@ from flask.helpers import send_file
 from flask_login import login_required
 from flask.views import MethodView
 from werkzeug.utils import secure_filename
+from celery.result import GroupResult
 from sqlalchemy import func, cast
 from dominate.tags import button, div, p, ul, li
+from dominate.util import raw
 import loutilities.renderrun as render
 from loutilities import timeu
-from loutilities.agegrade import AgeGrade
 from loutilities.filters import filtercontainerdiv, filterdiv, yadcfoption
 from loutilities.tables import DataTables, ColumnDT
 from loutilities.timeu import asctime
@@ -50,17 +51,17 @@ from ...settings import productname
 from ...raceresults import RaceResults, headerError, dataError, normalizeracetime
 from ...clubmember import DbClubMember
 from ...crudapi import CrudApi
-from ...model import Runner, ManagedResult, RaceResult, Race, Exclusion, Series, Divisions, Club, ClubAffiliation, dbdate
+from ...standingscache import invalidaterace
+from ...tabulation import retabulationraces
+from ...model import Runner, ManagedResult, RaceResult, Race, Exclusion, Series, Club, ClubAffiliation, dbdate
 from ...model import rendertime, renderfloat, rendermember, renderlocation, renderseries
 from ...resultsutils import ServiceAttributes, LocationServer, get_distance, get_runsignup_client
 from ...resultsutils import DIFF_CUTOFF, DISP_MATCH, DISP_CLOSE, DISP_CLOSEAGE, DISP_MISSED
-from ...resultsutils import ImportResults, tYmd, getrunnerchoices, get_earliestrace, ClubAffiliationLookup
+from ...resultsutils import ImportResults, tYmd, getrunnerchoices
 from ...model import RaceResultService, ApiCredentials
-from ...model import SERIES_OPTION_REQUIRES_CLUB, SERIES_OPTION_DISPLAY_CLUB
 from ...datatables_utils import DataTablesEditor, dt_editor_response, get_request_action, get_request_data
 from ...forms import SeriesResultForm
-from ...tasks import importresultstask
-from ...helpers import getagfactors
+from ...tasks import importresultstask, tabulateresultstask, retabulatedonetask, retabulateresults
 
 class BooleanError(Exception): pass
 class ParameterError(Exception): pass
@@ -1236,6 +1237,7 @@ class AjaxImportResults(MethodView):
                     nummrdeleted = ManagedResult.query.filter_by(club_id=club_id,raceid=raceid).delete()
                     numrrdeleted = RaceResult.query.filter_by(club_id=club_id,raceid=raceid).delete()
                     current_app.logger.debug('{} managedresults deleted; {} raceresults deleted'.format(nummrdeleted,numrrdeleted))
+                    invalidaterace(club_id, race)
                     # also delete any nonmembers who do not have results, as these were most likely brought in by past version of this race
                     nonmembers = Runner.query.filter_by(club_id=club_id,member=False)
                     for nonmember in nonmembers:
@@ -1302,9 +1304,13 @@ bp.add_url_rule('/_importresults/<int:raceid>',view_func=AjaxImportResults.as_vi
 
 class ImportResultsStatus(MethodView):
     decorators = [login_required]
-    
+    task = importresultstask
+
+    def redirect(self, info):
+        return url_for('.editparticipants',raceid=info.get('raceid'))
+
     def get(self, task_id):
-        task = importresultstask.AsyncResult(task_id)
+        task = self.task.AsyncResult(task_id)
         current_app.logger.debug(f'task.state: {task.state}, task.info {task.info}')
 
         if task.state == 'PENDING':
@@ -1325,10 +1331,10 @@ class ImportResultsStatus(MethodView):
             
             # task is finished, check for traceback, which indicates an error occurred
             if task.state == 'SUCCESS':
-                # check for traceback, which indicates an error occurred
-                response['cause'] = task.info.get('traceback','')
+                # check for cause or traceback, which indicates an error occurred
+                response['cause'] = task.info.get('cause', task.info.get('traceback',''))
                 if response['cause'] == '':
-                    response['redirect'] = url_for('.editparticipants',raceid=task.info.get('raceid'))
+                    response['redirect'] = self.redirect(task.info)
                 try:
                     task.forget()
                 except NotImplementedError:
@@ -1580,360 +1586,82 @@ class AjaxTabulateResults(MethodView):
                 flask.abort(403)
                 
             # do we have any series results yet?  If so, make sure it is ok to overwrite them
-            dbresults = RaceResult.query.filter_by(club_id=club_id,raceid=raceid).all()
+            dbresult = RaceResult.query.filter_by(club_id=club_id,raceid=raceid).first()
 
             # if some results exist, verify user wants to overwrite
-            if dbresults:
-                # verify overwrite
-                if not request.args.get('force')=='true':
-                    db.session.rollback()
-                    return failure_response(cause='Overwrite results?',confirm=True)
-                # force is true.  delete all the current results for this race
-                else:
-                    numdeleted = RaceResult.query.filter_by(club_id=club_id,raceid=raceid).delete()
+            # the task deletes the current results for this race
+            if dbresult and not request.args.get('force')=='true':
+                db.session.rollback()
+                return failure_response(cause='Overwrite results?',confirm=True)
     
-            # get race and list of runners who should be included in this race, based on membersonly
             race = Race.query.filter_by(club_id=club_id,id=raceid).first()
             if len(race.series) == 0:
                 db.session.rollback()
                 cause =  "Race '{}' is not included in any series".format(race.name)
                 current_app.logger.error(cause)
                 return failure_response(cause=cause)
-            
-            # need race date division date later for age calculation
-            racedate = dbdate.asc2dt(race.date)
 
-            # get precision for time rendering
-            timeprecision,agtimeprecision = render.getprecision(race.distance,surface=race.surface)
-            
-            # get club based age grade factors table
-            club = Club.query.filter_by(id=club_id).one()
-            ag = AgeGrade(agegradedata=getagfactors(club.agegradetable))
-
-            # for each series for this race - 'series' describes how to tabulate the results
-            theseseries = race.series
-            for series in theseseries:
-                # get divisions for this series, if appropriate
-                if series.divisions:
-                    alldivs = Divisions.query.filter_by(club_id=club_id,seriesid=series.id,active=True).all()
-                    
-                    if len(alldivs) == 0:
-                        cause = "Series '{0}' indicates divisions to be calculated, but no divisions found".format(series.name)
-                        db.session.rollback()
-                        current_app.logger.error(cause)
-                        return failure_response(cause=cause)
-                    
-                    divisions = []
-                    for thisdiv in alldivs:
-                        divisions.append((thisdiv.divisionlow, thisdiv.divisionhigh))
-
-                # if series displays club, collect club alternatives
-                if series.has_series_option(SERIES_OPTION_DISPLAY_CLUB):
-                    # make hashed lookup for known clubs
-                    clubaff = ClubAffiliationLookup(club_id, thisyear)
-                    
-                    # maybe some clubs are unknown
-                    unknownclubs = set()
+            # start task to tabulate results
+            task = tabulateresultstask.apply_async((club_id, thisyear, raceid))
 
-                # collect results from database
-                results = ManagedResult.query.filter(ManagedResult.club_id==club_id, ManagedResult.raceid==race.id, ManagedResult.runnerid!=None).order_by('time').all()
-                
-                # check for duplicate RaceResult entries
-                rrentries = set()
-                rrduplicates = set()
-
-                # loop through result entries, collecting overall, bygender, division and agegrade results
-                for thisresult in results:
-                    # skip results which should not be tallied due to missing club
-                    if series.has_series_option(SERIES_OPTION_REQUIRES_CLUB) and not thisresult.club:
-                        continue
-                    if (series.has_series_option(SERIES_OPTION_REQUIRES_CLUB) and clubaff.knownclub(thisresult.club) 
-                                                                              and not clubaff.clubaffiliation(thisresult.club).shortname):
-                        continue
-
-                    # get runner information
-                    runner = Runner.query.filter_by(club_id=club_id,id=thisresult.runnerid).first()
-                    runnerid = runner.id
-                    gender = runner.gender
-            
-                    # we may not have dateofbirth for some non-members; for other non-members it's been estimated
-                    if runner.dateofbirth:
-                        try:
-                            dob = dbdate.asc2dt(runner.dateofbirth)
-                        except ValueError:
-                            dob = None      # should not really happen, but this runner does not get division placement
-                    else:
-                        dob = None
-            
-                    # set agegrade age (race date based)
-                    # set division age (based on Jan 1 if we know dob, based on earliest race this year if we don't)
-                    if dob:
-                        agegradeage = timeu.age(racedate,dob)
-                        # if we know dob, date for division's age calculation is Jan 1 of year race was run
-                        if not runner.estdateofbirth:
-                            divdate = racedate.replace(month=1,day=1)
-                            divage = timeu.age(divdate, dob)
-                        
-                        # if we have estimated dob, date for division's age calculation is earliest race run this year by this runner
-                        else:
-                            # TODO: this doesn't quite seem right -- we want to emulate Jan 1, but don't know the real dob 
-                            # -- should we be looking at earliest race in *any* year?
-                            # get_earliestrace can return None if none found, but logic to get here guarantees at least one will be found
-                            earlyresult = get_earliestrace(runner, year=racedate.year)
-                            divdate = dbdate.asc2dt(earlyresult.race.date)
-                            divage = timeu.age(divdate, dob)
+            # commit database updates and close transaction
+            db.session.commit()
+            return jsonify({'success': True, 'current': 0, 'total':100, 'location': url_for('.tabulateresultsstatus', task_id=task.id)}), 202, {}
+        
+        except Exception as e:
+            # roll back database updates and close transaction
+            db.session.rollback()
+            cause = 'Unexpected Error: {}'.format(e)
+            current_app.logger.error(traceback.format_exc())
+            return failure_response(cause=cause)
 
-                    else:
-                        try:
-                            agegradeage = int(thisresult.age)
-                        except:
-                            agegradeage = None
-                        divage = None
-            
-                    # at this point, there should always be a runnerid in the database, even if non-member
-                    # create RaceResult entry
-                    # save overallplace for possible sort later (series.orderby)
-                    resulttime = thisresult.time
-                    raceresult = RaceResult(club_id, runnerid, race.id, series.id, resulttime, gender, agegradeage, overallplace=thisresult.place)
-                    
-                    # save club affiliation if needed
-                    if series.has_series_option(SERIES_OPTION_REQUIRES_CLUB):
-                        thisclubaff = clubaff.clubaffiliation(thisresult.club)
-                        if thisclubaff:
-                            raceresult.clubaffiliation = thisclubaff
-                        else:
-                            unknownclubs.add(thisresult.club)
+bp.add_url_rule('/_tabulateresults/<int:raceid>',view_func=AjaxTabulateResults.as_view('_tabulateresults'),methods=['POST'])
 
-                    # check for duplicates
-                    if runnerid in rrentries:
-                        rrduplicates.add(runnerid)
-                    rrentries.add(runnerid)
 
-                    # set source fields
-                    raceresult.source = productname()
-                    raceresult.sourceid = runnerid
-            
-                    # always add age grade to result if we know the age
-                    # we will decide whether to render, later based on series.agegrade, in another script
-                    if agegradeage:
-                        timeprecision,agtimeprecision = render.getprecision(race.distance,surface=race.surface)
-                        adjtime = render.adjusttime(resulttime,timeprecision)    # ceiling for adjtime
-                        raceresult.agpercent,raceresult.agtime,raceresult.agfactor = ag.agegrade(agegradeage,gender,race.distance,adjtime,surface=race.surface)
-            
-                    if series.divisions:
-                        # member's age to determine division is the member's age on Jan 1
-                        # if member doesn't give date of birth for membership list, member is not eligible for division awards
-                        # if non-member, also no division awards, because age as of Jan 1 is not known
-                        age = divage    # None if not available
-                        if age:
-                            # linear search for correct division
-                            for thisdiv in divisions:
-                                divlow = thisdiv[0]
-                                divhigh = thisdiv[1]
-                                if age in range(divlow,divhigh+1):
-                                    raceresult.divisionlow = divlow
-                                    raceresult.divisionhigh = divhigh
-                                    break
-            
-                    # make result persistent
-                    db.session.add(raceresult)
-                
-                # flush the results so they show up below
-                db.session.flush()
-                
-                # if duplicate entries found, complain to the admin
-                if rrduplicates:
-                    causedom = div()
-                    with causedom:
-                        p('Duplicate entries found for the following runners. Please correct and retabulate.')
-                        with ul():
-                            for rid in rrduplicates:
-                                runner = Runner.query.filter_by(id=rid).one()
-                                li(runner.name)
-                    cause = causedom.render()
-                    return failure_response(cause=cause)
-                
-                # if unknown clubs seen in the results, complain to the admin
-                if series.has_series_option(SERIES_OPTION_DISPLAY_CLUB) and unknownclubs:
-                    causedom = div()
-                    with causedom:
-                        p('Unknown club names found. Please correct and retabulate.')
-                        with ul():
-                            for unknownclub in unknownclubs:
-                                li(unknownclub)
-                    cause = causedom.render()
-                    return failure_response(cause=cause)
+class TabulateResultsStatus(ImportResultsStatus):
+    task = tabulateresultstask
 
-                # process bygender and division results, sorted by time or overallplace
-                # TODO: is series.overall vs. series.orderby=='time' redundant?  same question for series.agegrade vs. series.orderby=='agtime'
-                if series.orderby in ['time', 'overallplace']:
-                    # get all the results which have been stored in the database for this race/series
-                    dbresults = RaceResult.query.filter_by(club_id=club_id,raceid=race.id,seriesid=series.id).order_by(series.orderby).all()
-                    # this is easier, code-wise, than using sqlalchemy desc() function
-                    if series.hightolow:
-                        dbresults.reverse()
-                    numresults = len(dbresults)
-
-                    ### code below deleted because overallplace is definitely set in loop through ManagedResults above, 
-                    ### and no ties are rendered in standings for overallplace anyway
-                    # for rrndx in range(numresults):
-                    #     raceresult = dbresults[rrndx]
-                        
-                    #     # set place if it has not been set before
-                    #     # place may have been determined at previous iteration, if a tie was detected
-                    #     if not raceresult.overallplace:
-                    #         thisplace = rrndx+1
-                    #         tieindeces = [rrndx]
-                            
-                    #         # detect tie in subsequent results based on rendering,
-                    #         # which rounds to a specific precision based on distance
-                    #         # but do this only if averaging ties
-                    #         if series.has_series_option(SERIES_OPTION_AVERAGETIE):
-                    #             # TODO: need to change this code to support orderby=='overallplace' and averagetie==True
-                    #             time = render.rendertime(raceresult.time,timeprecision)
-                    #             for tiendx in range(rrndx+1,numresults):
-                    #                 if render.rendertime(dbresults[tiendx].time,timeprecision) != time:
-                    #                     break
-                    #                 tieindeces.append(tiendx)
-                    #             lasttie = tieindeces[-1] + 1
-                    #         for tiendx in tieindeces:
-                    #             numsametime = len(tieindeces)
-                    #             if numsametime > 1 and series.has_series_option(SERIES_OPTION_AVERAGETIE):
-                    #                 dbresults[tiendx].overallplace = (thisplace+lasttie) / 2.0
-                    #             else:
-                    #                 dbresults[tiendx].overallplace = thisplace
-            
-                    for gender in ['F', 'M', 'X']:
-                        dbresults = RaceResult.query.filter_by(club_id=club_id,raceid=race.id,seriesid=series.id,gender=gender).order_by(series.orderby).all()
-                        # this is easier, code-wise, than using sqlalchemy desc() function
-                        if series.hightolow:
-                            dbresults.reverse()
-            
-                        numresults = len(dbresults)
-                        for rrndx in range(numresults):
-                            raceresult = dbresults[rrndx]
-                        
-                            # set place if it has not been set before
-                            # place may have been determined at previous iteration, if a tie was detected
-                            if not raceresult.genderplace:
-                                thisplace = rrndx+1
-                                tieindeces = [rrndx]
-                                
-                                # detect tie in subsequent results based on rendering,
-                                # which rounds to a specific precision based on distance
-                                # but do this only if averaging ties
-                                if series.averagetie:
-                                    # TODO: need to change this code to support orderby=='overallplace' and averagetie==True
-                                    time = render.rendertime(raceresult.time,timeprecision)
-                                    for tiendx in range(rrndx+1,numresults):
-                                        if render.rendertime(dbresults[tiendx].time,timeprecision) != time:
-                                            break
-                                        tieindeces.append(tiendx)
-                                    lasttie = tieindeces[-1] + 1
-                                for tiendx in tieindeces:
-                                    numsametime = len(tieindeces)
-                                    if numsametime > 1 and series.averagetie:
-                                        dbresults[tiendx].genderplace = (thisplace+lasttie) / 2.0
-                                    else:
-                                        dbresults[tiendx].genderplace = thisplace
-            
-                    if series.divisions:
-                        for gender in ['F', 'M', 'X']:
-                            
-                            # linear search for correct division
-                            for thisdiv in divisions:
-                                divlow = thisdiv[0]
-                                divhigh = thisdiv[1]
-            
-                                dbresults = RaceResult.query  \
-                                              .filter_by(club_id=club_id,raceid=race.id,seriesid=series.id,gender=gender,divisionlow=divlow,divisionhigh=divhigh) \
-                                              .order_by(series.orderby).all()
-                                # this is easier, code-wise, than using sqlalchemy desc() function
-                                if series.hightolow:
-                                    dbresults.reverse()
-                    
-                                numresults = len(dbresults)
-                                for rrndx in range(numresults):
-                                    raceresult = dbresults[rrndx]
-            
-                                    # set place if it has not been set before
-                                    # place may have been determined at previous iteration, if a tie was detected
-                                    if not raceresult.divisionplace:
-                                        thisplace = rrndx+1
-                                        tieindeces = [rrndx]
-                                        
-                                        # detect tie in subsequent results based on rendering,
-                                        # which rounds to a specific precision based on distance
-                                        # but do this only if averaging ties
-                                        if series.averagetie:
-                                            # TODO: need to change this code to support orderby=='overallplace' and averagetie==True
-                                            time = render.rendertime(raceresult.time,timeprecision)
-                                            for tiendx in range(rrndx+1,numresults):
-                                                if render.rendertime(dbresults[tiendx].time,timeprecision) != time:
-                                                    break
-                                                tieindeces.append(tiendx)
-                                            lasttie = tieindeces[-1] + 1
-                                        for tiendx in tieindeces:
-                                            numsametime = len(tieindeces)
-                                            if numsametime > 1 and series.averagetie:
-                                                dbresults[tiendx].divisionplace = (thisplace+lasttie) / 2.0
-                                            else:
-                                                dbresults[tiendx].divisionplace = thisplace
-            
-                # process age grade results, ordered by agtime
-                elif series.orderby == 'agtime':
-                    for gender in ['F', 'M', 'X']:
-                        dbresults = RaceResult.query.filter_by(club_id=club_id,raceid=race.id,seriesid=series.id,gender=gender).order_by(series.orderby).all()
-                        # this is easier, code-wise, than using sqlalchemy desc() function
-                        if series.hightolow:
-                            dbresults.reverse()
-            
-                        numresults = len(dbresults)
-                        for rrndx in range(numresults):
-                            raceresult = dbresults[rrndx]
-                        
-                            # set place if it has not been set before
-                            # place may have been determined at previous iteration, if a tie was detected
-                            if not raceresult.agtimeplace:
-                                thisplace = rrndx+1
-                                tieindeces = [rrndx]
-                                
-                                # detect tie in subsequent results based on rendering,
-                                # which rounds to a specific precision based on distance
-                                # but do this only if averaging ties
-                                if series.averagetie:
-                                    time = render.rendertime(raceresult.agtime,agtimeprecision)
-                                    for tiendx in range(rrndx+1,numresults):
-                                        if render.rendertime(dbresults[tiendx].agtime,agtimeprecision) != time:
-                                            break
-                                        tieindeces.append(tiendx)
-                                    lasttie = tieindeces[-1] + 1
-                                for tiendx in tieindeces:
-                                    numsametime = len(tieindeces)
-                                    if numsametime > 1 and series.averagetie:
-                                        dbresults[tiendx].agtimeplace = (thisplace+lasttie) / 2.0
-                                    else:
-                                        dbresults[tiendx].agtimeplace = thisplace
-
-                # process age grade results, ordered by agpercent
-                elif series.orderby == 'agpercent':
-                    for gender in ['F', 'M', 'X']:
-                        dbresults = RaceResult.query.filter_by(club_id=club_id,raceid=race.id,seriesid=series.id,gender=gender).order_by(series.orderby).all()
-                        # this is easier, code-wise, than using sqlalchemy desc() function
-                        if series.hightolow:
-                            dbresults.reverse()
-            
-                        numresults = len(dbresults)
-                        #current_app.logger.debug('orderby=agpercent, club_id={}, race.id={}, series.id={}, gender={}, numresults={}'.format(club_id,race.id,series.id,gender,numresults))
-                        for rrndx in range(numresults):
-                            raceresult = dbresults[rrndx]
-                            thisplace = rrndx+1                                
-                            dbresults[rrndx].agtimeplace = thisplace
+    def redirect(self, info):
+        return url_for('frontend.seriesresults',raceid=info.get('raceid'))
+
+bp.add_url_rule('/tabulateresultsstatus/<task_id>',view_func=TabulateResultsStatus.as_view('tabulateresultsstatus'), methods=['GET',])
+
+
+class AjaxRetabulateResults(MethodView):
+    decorators = [login_required]
+
+    def post(self):
+        try:
+            club_id = flask.session['club_id']
+            thisyear = flask.session['year']
+
+            writecheck = UpdateClubDataPermission(club_id)
+
+            # verify user can write the data, otherwise abort
+            if not writecheck.can():
+                db.session.rollback()
+                flask.abort(403)
+
+            # all the series for the year, or a single series
+            seriesid = request.args.get('seriesid', None, type=int)
+            races = retabulationraces(club_id, thisyear, seriesid)
+            if not races:
+                db.session.rollback()
+                return failure_response(cause='No tabulated races found')
+
+            # verify user wants to overwrite the series results
+            if not request.args.get('force')=='true':
+                db.session.rollback()
+                return failure_response(cause='Retabulate {} races?'.format(len(races)),confirm=True)
+
+            # start tasks to retabulate the races
+            task = retabulateresults(club_id, thisyear, seriesid)
 
             # commit database updates and close transaction
             db.session.commit()
-            return success_response(redirect=url_for('frontend.seriesresults',raceid=raceid))
-        
+            return jsonify({'success': True, 'current': 0, 'total': len(races),
+                            'location': url_for('.retabulateresultsstatus', task_id=task.id, group_id=task.parent.id)}), 202, {}
+
         except Exception as e:
             # roll back database updates and close transaction
             db.session.rollback()
@@ -1941,7 +1669,69 @@ class AjaxTabulateResults(MethodView):
             current_app.logger.error(traceback.format_exc())
             return failure_response(cause=cause)
 
-bp.add_url_rule('/_tabulateresults/<int:raceid>',view_func=AjaxTabulateResults.as_view('_tabulateresults'),methods=['POST'])
+bp.add_url_rule('/_retabulateresults',view_func=AjaxRetabulateResults.as_view('_retabulateresults'),methods=['POST'])
+
+
+class RetabulateResultsStatus(MethodView):
+    decorators = [login_required]
+
+    def get(self, task_id, group_id):
+        task = retabulatedonetask.AsyncResult(task_id)
+        races = GroupResult.restore(group_id, app=retabulatedonetask.app)
+        total = len(races.results) if races else 1
+
+        # races are counted as they finish, then standings are refreshed
+        if task.state in ['PENDING', 'STARTED']:
+            response = {
+                'state': 'PROGRESS',
+                'current': races.completed_count() if races else 0,
+                'total': total,
+                'status': 'Retabulating...'
+            }
+
+        elif task.state == 'SUCCESS':
+            response = {
+                'state': task.state,
+                'current': total,
+                'total': total,
+                'cause': task.info.get('traceback',''),
+            }
+
+            # report races which couldn't be tabulated
+            failures = task.info.get('failures', [])
+            if failures:
+                causedom = div()
+                with causedom:
+                    p('The following races were not retabulated. Please correct and retabulate them.')
+                    with ul():
+                        for failure in failures:
+                            # cause is html from tabulation, traceback is text
+                            if failure['cause']:
+                                li('{}: '.format(failure['race']), raw(failure['cause']))
+                            else:
+                                li('{}: {}'.format(failure['race'], failure['traceback']))
+                response['cause'] = causedom.render()
+                response['failures'] = failures
+
+            try:
+                task.forget()
+                if races:
+                    races.forget()
+            except NotImplementedError:
+                # some backends don't implement forget
+                pass
+
+        else:
+            # something went wrong in the background job
+            response = {
+                'state': task.state,
+                'current': total,
+                'total': total,
+                'cause': str(task.info),  # this is the exception raised
+            }
+        return jsonify(response)
+
+bp.add_url_rule('/retabulateresultsstatus/<task_id>/<group_id>',view_func=RetabulateResultsStatus.as_view('retabulateresultsstatus'), methods=['GET',])
 
 ###########################################################################################
 # downloadresults endpoint
@@ -105,7 +105,7 @@ class TestStandings(MethodView):
                 racerows.append(thisrow)
                 
             # prepare to collect all the results for this series which have any results
-            rr = StandingsRenderer(club_id,thisyear,thisseries,races,racenums)
+            rr = StandingsRenderer(club_id,thisyear,thisseries,races,racenums,bulkload=True)
                 
             # declare "file" handler for HTML file type
             fh = HtmlStandingsHandler(racenums)
@@ -4,26 +4,59 @@ userviews - frontend views which don't require login
 """
 # standard
 import traceback
+from tempfile import TemporaryFile
+from hashlib import sha1
+from datetime import timezone
 
 # pypi
 import flask
 from flask import request, url_for, current_app, abort
 from flask.views import MethodView
-import loutilities.renderrun as render
+from flask_login import current_user
 
 # home grown
 from . import bp
 from ...model import SERIES_OPTION_DISPLAY_CLUB, db
 from ...model import Runner, RaceResult, Race, Series, RaceSeries, Club
 from ...forms import SeriesResultForm, StandingsForm
-from ...renderstandings import HtmlStandingsHandler, StandingsRenderer, addstyle
+from ...renderstandings import addstyle, StandingsRenderer, YearStandingsRenderer, XlsxStandingsHandler, JsonStandingsHandler
+from ...standingscache import getstandings, getseriesresults, standingsversion, renderstandings, loadcolumns, STANDINGS_ENGINES, GENDERS
+from ...seasonarchive import getstandingssnapshot, getseriesresultssnapshot
 from ...apicommon import failure_response, success_response
-from ...resultsutils import clubaffiliationelement
+from ...accesscontrol import UpdateClubDataPermission
 
 # admin guide
 from ...version import __docversion__
 adminguide = f'https://docs.scoretility.com/en/{__docversion__}/scoring-user-reference.html'
 
+# finalized seasons' snapshots only change if the season is reopened, see archivedresponse()
+ARCHIVE_MAX_AGE = 60*60
+
+def archivedresponse(response, archived_at):
+    '''
+    set caching headers for a response served from a finalized season's snapshot, and answer conditional requests
+
+    the snapshot is removed if the season is reopened, without changing the url, so the response isn't immutable.
+    the tradeoff is that browsers and shared caches may show the archived page for up to ARCHIVE_MAX_AGE after
+    the season is reopened, and after that they revalidate using ETag / Last-Modified, which is answered with
+    304 Not Modified until the season is reopened or finalized again
+
+    pages for logged in users may differ, so those may only be cached by the browser
+
+    :param response: flask response
+    :param archived_at: datetime when snapshot was stored
+    :rtype: response
+    '''
+    response.cache_control.max_age = ARCHIVE_MAX_AGE
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.last_modified = archived_at.replace(microsecond=0).astimezone(timezone.utc)
+    if not response.get_etag()[0]:
+        response.add_etag()
+    return response.make_conditional(request)
+
 #################################
 # seriesresults endpoint
 #################################
@@ -53,62 +86,24 @@ class SeriesResults(MethodView):
                 db.session.rollback()
                 abort(404)
             
-            # determine precision for rendered output
-            timeprecision,agtimeprecision = render.getprecision(race.distance,surface=race.surface)
-            
-            # get all the results, and the race record
-            results = []
-            for series in race.series:
-                seriesid = series.id
-                seriesresults = RaceResult.query.filter_by(raceid=raceid,seriesid=seriesid).order_by(series.orderby).all()
-                # this is easier, code-wise, than using sqlalchemy desc() function
-                if series.hightolow:
-                    seriesresults.reverse()
-                results += seriesresults
-            
-            # fix up the following:
-            #   * time gets converted from seconds
-            #   * determine member matching, set runnerid choices and initially selected choice
-            #   * based on matching, set disposition
-            displayresults = []
-            for result in results:
-                runner = Runner.query.filter_by(id=result.runnerid).first()
-                thisname = runner.name
-                series = Series.query.filter_by(id=result.seriesid).first()
-                thisseries = series.name
-                thistime = render.rendertime(result.time,timeprecision)
-                thisagtime = render.rendertime(result.agtime,agtimeprecision)
-                thispace = render.rendertime(result.time / race.distance, 0, useceiling=False)
-                thisdiv = ''
-                if not result.divisionlow and not result.divisionhigh:
-                    thisdiv=''
-                elif not result.divisionlow or result.divisionlow <= 1:
-                    thisdiv = '{} and under'.format(result.divisionhigh)
-                elif result.divisionhigh == 99 or not result.divisionhigh:
-                    thisdiv = '{} and up'.format(result.divisionlow)
-                else:
-                    thisdiv = '{} - {}'.format(result.divisionlow,result.divisionhigh)
-
-                clubaffiliation = clubaffiliationelement(result)
-                if not clubaffiliation:
-                    clubaffiliation = ''
-
-                if result.genderplace:
-                    thisplace = result.genderplace
-                elif result.agtimeplace:
-                    thisplace = result.agtimeplace
-                else:
-                    thisplace = None
-
-                # order must match that which is expected within seriesresults.html
-                displayresults.append((result,thisseries,thisplace,thisname,thistime,thisdiv,clubaffiliation,thisagtime,thispace))
+            # get the rendered results for all the race's series, from the finalized season's snapshot, else
+            # from the series results cache if available
+            snapshot = getseriesresultssnapshot(race.club_id, race)
+            if snapshot:
+                displayresults, archived_at = snapshot
+            else:
+                displayresults = getseriesresults(race.club_id, race)
             
             # commit database updates and close transaction
             db.session.commit()
-            return flask.render_template('seriesresults.html',form=form,race=race,resultsdata=displayresults,
-                                         adminguide=adminguide,
-                                         series=seriesarg,division=division,gender=gender,printerfriendly=printerfriendly,
-                                         inhibityear=True,inhibitclub=True)
+            response = flask.make_response(
+                flask.render_template('seriesresults.html',form=form,race=race,resultsdata=displayresults,
+                                      adminguide=adminguide,
+                                      series=seriesarg,division=division,gender=gender,printerfriendly=printerfriendly,
+                                      inhibityear=True,inhibitclub=True))
+            if snapshot:
+                archivedresponse(response, archived_at)
+            return response
         
         except:
             # roll back database updates and close transaction
@@ -155,11 +150,24 @@ class ViewStandings(MethodView):
             seriesid = thisseries.id
             thisyear = year
             
+            # club admins may request a standings engine to compare engines, else standings come from the cache
+            # engine recomputes the standings on every request, so it isn't available to other users
+            engine = request.args.get('engine')
+            if (engine not in STANDINGS_ENGINES or not current_user.is_authenticated
+                    or not UpdateClubDataPermission(club_id).can()):
+                engine = None
+
             form = StandingsForm()
     
+            # finalized seasons are served from their snapshot, without rendering the standings, even if engine was requested
+            snapshot = getstandingssnapshot(club_id, thisseries)
+
             # get races for this series, in date order
-            thequery = Race.query.join(RaceSeries).join(Series).filter(Series.id==seriesid,Series.active==True).order_by(Race.date)
-            races = thequery.all()
+            if snapshot:
+                races = snapshot.races
+            else:
+                thequery = Race.query.join(RaceSeries).join(Series).filter(Series.id==seriesid,Series.active==True).order_by(Race.date)
+                races = thequery.all()
             racenums = list(range(1,len(races)+1))
             resulturls = [flask.url_for('.seriesresults',raceid=r.id) for r in races]
             
@@ -184,12 +192,18 @@ class ViewStandings(MethodView):
                         thisrow.append({'num':None,'resultsurl':'','race':''})
                 racerows.append(thisrow)
                 
-            # prepare to collect all the results for this series which have any results
-            rr = StandingsRenderer(club_id,thisyear,thisseries,races,racenums)
-                
-            # declare "file" handler for HTML file type
-            fh = HtmlStandingsHandler(racenums)
-            rr.renderseries(fh)
+            # collect the rendered standings for this series, from the standings cache if available
+            # if gender or division are explicitly requested only that slice is sent, else all the
+            # standings are sent and the gender and division filters are applied in the browser
+            if snapshot:
+                allrows = snapshot.standings(gender=gender if gender in GENDERS else None,
+                                             division=request.args.get('div'))
+            else:
+                allrows = getstandings(club_id,thisyear,thisseries,races,racenums,
+                                       verify=current_app.config.get('STANDINGS_VERIFY_INCREMENTAL', False),
+                                       engine=engine,
+                                       gender=gender if gender in GENDERS else None,
+                                       division=request.args.get('div'))
 
             roworder = ['division','place','name','gender','age'] 
             if thisseries.has_series_option(SERIES_OPTION_DISPLAY_CLUB):
@@ -212,7 +226,7 @@ class ViewStandings(MethodView):
             standings = []
             firstheader = True
             for gen in ['F', 'M', 'X']:
-                rows = fh.iter(gen)
+                rows = allrows[gen]
                 for row in rows:
                     row['gender'] = addstyle(row['header'],gen,'gender')
                     #row['name'] = '<a href="{}?{}">{}</a>'.format(flask.url_for('runnerresults'),urllib.urlencode({'name':row['name'],'series':thisseries.name}),row['name'])
@@ -231,12 +245,16 @@ class ViewStandings(MethodView):
             
             # commit database updates and close transaction
             db.session.commit()
-            return flask.render_template('viewstandings.html',form=form,headingdata=headingdata,
-                                         adminguide=adminguide,
-                                         racerows=racerows,standings=standings,description=description,
-                                         displayclub=thisseries.has_series_option(SERIES_OPTION_DISPLAY_CLUB),
-                                         division=division,gender=gender,printerfriendly=printerfriendly,
-                                         inhibityear=True,inhibitclub=True)
+            response = flask.make_response(
+                flask.render_template('viewstandings.html',form=form,headingdata=headingdata,
+                                      adminguide=adminguide,
+                                      racerows=racerows,standings=standings,description=description,
+                                      displayclub=thisseries.has_series_option(SERIES_OPTION_DISPLAY_CLUB),
+                                      division=division,gender=gender,printerfriendly=printerfriendly,
+                                      inhibityear=True,inhibitclub=True))
+            if snapshot:
+                archivedresponse(response, snapshot.archived_at)
+            return response
         
         except Exception as e:
             # roll back database updates and close transaction
@@ -250,6 +268,178 @@ class ViewStandings(MethodView):
 bp.add_url_rule('/viewstandings/',view_func=ViewStandings.as_view('viewstandings'),methods=['GET'])
 
 
+class ExportStandings(MethodView):
+
+    def get(self):
+        try:
+            club = request.args.get('club')
+            year = request.args.get('year')
+            series = request.args.get('series')
+
+            thisclub = Club.query.filter_by(shname=club).first()
+            if not thisclub:
+                db.session.rollback()
+                cause = "Error: club '{}' does not exist".format(club)
+                flask.flash(cause)
+                current_app.logger.error(cause)
+                return flask.redirect(flask.url_for('frontend.index'))
+            club_id = thisclub.id
+
+            # rows are written to the workbook's worksheets as each series is rendered
+            # finalized seasons are written from their snapshot, without rendering the standings
+            fh = XlsxStandingsHandler()
+
+            # single series
+            if series:
+                thisseries = Series.query.filter_by(club_id=club_id,name=series,year=year).first()
+                if not thisseries:
+                    db.session.rollback()
+                    cause = "Error: series '{}' does not exist for '{}' club".format(series,thisclub.name)
+                    flask.flash(cause)
+                    current_app.logger.error(cause)
+                    return flask.redirect(flask.url_for('frontend.index'))
+                snapshot = getstandingssnapshot(club_id, thisseries)
+                if snapshot:
+                    snapshot.writexlsx(fh)
+                else:
+                    races = Race.query.join(RaceSeries).join(Series).filter(Series.id==thisseries.id,Series.active==True).order_by(Race.date).all()
+                    racenums = list(range(1,len(races)+1))
+                    fh.setraces(races, racenums)
+                    StandingsRenderer(club_id,year,thisseries,races,racenums,bulkload=True).renderseries(fh)
+                filename = '{}-{}-{}-standings.xlsx'.format(thisclub.shname,year,series)
+
+            # all the club's series for the year
+            else:
+                allseries = Series.query.filter_by(club_id=club_id,year=year,active=True).order_by(Series.name,Series.id).all()
+                snapshots = {s.id: getstandingssnapshot(club_id, s) for s in allseries}
+                yearstandings = YearStandingsRenderer(club_id,year,excludeseries=[id for id in snapshots if snapshots[id]])
+                def handlerfactory(thisseries, racenums):
+                    fh.setraces(yearstandings.races[thisseries.id], racenums)
+                    return fh
+                # series which aren't finalized are rendered in the same order, as they are reached
+                rendered = yearstandings.render(handlerfactory)
+                for thisseries in allseries:
+                    if snapshots[thisseries.id]:
+                        snapshots[thisseries.id].writexlsx(fh)
+                    else:
+                        next(rendered)
+                filename = '{}-{}-standings.xlsx'.format(thisclub.shname,year)
+
+            # workbook is saved to a temporary file, which is sent to the browser in blocks
+            xlsxfile = TemporaryFile()
+            fh.save(xlsxfile)
+            xlsxfile.seek(0)
+
+            # commit database updates and close transaction
+            db.session.commit()
+            return flask.send_file(xlsxfile, as_attachment=True, download_name=filename,
+                                   mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+        except Exception as e:
+            # roll back database updates and close transaction
+            db.session.rollback()
+            current_app.logger.error(traceback.format_exc())
+            raise
+
+bp.add_url_rule('/exportstandings/',view_func=ExportStandings.as_view('exportstandings'),methods=['GET'])
+
+
+# default and maximum number of standings rows per page for StandingsJson
+STANDINGS_PAGE_SIZE = 100
+STANDINGS_MAX_PAGE_SIZE = 1000
+
+class StandingsJson(MethodView):
+
+    def get(self):
+        try:
+            club = request.args.get('club')
+            year = request.args.get('year')
+            series = request.args.get('series')
+            gender = request.args.get('gen')
+            division = request.args.get('div')
+            try:
+                page = int(request.args.get('page', 1))
+                per_page = min(int(request.args.get('per_page', STANDINGS_PAGE_SIZE)), STANDINGS_MAX_PAGE_SIZE)
+            except ValueError:
+                db.session.rollback()
+                return failure_response(cause='page and per_page must be integers'), 400
+            if page < 1 or per_page < 1:
+                db.session.rollback()
+                return failure_response(cause='page and per_page must be positive'), 400
+            if gender and gender not in GENDERS:
+                db.session.rollback()
+                return failure_response(cause="gen must be one of {}".format(', '.join(GENDERS))), 400
+
+            thisclub = Club.query.filter_by(shname=club).first()
+            thisseries = Series.query.filter_by(club_id=thisclub.id,name=series,year=year).first() if thisclub else None
+            if not thisseries:
+                db.session.rollback()
+                cause = "series '{}' does not exist for club '{}' year {}".format(series,club,year)
+                return failure_response(cause=cause), 404
+            club_id = thisclub.id
+
+            # finalized seasons are served from their snapshot, which is versioned by when it was archived
+            snapshot = getstandingssnapshot(club_id, thisseries)
+            if snapshot:
+                races = snapshot.races
+            else:
+                races = Race.query.join(RaceSeries).join(Series).filter(Series.id==thisseries.id,Series.active==True).order_by(Race.date).all()
+            racenums = list(range(1,len(races)+1))
+
+            # the standings version only changes when the cached standings are invalidated, e.g., when results
+            # are tabulated, so polling clients can be answered without rendering the standings
+            if snapshot:
+                version = snapshot.archived_at
+            else:
+                version = standingsversion(club_id, year, thisseries, races, racenums)
+            db.session.commit()
+            etag = sha1('{}/{}/{}/{}/{}/{}/{}/{}'.format(club_id, thisseries.id, year, version.isoformat(),
+                                                         gender, division, page, per_page).encode()).hexdigest()
+            lastmodified = version.replace(microsecond=0).astimezone(timezone.utc)
+            if request.if_none_match:
+                notmodified = request.if_none_match.contains(etag)
+            else:
+                notmodified = request.if_modified_since is not None and lastmodified <= request.if_modified_since
+            if notmodified:
+                response = flask.make_response('', 304)
+
+            else:
+                # collected standings columns are used, so only totals and ties need to be calculated
+                genders = [gender] if gender else GENDERS
+                if snapshot:
+                    rows = snapshot.jsonrows(genders, division)
+                else:
+                    fh, columns = renderstandings(club_id, year, thisseries, races, racenums,
+                                                  columns=loadcolumns(club_id, thisseries, races),
+                                                  genders=genders, division=division, fh=JsonStandingsHandler())
+                    rows = [row for gen in genders for row in fh.iter(gen)]
+                start = (page - 1) * per_page
+                response = success_response(club=thisclub.shname, year=thisseries.year, series=thisseries.name,
+                                            gender=gender, division=division,
+                                            races=[{'race': racenum, 'name': race.name, 'date': race.date}
+                                                   for racenum, race in zip(racenums, races)],
+                                            page=page, per_page=per_page, total=len(rows),
+                                            standings=rows[start:start+per_page])
+
+            # commit database updates and close transaction
+            db.session.commit()
+
+            response.set_etag(etag)
+            response.last_modified = lastmodified
+            if snapshot:
+                archivedresponse(response, snapshot.archived_at)
+            return response
+
+        except Exception as e:
+            # roll back database updates and close transaction
+            db.session.rollback()
+            cause = 'Unexpected Error: {}\n{}'.format(e,traceback.format_exc())
+            current_app.logger.error(cause)
+            return failure_response(cause=cause), 500
+
+bp.add_url_rule('/standings/json',view_func=StandingsJson.as_view('standings/json'),methods=['GET'])
+
+
 class AjaxGetSeries(MethodView):
     
     def post(self):
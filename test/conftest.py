@@ -9,6 +9,7 @@ import pytest
 from flask import Flask
 
 from rrwebapp.model import db
+from rrwebapp.clubmember import DbClubMember
 
 # deliberately NOT using rrwebapp.create_app(): it unconditionally registers the admin
 # blueprint, which imports views/admin/member.py -> tasks.py -> celery.py, and celery.py
@@ -31,6 +32,8 @@ def app():
 @pytest.fixture
 def dbapp(app):
     """app fixture with a fresh in-memory database created for the test."""
+    # member pools cached for an earlier database would be reused, as club ids and versions start over
+    DbClubMember.pools.clear()
     with app.app_context():
         db.drop_all()
         db.create_all()
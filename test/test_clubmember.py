@@ -1,6 +1,10 @@
 import io
 
-from rrwebapp.clubmember import CsvClubMember, getratio
+import pytest
+from sqlalchemy import event
+
+from rrwebapp.model import db, Club, Runner
+from rrwebapp.clubmember import CsvClubMember, DbClubMember, getratio
 
 SIMPLE_CSV = (
     "First,Last,DOB,Gender,City,State\n"
@@ -106,3 +110,177 @@ def test_clubmember_stops_at_first_blank_name_row(dbapp):
 
     assert 'jane doe' in members
     assert 'john smith' not in members
+
+
+FIRSTNAMES = ['jane', 'john', 'mary', 'michael', 'sarah', 'david', 'emily', 'robert', 'anne', 'ann',
+              'chris', 'christopher', 'kim', 'lee', 'jo', 'maria', 'mario', 'li', 'jean-luc', "o'neil"]
+LASTNAMES = ['doe', 'smith', 'johnson', 'lee', 'li', 'nguyen', 'garcia', 'miller', 'o\'brien', 'van der berg',
+             'smyth', 'jonson', 'ng', 'müller', 'muller', 'brown', 'browne', 'kim', 'davis', 'davies']
+
+
+SYLLABLES = ['an', 'ber', 'ca', 'dal', 'el', 'fitz', 'gor', 'ha', 'is', 'jor', 'ka', 'lin', 'mo', 'nel',
+             'or', 'pe', 'quin', 'ro', 'son', 'ta', 'ul', 'vi', 'wat', 'yo', 'zel']
+
+
+def _namecorpus(numnames, seed=1):
+    """member names, and result names which are some of the names with typos, plus some unrelated names"""
+    import random
+    rand = random.Random(seed)
+    def lastname():
+        if rand.random() < 0.3:
+            return rand.choice(LASTNAMES)
+        return ''.join(rand.choice(SYLLABLES) for i in range(rand.randint(2, 4)))
+    names = set()
+    while len(names) < numnames:
+        names.add('{} {}'.format(rand.choice(FIRSTNAMES), lastname()))
+    names = sorted(names)
+    queries = []
+    for name in rand.sample(names, 30):
+        queries.append(name)
+        chars = list(name)
+        pos = rand.randrange(len(chars))
+        chars[pos] = rand.choice('abcdeiklmnorsty ')
+        queries.append(''.join(chars))
+        queries.append(name.split(' ')[-1] + ' ' + name.split(' ')[0])
+    queries += ['', 'x', 'zzz qqq', 'j', 'jane', "o'neil o'brien", 'müller']
+    return names, queries
+
+
+def test_nameindex_matches_difflib():
+    import difflib
+    from rrwebapp.clubmember import NameIndex
+    names, queries = _namecorpus(300)
+    index = NameIndex(names)
+
+    for cutoff in [0.5, 0.6, 0.7, 0.9, 1.0]:
+        for query in queries:
+            assert [name for ratio, name in index.get_close_matches(query, cutoff=cutoff)] == \
+                difflib.get_close_matches(query, names, cutoff=cutoff), (query, cutoff)
+
+
+@pytest.mark.benchmark
+def test_nameindex_faster_than_difflib():
+    import difflib, time
+    from rrwebapp.clubmember import NameIndex
+    names, queries = _namecorpus(3000)
+    index = NameIndex(names)
+
+    started = time.perf_counter()
+    for query in queries:
+        difflib.get_close_matches(query, names, cutoff=0.7)
+    difflibtime = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for query in queries:
+        index.get_close_matches(query, cutoff=0.7)
+    indextime = time.perf_counter() - started
+
+    assert indextime < difflibtime / 2, (indextime, difflibtime)
+
+
+def test_getmember_memoizes_matches(dbapp):
+    with dbapp.app_context():
+        cm = _mkclubmember()
+        first = cm.getmember('Jane Doi')
+        first['matchingmembers'].append('changed')
+        second = cm.getmember('jane doi')
+
+    assert len(second['matchingmembers']) == 1
+    assert cm.lastratio == getratio('jane doi', 'jane doe')
+
+
+@pytest.fixture
+def poolapp(dbapp):
+    """dbapp with a club and some runners"""
+    with dbapp.app_context():
+        club = Club('fsrc', 'Frederick Steeplechasers')
+        db.session.add(club)
+        db.session.flush()
+        db.session.add(Runner(club.id, 'Jane Mary Doe', '1990-01-02', 'F', 'Frederick, MD'))
+        db.session.add(Runner(club.id, 'Bob Smith', None, 'M', 'Baltimore, Maryland, MD', member=False))
+        db.session.commit()
+        dbapp.club_id = club.id
+        yield dbapp
+
+
+def test_dbclubmember_member_entries(poolapp):
+    pool = DbClubMember(club_id=poolapp.club_id)
+    members = pool.getmembers()
+
+    assert members['jane mary doe'] == [{
+        'id': '1', 'name': 'Jane Mary Doe', 'fname': 'Jane Mary', 'lname': 'Doe', 'mname': '',
+        'dob': '1990-01-02', 'gender': 'F', 'hometown': 'Frederick, MD', 'renewdate': None, 'expdate': None,
+        'member': 'True', 'estdateofbirth': '',
+    }]
+    assert members['bob smith'][0]['dob'] == ''
+    assert members['bob smith'][0]['hometown'] == 'Baltimore, Maryland, MD'
+    assert pool.findmember('Jane Doe', 30, '2020-06-01') == ('Jane Mary Doe', '1990-01-02')
+    assert list(DbClubMember(club_id=poolapp.club_id, member=True).getmembers()) == ['jane mary doe']
+
+
+def test_dbclubmember_pool_reused_until_runners_change(poolapp):
+    club_id = poolapp.club_id
+    first = DbClubMember(club_id=club_id)
+
+    assert DbClubMember(club_id=club_id).members is first.members
+    assert DbClubMember(club_id=club_id, member=True).members is not first.members
+
+    runner = Runner.query.filter_by(name='Bob Smith').one()
+    runner.hometown = 'Frederick, MD'
+    db.session.commit()
+    second = DbClubMember(club_id=club_id)
+    assert second.members is not first.members
+    assert second.getmembers()['bob smith'][0]['hometown'] == 'Frederick, MD'
+
+    db.session.add(Runner(club_id, 'Ann Lee', '1980-03-03', 'F', 'Frederick, MD'))
+    db.session.commit()
+    third = DbClubMember(club_id=club_id)
+    assert 'ann lee' in third.getmembers()
+
+    db.session.delete(Runner.query.filter_by(name='Ann Lee').one())
+    db.session.commit()
+    assert 'ann lee' not in DbClubMember(club_id=club_id).getmembers()
+
+
+def test_dbclubmember_uncommitted_runners_not_cached(poolapp):
+    club_id = poolapp.club_id
+    db.session.add(Runner(club_id, 'Ann Lee', '1980-03-03', 'F', 'Frederick, MD'))
+    db.session.flush()
+
+    assert 'ann lee' in DbClubMember(club_id=club_id).getmembers()
+    assert DbClubMember.pools == {}
+
+    db.session.rollback()
+    assert 'ann lee' not in DbClubMember(club_id=club_id).getmembers()
+    assert len(DbClubMember.pools) == 1
+
+    # pending runners are flushed when the pool is checked
+    db.session.add(Runner(club_id, 'Ann Lee', '1980-03-03', 'F', 'Frederick, MD'))
+    assert 'ann lee' in DbClubMember(club_id=club_id).getmembers()
+
+
+def test_runnersversion_bumped_once_at_commit(poolapp):
+    club_id = poolapp.club_id
+    updates = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('UPDATE CLUB'):
+            updates.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        version = db.session.get(Club, club_id).runnersversion
+        for name in ['Ann Lee', 'Cal Ray']:
+            db.session.add(Runner(club_id, name, '1980-03-03', 'F', 'Frederick, MD'))
+            db.session.flush()
+        assert updates == []
+
+        Runner.query.filter_by(name='Ann Lee').one().hometown = 'Baltimore, MD'
+        db.session.commit()
+        assert len(updates) == 1
+        assert db.session.get(Club, club_id).runnersversion == version + 1
+
+        # changes which are only flushed by commit are counted
+        Runner.query.filter_by(name='Cal Ray').one().hometown = 'Baltimore, MD'
+        db.session.commit()
+        assert db.session.get(Club, club_id).runnersversion == version + 2
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
@@ -118,3 +118,38 @@ def test_raceresults_raises_headererror_when_no_header_found(tmp_path, dbapp):
     with dbapp.app_context():
         with pytest.raises(headerError):
             RaceResults(filename, DISTANCE)
+
+
+def test_raceresults_count_rows_after_header(tmp_path, dbapp):
+    csv_text = (
+        "Frederick 5K results\n"
+        "\n"
+        + SIMPLE_CSV +
+        "3,No Time,M,40,,Frederick,MD,FSRC"
+    )
+    filename = _write(tmp_path, csv_text)
+    with dbapp.app_context():
+        rr = RaceResults(filename, DISTANCE)
+        count = rr.count()
+        results = list(rr)
+        rr.close()
+
+    # row without time is counted, but skipped when read
+    assert count == 3
+    assert len(results) == 2
+
+
+def test_raceresults_count_xlsx(tmp_path, dbapp):
+    from openpyxl import Workbook
+    wb = Workbook()
+    ws = wb.active
+    for line in SIMPLE_CSV.splitlines():
+        ws.append(line.split(','))
+    filename = str(tmp_path / 'results.xlsx')
+    wb.save(filename)
+    with dbapp.app_context():
+        rr = RaceResults(filename, DISTANCE)
+        count = rr.count()
+        rr.close()
+
+    assert count == 2
@@ -0,0 +1,1122 @@
+import io
+
+import pytest
+from openpyxl import load_workbook
+from flask import Blueprint
+from sqlalchemy import event
+
+from rrwebapp.model import (
+    db, Club, Runner, Race, Series, RaceSeries, RaceResult, ManagedResult, Divisions, StandingsCache,
+    StandingsColumn, SeriesResultsCache, AgeGradeTable, AgeGradeCategory, AgeGradeFactor,
+)
+from rrwebapp.renderstandings import (
+    StandingsRenderer, YearStandingsRenderer, HtmlStandingsHandler, XlsxStandingsHandler, JsonStandingsHandler, RaceStanding, RunnerStanding, Points, resultsiterator, scoreresults, scoreseries, parameterError,
+)
+from rrwebapp.standingscache import getstandings, invalidatestandings, invalidaterace, getseriesresults, prewarm, GENDERS
+from rrwebapp import standingscache
+from rrwebapp.sqlstandings import SqlStandingsRenderer
+from rrwebapp.tabulation import TabulateResults, tabulationError, placeresults, retabulationraces
+from rrwebapp.seasonarchive import finalizeseason, reopenseason, getstandingssnapshot, getseriesresultssnapshot, untabulatedraces
+
+
+# ---------------------------------------------------------------------------
+# fixtures
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def stdapp(dbapp):
+    """dbapp with a stand-in admin.results endpoint, which HtmlStandingsHandler links runner names to"""
+    admin = Blueprint('admin', __name__)
+    admin.add_url_rule('/results', 'results', lambda: '')
+    dbapp.register_blueprint(admin)
+    with dbapp.test_request_context():
+        yield dbapp
+
+
+# (name, gender, dateofbirth, estdateofbirth)
+RUNNERS = [
+    ('Alice Abel', 'F', '1980-06-01', False),
+    ('Beth Baker', 'F', '1985-02-01', False),
+    ('Cara Cole', 'F', '1990-09-01', True),
+    ('Dana Dunn', 'F', '', None),
+    ('Ed Evans', 'M', '1975-03-01', False),
+    ('Fred Ford', 'M', '1988-11-01', False),
+    ('Gus Gray', 'M', '1992-04-01', False),
+]
+
+# per race, (name, time) in finishing order
+RACES = [
+    ('Race One', '2020-03-01', [('Alice Abel', 1200), ('Ed Evans', 1210), ('Beth Baker', 1300), ('Fred Ford', 1310),
+                                ('Cara Cole', 1400), ('Gus Gray', 1500)]),
+    ('Race Two', '2020-04-01', [('Fred Ford', 1190), ('Beth Baker', 1250), ('Ed Evans', 1260), ('Alice Abel', 1280),
+                                ('Dana Dunn', 1350)]),
+    ('Race Three', '2020-05-01', [('Gus Gray', 1180), ('Alice Abel', 1220), ('Beth Baker', 1225), ('Dana Dunn', 1290),
+                                  ('Ed Evans', 1300), ('Cara Cole', 1320)]),
+]
+
+DIVISIONS = [(1, 29), (30, 39), (40, 99)]
+
+
+def _mkstandings(**seriesattrs):
+    """create club, series, races, runners and tabulated results for standings tests
+
+    :rtype: club, series, races
+    """
+    club = Club(shname='c', name='Club C')
+    db.session.add(club)
+    db.session.flush()
+
+    attrs = dict(club_id=club.id, name='Grand Prix', year=2020, orderby='time', hightolow=False,
+                 averagetie=False, multiplier=1, maxgenpoints=10, maxdivpoints=5, maxraces=2,
+                 maxbynumrunners=False, options='', tieoptions='head_to_head_points, average_points',
+                 oaawards=1, divawards=1, minraces=None, active=True)
+    attrs.update(seriesattrs)
+    series = Series(**attrs)
+    db.session.add(series)
+    db.session.flush()
+
+    for divlow, divhigh in DIVISIONS:
+        db.session.add(Divisions(club_id=club.id, year=2020, seriesid=series.id,
+                                 divisionlow=divlow, divisionhigh=divhigh, active=True))
+
+    runners = {}
+    for name, gender, dob, estdob in RUNNERS:
+        runner = Runner(club.id, name=name, dateofbirth=dob, gender=gender, estdateofbirth=estdob,
+                        member=not estdob and dob != '')
+        db.session.add(runner)
+        runners[name] = runner
+    db.session.flush()
+
+    races = []
+    for racename, date, finishers in RACES:
+        race = Race(club_id=club.id, name=racename, year=2020, date=date, distance=3.1, surface='road', active=True)
+        db.session.add(race)
+        db.session.flush()
+        db.session.add(RaceSeries(race.id, series.id))
+        races.append(race)
+
+        genderplace = {}
+        divisionplace = {}
+        for place, (name, time) in enumerate(finishers, 1):
+            runner = runners[name]
+            age = 2020 - int(runner.dateofbirth[0:4]) if runner.dateofbirth else 35
+            db.session.add(ManagedResult(club.id, race.id, place=place, name=name, gender=runner.gender, age=age,
+                                         time=time, runnerid=runner.id))
+            div = [d for d in DIVISIONS if d[0] <= age <= d[1]][0]
+            genderplace[runner.gender] = genderplace.get(runner.gender, 0) + 1
+            divisionplace[runner.gender, div] = divisionplace.get((runner.gender, div), 0) + 1
+            db.session.add(RaceResult(club.id, runner.id, race.id, series.id, time, runner.gender, age,
+                                      divisionlow=div[0], divisionhigh=div[1], overallplace=place,
+                                      genderplace=genderplace[runner.gender],
+                                      divisionplace=divisionplace[runner.gender, div]))
+    db.session.commit()
+
+    return club, series, races
+
+
+def _render(club, series, races, renderer=StandingsRenderer, **kwargs):
+    """render series standings with HtmlStandingsHandler
+
+    :rtype: {gen: [pline, ...], ...} for the genders rendered
+    """
+    racenums = list(range(1, len(races) + 1))
+    rr = renderer(club.id, 2020, series, races, racenums, **kwargs)
+    fh = HtmlStandingsHandler(racenums)
+    rr.renderseries(fh)
+    return {gen: list(fh.iter(gen)) for gen in fh.HTML}
+
+
+def _countqueries(kinds=('SELECT',)):
+    """count statements issued within the context of the test
+
+    :param kinds: statement types to count
+    :rtype: list, appended to for each statement
+    """
+    selects = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(kinds):
+            selects.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return selects
+
+
+# ---------------------------------------------------------------------------
+# bulk loading
+# ---------------------------------------------------------------------------
+
+def test_loadresults_partitions_by_gender_and_race_in_standings_order(stdapp):
+    club, series, races = _mkstandings()
+    rr = StandingsRenderer(club.id, 2020, series, races, [1, 2, 3], bulkload=True)
+
+    bulkresults = rr.loadresults()
+
+    assert set(bulkresults) == {'F', 'M'}
+    for race in races:
+        for gen in ['F', 'M']:
+            expected = RaceResult.query.order_by('time').filter_by(club_id=club.id, raceid=race.id,
+                                                                  seriesid=series.id, gender=gen).all()
+            assert bulkresults[gen][race.id] == expected
+
+
+def test_loadresults_reverses_partitions_for_hightolow(stdapp):
+    club, series, races = _mkstandings(hightolow=True)
+    rr = StandingsRenderer(club.id, 2020, series, races, [1, 2, 3], bulkload=True)
+
+    bulkresults = rr.loadresults()
+
+    times = [r.time for r in bulkresults['F'][races[0].id]]
+    assert times == sorted(times, reverse=True)
+
+
+def test_bulkload_renders_same_standings_as_per_race_queries(stdapp):
+    club, series, races = _mkstandings()
+
+    assert _render(club, series, races, bulkload=True) == _render(club, series, races)
+
+
+def test_bulkload_uses_single_raceresult_query(stdapp):
+    club, series, races = _mkstandings()
+    clubid, seriesid = club.id, series.id
+    db.session.expunge_all()
+    club = Club.query.filter_by(id=clubid).one()
+    series = Series.query.filter_by(id=seriesid).one()
+    races = Race.query.order_by(Race.date).all()
+
+    selects = _countqueries()
+    _render(club, series, races, bulkload=True)
+
+    assert len([s for s in selects if 'FROM raceresult' in s]) == 1
+
+
+# ---------------------------------------------------------------------------
+# standings cache
+# ---------------------------------------------------------------------------
+
+def test_getstandings_renders_same_rows_as_html_handler(stdapp):
+    club, series, races = _mkstandings()
+
+    standings = getstandings(club.id, 2020, series, races, [1, 2, 3])
+
+    assert standings == _render(club, series, races)
+
+
+def test_getstandings_stores_rows_by_gender_and_division(stdapp):
+    club, series, races = _mkstandings()
+
+    getstandings(club.id, '2020', series, races, [1, 2, 3])
+
+    cached = StandingsCache.query.filter_by(club_id=club.id, seriesid=series.id, year=2020, gender='F').order_by(
+        StandingsCache.position).all()
+    assert [c.division for c in cached] == ['Division', 'Overall', '29 and under', '30 to 39', '40 and up']
+
+
+def test_getstandings_serves_from_cache(stdapp):
+    club, series, races = _mkstandings()
+    expected = getstandings(club.id, 2020, series, races, [1, 2, 3])
+
+    selects = _countqueries()
+    standings = getstandings(club.id, 2020, series, races, [1, 2, 3])
+
+    assert standings == expected
+    assert not [s for s in selects if 'FROM raceresult' in s]
+
+
+def test_invalidatestandings_forces_rerender(stdapp):
+    club, series, races = _mkstandings()
+    getstandings(club.id, 2020, series, races, [1, 2, 3])
+
+    # drop Gus Gray's only win, which changes the men's standings
+    RaceResult.query.filter_by(raceid=races[2].id, overallplace=1).delete()
+    assert getstandings(club.id, 2020, series, races, [1, 2, 3]) != _render(club, series, races)
+
+    assert invalidatestandings(club.id, year=2020, seriesid=series.id) > 0
+    assert getstandings(club.id, 2020, series, races, [1, 2, 3]) == _render(club, series, races)
+
+
+def test_invalidatestandings_limited_to_year(stdapp):
+    club, series, races = _mkstandings()
+    getstandings(club.id, 2020, series, races, [1, 2, 3])
+
+    assert invalidatestandings(club.id, year=2019) == 0
+    assert StandingsCache.query.filter_by(club_id=club.id).count() > 0
+
+
+# ---------------------------------------------------------------------------
+# incremental standings
+# ---------------------------------------------------------------------------
+
+def _retabulate(race):
+    """swap the first two finishers of a race, as if the race results were corrected and tabulated again"""
+    first, second = RaceResult.query.filter_by(raceid=race.id, gender='F').order_by(RaceResult.genderplace).limit(2)
+    first.genderplace, second.genderplace = second.genderplace, first.genderplace
+    first.time, second.time = second.time, first.time
+    invalidaterace(race.club_id, race)
+
+
+def test_getstandings_stores_column_per_race_and_gender(stdapp):
+    club, series, races = _mkstandings()
+
+    getstandings(club.id, 2020, series, races, [1, 2, 3])
+
+    assert StandingsColumn.query.filter_by(club_id=club.id, seriesid=series.id).count() == 3 * 3
+
+
+def test_invalidaterace_keeps_other_race_columns(stdapp):
+    club, series, races = _mkstandings()
+    getstandings(club.id, 2020, series, races, [1, 2, 3])
+
+    _retabulate(races[1])
+
+    assert StandingsCache.query.filter_by(club_id=club.id).count() == 0
+    assert {c.raceid for c in StandingsColumn.query.filter_by(club_id=club.id).all()} == {races[0].id, races[2].id}
+
+
+def test_incremental_standings_same_as_full_rebuild(stdapp):
+    club, series, races = _mkstandings()
+    getstandings(club.id, 2020, series, races, [1, 2, 3])
+
+    _retabulate(races[1])
+    selects = _countqueries()
+    standings = getstandings(club.id, 2020, series, races, [1, 2, 3])
+    raceresultselects = [s for s in selects if 'FROM raceresult' in s]
+
+    assert standings == _render(club, series, races)
+    assert len(raceresultselects) == 1
+
+
+def test_loadresults_skips_collected_races(stdapp):
+    club, series, races = _mkstandings()
+    columns = {(gen, race.id): [] for gen in ['F', 'M', 'X'] for race in [races[0], races[2]]}
+    rr = StandingsRenderer(club.id, 2020, series, races, [1, 2, 3], bulkload=True, columns=columns)
+
+    bulkresults = rr.loadresults()
+
+    assert set(bulkresults['F']) == {races[1].id}
+
+
+def test_verify_replaces_stale_columns_with_full_rebuild(stdapp):
+    club, series, races = _mkstandings()
+    getstandings(club.id, 2020, series, races, [1, 2, 3])
+
+    # change results without invalidating the race's columns
+    _retabulate(races[1])
+    db.session.add(StandingsColumn(club_id=club.id, seriesid=series.id, raceid=races[1].id, year=2020, gender='F',
+                                   standings='[]'))
+
+    standings = getstandings(club.id, 2020, series, races, [1, 2, 3], verify=True)
+
+    assert standings == _render(club, series, races)
+
+
+# ---------------------------------------------------------------------------
+# sql engine
+# ---------------------------------------------------------------------------
+
+def _agstandings(**seriesattrs):
+    """create standings for age grade series, which have age grade places and no divisions
+
+    :rtype: club, series, races
+    """
+    club, series, races = _mkstandings(**seriesattrs)
+    for result in RaceResult.query.all():
+        result.agtimeplace = result.genderplace
+        result.agpercent = 100 - 3.5 * result.genderplace
+    for division in Divisions.query.all():
+        db.session.delete(division)
+    db.session.commit()
+    db.session.refresh(series)
+    return club, series, races
+
+
+@pytest.mark.parametrize('seriesattrs', [
+    {},
+    {'hightolow': True},
+    {'maxbynumrunners': True},
+    {'maxraces': None},
+    {'maxraces': 1},
+    {'maxgenpoints': 0},
+    {'maxgenpoints': 0, 'options': 'proportional_scoring'},
+])
+def test_sql_engine_renders_same_standings(stdapp, seriesattrs):
+    club, series, races = _mkstandings(**seriesattrs)
+
+    assert _render(club, series, races, renderer=SqlStandingsRenderer) == _render(club, series, races)
+
+
+@pytest.mark.parametrize('seriesattrs', [
+    {'orderby': 'agtime'},
+    {'orderby': 'agtime', 'maxbynumrunners': True},
+    {'orderby': 'agtime', 'maxgenpoints': 0},
+    # agpercent points include halves, which must be rounded as python does
+    {'orderby': 'agpercent', 'hightolow': True},
+])
+def test_sql_engine_renders_same_agegrade_standings(stdapp, seriesattrs):
+    club, series, races = _agstandings(**seriesattrs)
+
+    assert _render(club, series, races, renderer=SqlStandingsRenderer) == _render(club, series, races)
+
+
+def test_getstandings_engine_bypasses_cache(stdapp):
+    club, series, races = _mkstandings()
+
+    standings = getstandings(club.id, 2020, series, races, [1, 2, 3], engine='sql')
+
+    assert standings == _render(club, series, races)
+    assert StandingsCache.query.filter_by(club_id=club.id).count() == 0
+
+
+# ---------------------------------------------------------------------------
+# stored points
+# ---------------------------------------------------------------------------
+
+def test_scoreresults_by_place():
+    series = Series(orderby='time', multiplier=2, maxgenpoints=10, maxdivpoints=5, maxbynumrunners=False, options='')
+    series.divisions = [Divisions(divisionlow=1, divisionhigh=99)]
+    results = [RaceResult(1, 1, 1, 1, 100 + place, 'F', 30, divisionlow=1, divisionhigh=99, genderplace=place,
+                          divisionplace=place) for place in [1, 2, 7]]
+
+    assert scoreresults(series, results) == [(20, 10), (18, 8), (8, 0)]
+
+
+@pytest.mark.parametrize('maxgenpoints', [0, 10])
+def test_scoreresults_agtime_by_number_of_runners(maxgenpoints):
+    # agtime points always started from the number of runners in the race, regardless of maxgenpoints
+    series = Series(orderby='agtime', multiplier=2, maxgenpoints=maxgenpoints, maxdivpoints=5, maxbynumrunners=False,
+                    options='')
+    series.divisions = []
+    results = [RaceResult(1, 1, 1, 1, 100 + place, 'F', 30, agtimeplace=place) for place in [1, 2, 3]]
+
+    assert scoreresults(series, results) == [(6, None), (4, None), (2, None)]
+
+
+@pytest.mark.parametrize('maxgenpoints', [0, 10])
+def test_agtime_standings_by_number_of_runners(stdapp, maxgenpoints):
+    club, series, races = _agstandings(orderby='agtime', maxgenpoints=maxgenpoints)
+    numrunners = RaceResult.query.filter_by(raceid=races[0].id, gender='F').count()
+    first = RaceResult.query.filter_by(raceid=races[0].id, gender='F', agtimeplace=1).one()
+
+    for renderer in [StandingsRenderer, SqlStandingsRenderer]:
+        standings = _render(club, series, races, renderer=renderer)
+        leader = [pline for pline in standings['F'] if first.runner.name in pline.get('name', '')]
+        assert leader and '>{}<'.format(numrunners) in leader[0]['race1'], renderer
+
+
+def test_scoreseries_renders_same_standings(stdapp):
+    club, series, races = _mkstandings()
+    expected = _render(club, series, races)
+
+    scoreseries(club.id, series)
+
+    assert RaceResult.query.filter_by(genderpoints=None).count() == 0
+    assert _render(club, series, races) == expected
+
+
+def test_stored_points_are_used_for_standings(stdapp):
+    club, series, races = _mkstandings()
+    scoreseries(club.id, series)
+    for result in RaceResult.query.filter_by(raceid=races[0].id).all():
+        result.genderpoints = 100 + result.genderpoints
+
+    standings = _render(club, series, races)
+
+    assert standings == _render(club, series, races, renderer=SqlStandingsRenderer)
+    assert '>110<' in standings['F'][2]['race1']
+
+
+# ---------------------------------------------------------------------------
+# tie breaking
+# ---------------------------------------------------------------------------
+
+def _ties(tieoptions, runnerpoints, division=False, maxraces=None):
+    """iterate through tied runners with resultsiterator
+
+    :param runnerpoints: {runnerid: ({raceid: genpoints, ...}, {raceid: divpoints, ...}), ...}, runners in bypoints order
+    :rtype: [(runnerid, place, explanation), ...]
+    """
+    series = Series(tieoptions=tieoptions, maxraces=maxraces, minraces=None)
+    races = [Race(club_id=1, name='Race {}'.format(i), year=2020) for i in range(3)]
+    for raceid, race in enumerate(races):
+        race.id = raceid
+    byrunner = {}
+    runnerresults = {}
+    bypoints = []
+    for runnerid, (genpoints, divpoints) in runnerpoints.items():
+        runner = RunnerStanding(runnerid, 'r{}'.format(runnerid), 30, len(races), bydiv=True)
+        for raceid in genpoints:
+            runner.setpoints(raceid, genpoints[raceid], divpoints.get(raceid))
+        byrunner[runnerid, 'r{}'.format(runnerid), 30] = runner
+        runnerresults[runnerid] = {RaceStanding(races[raceid]) for raceid in genpoints}
+        bypoints.append(Points(totpoints=10, runnerid=runnerid, name='r{}'.format(runnerid), age=30,
+                               numraces=len(genpoints), tied=False))
+
+    theseresults = resultsiterator(series, bypoints, byrunner, runnerresults, races, division=division)
+    return [(p.runnerid, theseresults.calcrenderplace(p), getattr(p, 'explanation', None)) for p in theseresults]
+
+
+def test_tie_head_to_head_two_runners():
+    ties = _ties('head_to_head_points, average_points', {1: ({0: 4, 1: 6}, {}), 2: ({0: 5, 2: 5}, {})})
+
+    assert ties == [(2, 1, None), (1, 2, 'behind last due to point differential in head to head races')]
+
+
+def test_tie_head_to_head_falls_through_to_average():
+    ties = _ties('head_to_head_points, average_points', {1: ({0: 5, 1: 5}, {}), 2: ({0: 5, 1: 5, 2: 2}, {})})
+
+    assert ties == [(1, 1, None), (2, 2, 'behind last due to point average across races')]
+
+
+def test_tie_average_without_head_to_head():
+    ties = _ties('average_points', {1: ({0: 2, 1: 2, 2: 6}, {}), 2: ({0: 5, 1: 5}, {}), 3: ({0: 2, 1: 10}, {})},
+                 maxraces=2)
+
+    assert ties == [(3, 1, None), (2, 2, 'behind last due to point average across races'),
+                    (1, 3, 'behind last due to point average across races')]
+
+
+def test_tie_head_to_head_three_runners():
+    ties = _ties('head_to_head_points', {1: ({0: 3, 1: 3}, {}), 2: ({0: 4, 1: 4}, {}), 3: ({0: 5, 1: 5}, {})})
+
+    assert ties == [(3, 1, None), (2, 2, 'behind last due to point differential in head to head races'),
+                    (1, 3, 'behind last due to point differential in head to head races')]
+
+
+def test_tie_unbroken():
+    ties = _ties('head_to_head_points, average_points', {1: ({0: 5, 1: 5}, {}), 2: ({0: 5, 1: 5}, {})})
+
+    assert ties == [(1, 1, None), (2, 1, 'tied with last')]
+
+
+def test_tie_division_compares_overall():
+    ties = _ties('average_points, div_compare_overall', {1: ({0: 4, 1: 4}, {0: 5, 1: 5}), 2: ({0: 6, 1: 6}, {0: 5, 1: 5})},
+                 division=True)
+
+    assert ties == [(2, 1, None), (1, 2, 'behind last due to point average across races in overall competition')]
+
+
+# ---------------------------------------------------------------------------
+# year standings
+# ---------------------------------------------------------------------------
+
+def _addseries(club, series, races, name, **seriesattrs):
+    """add another series to the year with the same races and results as series
+
+    :rtype: Series
+    """
+    attrs = {c.name: getattr(series, c.name) for c in Series.__table__.columns if c.name != 'id'}
+    attrs.update(name=name, **seriesattrs)
+    newseries = Series(**attrs)
+    db.session.add(newseries)
+    db.session.flush()
+    for divlow, divhigh in DIVISIONS:
+        db.session.add(Divisions(club_id=club.id, year=2020, seriesid=newseries.id,
+                                 divisionlow=divlow, divisionhigh=divhigh, active=True))
+    for race in races:
+        db.session.add(RaceSeries(race.id, newseries.id))
+        for result in RaceResult.query.filter_by(raceid=race.id, seriesid=series.id).all():
+            db.session.add(RaceResult(club.id, result.runnerid, race.id, newseries.id, result.time, result.gender,
+                                      result.agage, divisionlow=result.divisionlow, divisionhigh=result.divisionhigh,
+                                      overallplace=result.overallplace, genderplace=result.genderplace,
+                                      divisionplace=result.divisionplace))
+    db.session.commit()
+    return newseries
+
+
+def _renderyear(club):
+    """render standings for all the club's series for the year
+
+    :rtype: {seriesname: {gen: [pline, ...], ...}, ...}
+    """
+    year = YearStandingsRenderer(club.id, 2020)
+    rendered = year.render(lambda series, racenums: HtmlStandingsHandler(racenums))
+    return {series.name: {gen: list(fh.iter(gen)) for gen in ['F', 'M', 'X']} for series, races, fh in rendered}
+
+
+def test_year_standings_same_as_each_series(stdapp):
+    club, series, races = _mkstandings()
+    trail = _addseries(club, series, races, 'Trail', maxraces=None, hightolow=True, tieoptions='')
+
+    standings = _renderyear(club)
+
+    assert list(standings) == ['Grand Prix', 'Trail']
+    assert standings['Grand Prix'] == _render(club, series, races)
+    assert standings['Trail'] == _render(club, trail, races)
+
+
+def test_year_standings_queries_shared_across_series(stdapp):
+    club, series, races = _mkstandings()
+    _addseries(club, series, races, 'Trail')
+    selects = _countqueries()
+    _renderyear(club)
+    twoseries = len(selects)
+
+    _addseries(club, series, races, 'Ultra', maxraces=1)
+    selects.clear()
+    _renderyear(club)
+
+    assert len(selects) == twoseries
+
+
+# ---------------------------------------------------------------------------
+# gender / division slicing
+# ---------------------------------------------------------------------------
+
+def test_gender_slice_collects_only_that_gender(stdapp):
+    club, series, races = _mkstandings()
+    racenums = list(range(1, len(races) + 1))
+    rr = StandingsRenderer(club.id, 2020, series, races, racenums, bulkload=True, genders=['F'])
+    fh = HtmlStandingsHandler(racenums)
+    rr.renderseries(fh)
+
+    assert {gen for gen, raceid in rr.columns} == {'F'}
+    assert list(fh.iter('F')) == _render(club, series, races)['F']
+
+
+@pytest.mark.parametrize('renderer', [StandingsRenderer, SqlStandingsRenderer])
+def test_division_slice_keeps_overall_award_winners(stdapp, renderer):
+    club, series, races = _mkstandings()
+    full = _render(club, series, races, renderer=renderer)['F']
+
+    sliced = _render(club, series, races, renderer=renderer, genders=['F'], division='40 and up')['F']
+
+    # column headings, division header, then the division's runners, which are in full standings
+    assert sliced[0] == full[0]
+    assert all(row in full for row in sliced)
+    assert len(sliced) < len(full)
+    assert any('>oa-1<' in row['place'] for row in sliced)
+
+
+def test_overall_slice(stdapp):
+    club, series, races = _mkstandings()
+    full = _render(club, series, races)['M']
+
+    sliced = _render(club, series, races, genders=['M'], division='Overall')['M']
+
+    assert sliced == full[:len(sliced)]
+    assert not any('Age Group' in row['name'] for row in sliced)
+
+
+def test_getstandings_slice_same_cached_or_rendered(stdapp, monkeypatch):
+    club, series, races = _mkstandings()
+    racenums = list(range(1, len(races) + 1))
+
+    rendered = getstandings(club.id, 2020, series, races, racenums, gender='F', division='30 to 39')
+    db.session.commit()
+    assert rendered['M'] == rendered['X'] == []
+
+    # the full standings were stored by the sliced request, so other slices aren't rendered again
+    assert {entry.gender for entry in StandingsCache.query.all()} == set(GENDERS)
+    assert StandingsColumn.query.count() == len(races) * len(GENDERS)
+    monkeypatch.setattr(standingscache, 'renderstandings', None)
+    cached = getstandings(club.id, 2020, series, races, racenums, gender='F', division='30 to 39')
+    full = getstandings(club.id, 2020, series, races, racenums)
+
+    assert cached == rendered
+    assert full['M']
+    assert all(row in full['F'] for row in rendered['F'])
+
+
+# ---------------------------------------------------------------------------
+# xlsx export
+# ---------------------------------------------------------------------------
+
+def _xlsx(fh):
+    """save XlsxStandingsHandler workbook and read it back
+
+    :rtype: {sheetname: [[(value, style), ...], ...], ...} with empty cells omitted
+    """
+    f = io.BytesIO()
+    fh.save(f)
+    wb = load_workbook(f)
+    return {ws.title: [[(c.value, c.style) for c in row if c.value is not None] for row in ws.iter_rows()]
+            for ws in wb.worksheets}
+
+
+def test_xlsx_rows_match_standings(stdapp):
+    club, series, races = _mkstandings()
+    racenums = list(range(1, len(races) + 1))
+    fh = XlsxStandingsHandler()
+    fh.setraces(races, racenums)
+    StandingsRenderer(club.id, 2020, series, races, racenums).renderseries(fh)
+
+    sheets = _xlsx(fh)
+
+    assert list(sheets) == ['Grand Prix Women', 'Grand Prix Men', 'Grand Prix Non-binary']
+    rows = sheets['Grand Prix Women']
+    assert rows[5] == [('Race 1: Race One: 03/01/2020', 'racename')]
+    overall = rows.index([('Place', 'racehdr'), ('Overall', 'divhdr'), ('Div Age', 'divhdr'), ('n', 'divhdr')])
+    # overall winner is highlighted, and the lowest of three races is dropped for maxraces=2
+    assert rows[overall+1] == [(1, 'place'), ('Alice Abel', 'name-noteligable'), (39, 'age'), (3, 'nraces'),
+                               (10, 'race'), (9, 'race-dropped'), (10, 'race'), (20, 'total')]
+    html = _render(club, series, races)
+    assert len([r for r in rows if r and r[0][1] == 'place']) == len([r for r in html['F'] if not r['header']])
+
+
+def test_xlsx_year_export_sheet_per_series_and_gender(stdapp):
+    club, series, races = _mkstandings()
+    _addseries(club, series, races, 'Trail', maxraces=None)
+    fh = XlsxStandingsHandler()
+    year = YearStandingsRenderer(club.id, 2020)
+    def handlerfactory(series, racenums):
+        fh.setraces(year.races[series.id], racenums)
+        return fh
+    for series, races, thisfh in year.render(handlerfactory):
+        assert thisfh is fh
+
+    sheets = _xlsx(fh)
+
+    assert list(sheets) == ['Grand Prix Women', 'Grand Prix Men', 'Grand Prix Non-binary',
+                            'Trail Women', 'Trail Men', 'Trail Non-binary']
+    # no races are dropped without maxraces
+    assert not [c for c in sum(sheets['Trail Women'], []) if c[1] == 'race-dropped']
+
+
+# ---------------------------------------------------------------------------
+# json standings
+# ---------------------------------------------------------------------------
+
+def test_json_rows_match_html_standings(stdapp):
+    club, series, races = _mkstandings()
+    racenums = list(range(1, len(races) + 1))
+    fh = JsonStandingsHandler()
+    StandingsRenderer(club.id, 2020, series, races, racenums).renderseries(fh)
+    html = _render(club, series, races)
+
+    rows = list(fh.iter('F'))
+
+    assert len(rows) == len([r for r in html['F'] if not r['header']])
+    assert rows[0] == {'gender': 'F', 'division': 'Overall', 'award': 'overall', 'place': 1, 'tiebreak': None,
+                       'name': 'Alice Abel', 'runnerid': rows[0]['runnerid'], 'age': 39, 'nraces': 3, 'total': 20,
+                       'races': [{'race': 1, 'points': 10, 'dropped': False}, {'race': 2, 'points': 9, 'dropped': True},
+                                 {'race': 3, 'points': 10, 'dropped': False}]}
+    assert [r['place'] for r in rows if r['division'] == '40 and up'] == ['oa-1']
+
+
+@pytest.fixture
+def jsonclient(stdapp):
+    """stdapp test client with the frontend views, for an anonymous user"""
+    from flask_login import LoginManager
+    from rrwebapp.views.frontend import bp
+    stdapp.register_blueprint(bp)
+    loginmanager = LoginManager(stdapp)
+    loginmanager.user_loader(lambda userid: None)
+    return stdapp.test_client()
+
+
+def test_json_standings_pagination_and_slice(stdapp, jsonclient):
+    club, series, races = _mkstandings()
+
+    allrows = jsonclient.get('/standings/json?club=c&year=2020&series=Grand Prix').json
+    page2 = jsonclient.get('/standings/json?club=c&year=2020&series=Grand Prix&page=2&per_page=3').json
+    women = jsonclient.get('/standings/json?club=c&year=2020&series=Grand Prix&gen=F&div=30 to 39').json
+
+    assert page2['total'] == allrows['total']
+    assert page2['standings'] == allrows['standings'][3:6]
+    assert [r['name'] for r in women['standings']] == ['Beth Baker', 'Dana Dunn', 'Cara Cole']
+    assert jsonclient.get('/standings/json?club=c&year=2020&series=Nope').status_code == 404
+
+
+def _viewstandings(stdapp, monkeypatch, admin=False):
+    """prepare to get viewstandings page, recording the engine getstandings() is called with
+
+    :param admin: True to view as club admin
+    :rtype: list, appended to for each getstandings() call
+    """
+    from types import SimpleNamespace
+    from rrwebapp.views.frontend import userviews
+    stdapp.config.update(SECRET_KEY='test', WTF_CSRF_ENABLED=False)
+    engines = []
+    def getstandings_(*args, **kwargs):
+        engines.append(kwargs['engine'])
+        return getstandings(*args, **kwargs)
+    monkeypatch.setattr(userviews, 'getstandings', getstandings_)
+    # the page layout isn't available to the tests
+    monkeypatch.setattr(userviews.flask, 'render_template', lambda *args, **kwargs: '')
+    if admin:
+        monkeypatch.setattr(userviews, 'current_user', SimpleNamespace(is_authenticated=True))
+        monkeypatch.setattr(userviews, 'UpdateClubDataPermission', lambda club_id: SimpleNamespace(can=lambda: True))
+    return engines
+
+
+def test_json_standings_when_coalesced_render_not_visible(stdapp, jsonclient, monkeypatch):
+    from rrwebapp import standingscache
+    club, series, races = _mkstandings()
+    url = '/standings/json?club=c&year=2020&series=Grand Prix'
+    expected = jsonclient.get(url).json['standings']
+    invalidatestandings(club.id)
+    db.session.commit()
+    # as when the render is coalesced with another request's, which hasn't committed the standings
+    monkeypatch.setattr(standingscache, 'getstandings', lambda *args, **kwargs: None)
+
+    first = jsonclient.get(url)
+    again = jsonclient.get(url, headers={'If-None-Match': first.headers['ETag']})
+
+    assert first.status_code == 200
+    assert first.json['standings'] == expected
+    assert again.status_code == 200
+
+
+def test_viewstandings_ignores_engine_for_anonymous_user(stdapp, jsonclient, monkeypatch):
+    club, series, races = _mkstandings()
+    engines = _viewstandings(stdapp, monkeypatch)
+
+    response = jsonclient.get('/viewstandings/?club=c&year=2020&series=Grand Prix&engine=sql')
+
+    assert response.status_code == 200
+    assert engines == [None]
+    assert StandingsCache.query.filter_by(club_id=club.id).count() > 0
+
+
+def test_json_standings_conditional_get(stdapp, jsonclient):
+    club, series, races = _mkstandings()
+    url = '/standings/json?club=c&year=2020&series=Grand Prix'
+    first = jsonclient.get(url)
+    etag = first.headers['ETag']
+
+    assert not etag.startswith('W/')
+    assert jsonclient.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert jsonclient.get(url, headers={'If-Modified-Since': first.headers['Last-Modified']}).status_code == 304
+    assert jsonclient.get(url + '&page=2', headers={'If-None-Match': etag}).status_code == 200
+
+    # standings are invalidated when results are tabulated
+    invalidatestandings(club.id)
+    db.session.commit()
+    again = jsonclient.get(url, headers={'If-None-Match': etag})
+    assert again.status_code == 200
+    assert again.headers['ETag'] != etag
+    assert again.json['standings'] == first.json['standings']
+
+
+# ---------------------------------------------------------------------------
+# series results cache and prewarming
+# ---------------------------------------------------------------------------
+
+def _seriesresultsstandings():
+    """_mkstandings(), with the age grade times which tabulation sets"""
+    club, series, races = _mkstandings()
+    for result in RaceResult.query.all():
+        result.agtime = result.time
+    db.session.commit()
+    return club, series, races
+
+
+def test_getseriesresults_rows_in_series_order(stdapp):
+    club, series, races = _seriesresultsstandings()
+
+    rows = getseriesresults(club.id, races[1])
+
+    assert [r[3] for r in rows] == ['Fred Ford', 'Beth Baker', 'Ed Evans', 'Alice Abel', 'Dana Dunn']
+    assert rows[0][0] == {'gender': 'M', 'agage': 32, 'divisionplace': 1, 'agpercent': None}
+    assert rows[0][1:3] == ['Grand Prix', 1]
+
+
+def test_getseriesresults_serves_from_cache(stdapp):
+    club, series, races = _seriesresultsstandings()
+    rows = getseriesresults(club.id, races[0])
+    db.session.commit()
+    RaceResult.query.filter_by(raceid=races[0].id).delete()
+
+    assert getseriesresults(club.id, races[0]) == rows
+
+    invalidaterace(club.id, races[0])
+    assert getseriesresults(club.id, races[0]) == []
+
+
+def test_invalidatestandings_removes_series_results(stdapp):
+    club, series, races = _seriesresultsstandings()
+    for race in races:
+        getseriesresults(club.id, race)
+
+    invalidatestandings(club.id, year=2020, seriesid=series.id)
+
+    assert SeriesResultsCache.query.count() == 0
+
+
+def test_prewarm_race_fills_caches(stdapp):
+    club, series, races = _seriesresultsstandings()
+    trail = _addseries(club, series, races, 'Trail')
+    for result in RaceResult.query.filter_by(seriesid=trail.id).all():
+        result.agtime = result.time
+
+    assert prewarm(club.id, race=races[0]) == 2
+
+    assert {c.seriesid for c in StandingsCache.query.all()} == {series.id, trail.id}
+    assert [c.raceid for c in SeriesResultsCache.query.all()] == [races[0].id]
+    expected = _render(club, series, races)
+    selects = _countqueries()
+    assert getstandings(club.id, 2020, series, races, [1, 2, 3]) == expected
+    assert len(selects) == 1
+
+
+def test_prewarm_year_fills_caches(stdapp):
+    club, series, races = _seriesresultsstandings()
+
+    assert prewarm(club.id, year=2020) == 1
+
+    assert StandingsCache.query.filter_by(seriesid=series.id).count() > 0
+    assert {c.raceid for c in SeriesResultsCache.query.all()} == {race.id for race in races}
+
+
+# ---------------------------------------------------------------------------
+# finalized season snapshots
+# ---------------------------------------------------------------------------
+
+def test_snapshot_standings_match_rendered(stdapp):
+    club, series, races = _seriesresultsstandings()
+    expected = _render(club, series, races)
+
+    assert finalizeseason(club.id, 2020) == 1
+    db.session.commit()
+    snapshot = getstandingssnapshot(club.id, series)
+
+    assert snapshot.standings() == expected
+    assert [(r.id, r.name) for r in snapshot.races] == [(r.id, r.name) for r in races]
+    assert snapshot.standings(gender='F', division='30 to 39') == getstandings(
+        club.id, 2020, series, races, [1, 2, 3], gender='F', division='30 to 39')
+    rows, archived_at = getseriesresultssnapshot(club.id, races[1])
+    assert rows == getseriesresults(club.id, races[1])
+
+
+def test_snapshot_served_after_results_change(stdapp, jsonclient):
+    club, series, races = _seriesresultsstandings()
+    url = '/standings/json?club=c&year=2020&series=Grand Prix'
+    live = jsonclient.get(url)
+    finalizeseason(club.id, 2020)
+    db.session.commit()
+
+    RaceResult.query.delete()
+    invalidatestandings(club.id)
+    db.session.commit()
+    archived = jsonclient.get(url)
+
+    assert archived.json['standings'] == live.json['standings']
+    assert 'immutable' not in archived.headers['Cache-Control']
+    assert archived.cache_control.max_age <= 60*60
+    assert jsonclient.get(url, headers={'If-None-Match': archived.headers['ETag']}).status_code == 304
+
+
+def test_snapshot_served_when_engine_requested(stdapp, jsonclient, monkeypatch):
+    club, series, races = _seriesresultsstandings()
+    finalizeseason(club.id, 2020)
+    db.session.commit()
+    engines = _viewstandings(stdapp, monkeypatch, admin=True)
+
+    response = jsonclient.get('/viewstandings/?club=c&year=2020&series=Grand Prix&engine=sql')
+
+    assert response.status_code == 200
+    assert engines == []
+    assert response.last_modified is not None
+
+
+def test_snapshot_page_revalidated(stdapp, jsonclient, monkeypatch):
+    club, series, races = _seriesresultsstandings()
+    finalizeseason(club.id, 2020)
+    db.session.commit()
+    _viewstandings(stdapp, monkeypatch)
+    url = '/viewstandings/?club=c&year=2020&series=Grand Prix'
+    archived = jsonclient.get(url)
+
+    assert archived.cache_control.public and 'immutable' not in archived.headers['Cache-Control']
+    assert jsonclient.get(url, headers={'If-None-Match': archived.headers['ETag']}).status_code == 304
+    assert jsonclient.get(url, headers={'If-Modified-Since': archived.headers['Last-Modified']}).status_code == 304
+
+    # reopened season is rendered live, and not cached
+    reopenseason(club.id, 2020)
+    db.session.commit()
+    live = jsonclient.get(url, headers={'If-Modified-Since': archived.headers['Last-Modified']})
+    assert live.status_code == 200
+    assert live.cache_control.max_age is None
+
+
+def _xlsxresponse(response):
+    """read back workbook sent by exportstandings
+
+    :rtype: {sheetname: [[(value, style), ...], ...], ...} as from _xlsx()
+    """
+    wb = load_workbook(io.BytesIO(response.data))
+    return {ws.title: [[(c.value, c.style) for c in row if c.value is not None] for row in ws.iter_rows()]
+            for ws in wb.worksheets}
+
+
+def test_snapshot_exported_after_results_change(stdapp, jsonclient):
+    club, series, races = _seriesresultsstandings()
+    # Trail isn't finalized, so it is rendered between the finalized series
+    _addseries(club, series, races, 'Trail', maxraces=None)
+    _addseries(club, series, races, 'Ultra')
+    for result in RaceResult.query.all():
+        result.agtime = result.time
+    db.session.commit()
+    seriesurl = '/exportstandings/?club=c&year=2020&series=Grand Prix'
+    yearurl = '/exportstandings/?club=c&year=2020'
+    live = _xlsxresponse(jsonclient.get(seriesurl))
+    liveyear = _xlsxresponse(jsonclient.get(yearurl))
+    trail = Series.query.filter_by(name='Trail').one()
+    trail.active = False
+    db.session.commit()
+    finalizeseason(club.id, 2020)
+    trail.active = True
+    db.session.commit()
+
+    RaceResult.query.filter(RaceResult.seriesid != trail.id).delete()
+    invalidatestandings(club.id)
+    db.session.commit()
+
+    assert _xlsxresponse(jsonclient.get(seriesurl)) == live
+    assert _xlsxresponse(jsonclient.get(yearurl)) == liveyear
+
+
+def test_untabulatedraces(stdapp):
+    club, series, races = _seriesresultsstandings()
+    RaceResult.query.filter_by(raceid=races[1].id).delete()
+    db.session.commit()
+
+    assert untabulatedraces(club.id, 2020) == [races[1]]
+
+
+def test_reopenseason_removes_snapshots(stdapp):
+    club, series, races = _seriesresultsstandings()
+    finalizeseason(club.id, 2020)
+    # finalizing again keeps the existing snapshots
+    assert finalizeseason(club.id, 2020) == 0
+
+    assert reopenseason(club.id, 2020) == 1
+    db.session.commit()
+
+    assert getstandingssnapshot(club.id, series) is None
+    assert getseriesresultssnapshot(club.id, races[0]) is None
+
+
+# ---------------------------------------------------------------------------
+# tabulation
+# ---------------------------------------------------------------------------
+
+def _agegradetable(club):
+    """give club an age grade table with flat factors for road 4K to 10K"""
+    table = AgeGradeTable(name='flat')
+    for gender in ['F', 'M']:
+        for dist_mm in [4_000_000, 10_000_000]:
+            category = AgeGradeCategory(gender=gender, surface='road', dist_mm=dist_mm, oc_secs=dist_mm / 5000)
+            category.factors = [AgeGradeFactor(age=age, factor=1.0) for age in range(5, 100)]
+            table.categories.append(category)
+    club.agegradetable = table
+    db.session.commit()
+
+
+def test_tabulate_replaces_series_results(stdapp):
+    club, series, races = _mkstandings()
+    _agegradetable(club)
+    before = {r.runnerid: (r.overallplace, r.genderplace) for r in RaceResult.query.filter_by(raceid=races[1].id)}
+    progress = []
+
+    total = TabulateResults(club.id, 2020, races[1], progress=lambda current, total: progress.append((current, total))).tabulate()
+    db.session.commit()
+
+    results = RaceResult.query.filter_by(raceid=races[1].id).all()
+    assert {r.runnerid: (r.overallplace, r.genderplace) for r in results} == before
+    assert all(r.genderpoints is not None and r.agtime for r in results)
+    alice = Runner.query.filter_by(name='Alice Abel').one()
+    assert [(r.divisionlow, r.divisionhigh, r.divisionplace) for r in results if r.runnerid == alice.id] == [(30, 39, 2)]
+    # one step per result plus one for placing the series
+    assert total == 6
+    assert progress[-1] == (6, 6)
+
+
+def test_placeresults_averages_ties():
+    results = [RaceResult(1, runnerid, 1, 1, time, 'F', 30) for runnerid, time in enumerate([100, 101, 101, 101, 102])]
+    tiekeys = {id(r): int(r.time) for r in results}
+
+    placeresults(results, 'genderplace', tiekeys)
+    assert [r.genderplace for r in results] == [1, 3.0, 3.0, 3.0, 5]
+
+    placeresults(results, 'genderplace')
+    assert [r.genderplace for r in results] == [1, 2, 3, 4, 5]
+
+
+def test_tabulate_averaged_ties_and_divisions(stdapp):
+    club, series, races = _mkstandings(averagetie=True)
+    _agegradetable(club)
+    # Alice Abel catches Beth Baker
+    result = ManagedResult.query.filter_by(raceid=races[1].id, name='Alice Abel').one()
+    result.time = 1250
+    db.session.commit()
+
+    TabulateResults(club.id, 2020, races[1]).tabulate()
+    db.session.commit()
+
+    runners = {runner.id: runner.name for runner in Runner.query.all()}
+    places = {runners[r.runnerid]: (r.genderplace, r.divisionlow, r.divisionplace)
+              for r in RaceResult.query.filter_by(raceid=races[1].id)}
+    assert places == {
+        'Fred Ford': (1, 30, 1),
+        'Ed Evans': (2, 40, 1),
+        'Beth Baker': (1.5, 30, 1.5),
+        'Alice Abel': (1.5, 30, 1.5),
+        # no date of birth, so no division
+        'Dana Dunn': (3, None, None),
+    }
+
+
+@pytest.mark.parametrize('orderby', ['agpercent', 'overallplace'])
+def test_tabulate_averaged_ties_any_orderby(stdapp, orderby):
+    club, series, races = _mkstandings(averagetie=True, orderby=orderby)
+    _agegradetable(club)
+
+    TabulateResults(club.id, 2020, races[1]).tabulate()
+    db.session.commit()
+
+    assert RaceResult.query.filter_by(raceid=races[1].id).count() == 5
+
+
+def test_tabulate_averaged_ties_unsupported_orderby(stdapp):
+    club, series, races = _mkstandings(averagetie=True, orderby='genderplace')
+    _agegradetable(club)
+
+    # rejected when scoring, rather than failing while looking for ties
+    with pytest.raises(parameterError):
+        TabulateResults(club.id, 2020, races[1]).tabulate()
+
+
+def test_tabulate_round_trips_independent_of_race_size(stdapp):
+    club, series, races = _mkstandings()
+    _agegradetable(club)
+    statements = _countqueries(kinds=('SELECT', 'INSERT', 'UPDATE', 'DELETE'))
+
+    counts = []
+    for race in races[0:2]:
+        # committing expires everything, so each tabulation loads what it needs
+        db.session.commit()
+        del statements[:]
+        TabulateResults(club.id, 2020, race).tabulate()
+        counts.append(len(statements))
+
+    # Race One has 6 finishers, Race Two has 5
+    assert counts[0] == counts[1]
+    assert len([s for s in statements if s.startswith('INSERT INTO raceresult')]) == 1
+
+
+def test_retabulationraces_only_tabulated_races(stdapp):
+    club, series, races = _mkstandings()
+    trail = _addseries(club, series, races[0:1], 'Trail')
+    # not run yet
+    race = Race(club_id=club.id, name='Race Four', year=2020, date='2020-06-01', distance=3.1, surface='road', active=True)
+    db.session.add(race)
+    db.session.flush()
+    db.session.add(RaceSeries(race.id, trail.id))
+    db.session.commit()
+
+    assert retabulationraces(club.id, 2020) == races
+    assert retabulationraces(club.id, '2020', seriesid=trail.id) == races[0:1]
+    assert retabulationraces(club.id, 2021) == []
+
+
+def test_tabulate_duplicate_runner_raises(stdapp):
+    club, series, races = _mkstandings()
+    _agegradetable(club)
+    result = ManagedResult.query.filter_by(raceid=races[1].id).first()
+    db.session.add(ManagedResult(club.id, races[1].id, place=6, name=result.name, gender=result.gender,
+                                 age=result.age, time=1400, runnerid=result.runnerid))
+    db.session.commit()
+
+    with pytest.raises(tabulationError, match='Duplicate entries'):
+        TabulateResults(club.id, 2020, races[1]).tabulate()
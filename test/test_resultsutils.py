@@ -1,14 +1,17 @@
 import datetime
 from unittest.mock import patch, MagicMock
 
+import pytest
+from sqlalchemy import event
+
 from rrwebapp.model import (
     db, Club, Runner, Race, ManagedResult, Exclusion,
-    ApiCredentials, RaceResultService, ClubAffiliation, Location,
+    ApiCredentials, RaceResultService, ClubAffiliation, Location, Series, RaceSeries, RaceResult,
 )
 from rrwebapp.resultsutils import (
-    race_fixeddist, get_distance, normname, filtermissed, get_earliestrace,
+    race_fixeddist, get_distance, normname, filtermissed, get_earliestrace, DivisionAgeLookup,
     ServiceAttributes, ClubAffiliationLookup, clubaffiliationelement, LocationServer,
-    ServiceResultFile,
+    ServiceResultFile, ImportResults, ImportLookup, matchError,
 )
 
 
@@ -102,8 +105,10 @@ def test_filtermissed_excludes_entries_in_exclusions_table(dbapp):
 
         missed = [{'name': 'Jane D', 'dbname': 'Jane Doe', 'dob': '1990-01-01'}]
         result = filtermissed(club.id, missed, '2020-01-01', 30)
+        lookupresult = filtermissed(club.id, missed, '2020-01-01', 30, lookup=ImportLookup(club.id))
 
     assert result == []
+    assert lookupresult == []
 
 
 def test_get_earliestrace_returns_earliest_within_year(dbapp):
@@ -139,6 +144,93 @@ def test_get_earliestrace_returns_none_when_no_results(dbapp):
         assert get_earliestrace(runner, year=2020) is None
 
 
+# ---------------------------------------------------------------------------
+# DivisionAgeLookup
+# ---------------------------------------------------------------------------
+
+def _mkdivagerunners(club):
+    """runners with known, estimated and missing dob, and results in 2019 and 2020"""
+    known = Runner(club.id, name='Known Dob', dateofbirth='1990-06-15')
+    estimated = Runner(club.id, name='Est Dob', dateofbirth='1980-04-01', estdateofbirth=True, member=False)
+    nodob = Runner(club.id, name='No Dob', member=False)
+    otheryear = Runner(club.id, name='Other Year', member=False)
+    db.session.add_all([known, estimated, nodob, otheryear])
+    db.session.commit()
+
+    early = Race(club_id=club.id, name='Spring 5k', year=2020, date='2020-03-01', fixeddist='3.1')
+    late = Race(club_id=club.id, name='Fall 5k', year=2020, date='2020-10-01', fixeddist='3.1')
+    lastyear = Race(club_id=club.id, name='Winter 5k', year=2019, date='2019-01-01', fixeddist='3.1')
+    db.session.add_all([early, late, lastyear])
+    db.session.commit()
+
+    for runner, race, resultage in [(known, early, 29), (known, late, 30),
+                                    (estimated, late, 40), (estimated, lastyear, 38),
+                                    (nodob, late, 45), (nodob, early, 44),
+                                    (otheryear, lastyear, 50)]:
+        db.session.add(ManagedResult(club.id, race.id, name=runner.name, age=resultage, runnerid=runner.id))
+    db.session.commit()
+    return known, estimated, nodob, otheryear
+
+
+def test_divisionagelookup_known_dob_uses_jan_1(dbapp):
+    with dbapp.app_context():
+        club = _mkclub()
+        known, estimated, nodob, otheryear = _mkdivagerunners(club)
+
+        divages = DivisionAgeLookup(club.id, 2020)
+
+        assert divages.divisionage(known.id) == 29
+        assert divages.standingsage(known.id) == 29
+
+
+def test_divisionagelookup_estimated_dob_uses_earliest_race_in_year(dbapp):
+    with dbapp.app_context():
+        club = _mkclub()
+        known, estimated, nodob, otheryear = _mkdivagerunners(club)
+
+        divages = DivisionAgeLookup(club.id, 2020)
+
+        # earliest 2020 race is 2020-10-01, dob 1980-04-01
+        assert divages.divisionage(estimated.id) == 40
+        assert divages.standingsage(estimated.id) == 40
+
+
+def test_divisionagelookup_no_dob_has_standings_age_but_no_division(dbapp):
+    with dbapp.app_context():
+        club = _mkclub()
+        known, estimated, nodob, otheryear = _mkdivagerunners(club)
+
+        divages = DivisionAgeLookup(club.id, 2020)
+
+        assert divages.divisionage(nodob.id) is None
+        # age from earliest 2020 race
+        assert divages.standingsage(nodob.id) == 44
+
+
+def test_divisionagelookup_none_without_results_in_year(dbapp):
+    with dbapp.app_context():
+        club = _mkclub()
+        known, estimated, nodob, otheryear = _mkdivagerunners(club)
+
+        divages = DivisionAgeLookup(club.id, 2020)
+
+        assert divages.divisionage(otheryear.id) is None
+        assert divages.standingsage(otheryear.id) is None
+        assert divages.standingsage(9999) is None
+
+
+def test_divisionagelookup_matches_get_earliestrace(dbapp):
+    with dbapp.app_context():
+        club = _mkclub()
+        known, estimated, nodob, otheryear = _mkdivagerunners(club)
+
+        divages = DivisionAgeLookup(club.id, 2020)
+
+        for runner in [estimated, nodob]:
+            earlyresult = get_earliestrace(runner, year=2020)
+            assert divages.standingsage(runner.id) == earlyresult.age
+
+
 # ---------------------------------------------------------------------------
 # ServiceAttributes
 # ---------------------------------------------------------------------------
@@ -257,6 +349,133 @@ def test_locationserver_getlocation_uses_cached_row_without_calling_geocode(dbap
     assert loc.latitude == 39.4
 
 
+# ---------------------------------------------------------------------------
+# ImportResults (dbapp)
+# ---------------------------------------------------------------------------
+
+IMPORTED = [
+    {'place': 1, 'name': 'Jane Doe', 'gender': 'F', 'age': 30, 'time': 1200.0, 'city': 'Frederick', 'state': 'MD'},
+    {'place': 2, 'name': 'John Smyth', 'gender': 'M', 'age': 40, 'time': 1300.0},
+    {'place': 3, 'name': 'John Smith', 'gender': 'M', 'age': 55, 'time': 1400.0},
+    {'place': 4, 'name': 'Someone Else', 'gender': 'M', 'age': 45, 'time': 1500.0, 'club': 'FSRC'},
+    {'place': 5, 'name': 'Mary Jones', 'gender': 'F', 'age': 50, 'time': 1600.0},
+]
+
+
+def _mkimportrace():
+    club = _mkclub()
+    series = Series(club_id=club.id, name='Grand Prix', year=2020, membersonly=False, active=True)
+    race = Race(club_id=club.id, name='Race One', year=2020, date='2020-06-01', distance=3.1, surface='road', active=True)
+    db.session.add_all([series, race])
+    db.session.flush()
+    db.session.add(RaceSeries(race.id, series.id))
+    db.session.add(Runner(club.id, 'Jane Doe', '1990-01-01', 'F', 'Frederick, MD'))
+    db.session.add(Runner(club.id, 'John Smith', '1980-01-01', 'M', 'Frederick, MD'))
+    db.session.commit()
+    return club, race
+
+
+def test_importresults_add_dbresult_inserts_in_batches(dbapp):
+    with dbapp.app_context():
+        club, race = _mkimportrace()
+
+        # results as they were added one at a time
+        importresults = ImportResults(club.id, race.id)
+        expected = []
+        for inresult in IMPORTED:
+            dbresult = ManagedResult(club.id, race.id)
+            importresults.update_dbresult(inresult, dbresult)
+            expected.append({column: getattr(dbresult, column) for column in importresults.columns})
+
+        importresults = ImportResults(club.id, race.id)
+        importresults.BATCHSIZE = 2
+        for inresult in IMPORTED:
+            importresults.add_dbresult(inresult)
+        # full batches were inserted as they were collected
+        assert ManagedResult.query.count() == 4
+
+        importresults.flush_dbresults()
+        db.session.commit()
+        rows = ManagedResult.query.order_by(ManagedResult.place).all()
+
+    assert [{column: getattr(row, column) for column in importresults.columns} for row in rows] == expected
+    assert [row.initialdisposition for row in rows] == ['definite', 'similar', 'missed', 'missed', 'missed']
+
+
+def test_importresults_dispositions_without_queries(dbapp):
+    with dbapp.app_context():
+        club, race = _mkimportrace()
+        series = Series.query.one()
+        bob = Runner(club.id, 'Bob Jones', None, 'M', 'Frederick, MD', member=False)
+        db.session.add(bob)
+        for name, date in [('Race Zero', '2019-06-01'), ('Race Minus', '2018-06-01')]:
+            pastrace = Race(club_id=club.id, name=name, year=int(date[0:4]), date=date, distance=3.1, surface='road', active=True)
+            db.session.add(pastrace)
+            db.session.flush()
+            db.session.add(RaceResult(club.id, bob.id, pastrace.id, series.id, 1500.0, 'M', 40 if name == 'Race Zero' else 39))
+        smith = Runner.query.filter_by(name='John Smith').one()
+        db.session.add(Exclusion(club_id=club.id, foundname='john smyth', runnerid=smith.id))
+        db.session.commit()
+
+        importresults = ImportResults(club.id, race.id)
+        assert importresults.lookup.earlyresult(bob.id) == ('2018-06-01', 39)
+
+        statements = []
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            for inresult in [
+                    {'place': 1, 'name': 'Bob Jones', 'gender': 'M', 'age': 42, 'time': 1500.0},
+                    {'place': 2, 'name': 'John Smyth', 'gender': 'M', 'age': 40, 'time': 1600.0},
+                    {'place': 3, 'name': 'Jane Doe', 'gender': 'F', 'age': 30, 'time': 1700.0},
+                    {'place': 4, 'name': 'Jane Do', 'gender': 'F', 'age': 45, 'time': 1800.0},
+                ]:
+                importresults.add_dbresult(inresult)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+        assert statements == []
+
+        importresults.flush_dbresults()
+        rows = ManagedResult.query.order_by(ManagedResult.place).all()
+
+    assert [(row.initialdisposition, row.runnerid) for row in rows] == [
+        ('definite', bob.id), ('missed', None), ('definite', rows[2].runnerid), ('missed', None)]
+
+
+def test_importresults_parallel_matches_sequential(dbapp):
+    with dbapp.app_context():
+        club, race = _mkimportrace()
+        inresults = [dict(inresult, place=place) for place, inresult in enumerate(IMPORTED * 10, 1)]
+
+        importresults = ImportResults(club.id, race.id)
+        expected = [importresults.match_dbresult(inresult) for inresult in inresults]
+
+        importresults = ImportResults(club.id, race.id)
+        importresults.CHUNKSIZE = 7
+        importresults.BATCHSIZE = 20
+        progress = []
+        importresults.add_dbresults_parallel(inresults, 2, progress=lambda current, total: progress.append((current, total)))
+        importresults.flush_dbresults()
+        db.session.commit()
+        rows = ManagedResult.query.order_by(ManagedResult.id).all()
+
+    assert [{column: getattr(row, column) for column in importresults.columns} for row in rows] == expected
+    assert progress[-1] == (50, 50)
+    assert [current for current, total in progress] == sorted(current for current, total in progress)
+
+
+def test_importresults_parallel_worker_error_raised(dbapp):
+    with dbapp.app_context():
+        club, race = _mkimportrace()
+        inresults = IMPORTED + [{'place': 6, 'name': 'No Time', 'gender': 'M', 'age': 30, 'time': None}]
+
+        importresults = ImportResults(club.id, race.id)
+        with pytest.raises(matchError, match='TypeError'):
+            importresults.add_dbresults_parallel(inresults, 2)
+
+
 # ---------------------------------------------------------------------------
 # ServiceResultFile (plain file I/O, no db needed)
 # ---------------------------------------------------------------------------
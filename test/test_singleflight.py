@@ -0,0 +1,97 @@
+import time
+from threading import Thread, Barrier
+
+import pytest
+
+from rrwebapp.singleflight import SingleFlight
+
+
+def _concurrent(flights, key, fn, numthreads=5):
+    """call flights[i % len(flights)].do(key, fn) from numthreads threads at once
+
+    :rtype: [result or exception, ...] in thread order
+    """
+    barrier = Barrier(numthreads)
+    results = [None] * numthreads
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = flights[i % len(flights)].do(key, fn)
+        except Exception as e:
+            results[i] = e
+    threads = [Thread(target=run, args=(i,)) for i in range(numthreads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _slowcount(calls, delay=0.2):
+    """function which counts its calls and takes a while to compute"""
+    def fn():
+        calls.append(1)
+        time.sleep(delay)
+        return {'rows': [len(calls)]}
+    return fn
+
+
+def test_concurrent_calls_share_result():
+    calls = []
+
+    results = _concurrent([SingleFlight()], 'key', _slowcount(calls))
+
+    assert len(calls) == 1
+    assert all(r == {'rows': [1]} for r in results)
+    # waiting threads get their own copy
+    assert len({id(r) for r in results}) == len(results)
+
+
+def test_different_keys_not_coalesced():
+    calls = []
+    flight = SingleFlight()
+    fn = _slowcount(calls, delay=0)
+
+    flight.do('a', fn)
+    flight.do('b', fn)
+    flight.do('a', fn)
+
+    assert len(calls) == 3
+
+
+def test_error_shared_with_waiting_threads():
+    def fn():
+        time.sleep(0.2)
+        raise ValueError('render failed')
+
+    results = _concurrent([SingleFlight()], 'key', fn)
+
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_waiting_times_out():
+    calls = []
+
+    results = _concurrent([SingleFlight(timeout=0.05)], 'key', _slowcount(calls), numthreads=2)
+
+    assert len(calls) == 2
+    assert all(r is not None for r in results)
+
+
+def test_lock_file_shares_result_across_instances(tmp_path):
+    # each instance stands in for a separate process
+    calls = []
+
+    results = _concurrent([SingleFlight(lockdir=str(tmp_path)) for i in range(3)], 'key', _slowcount(calls), numthreads=3)
+
+    assert len(calls) == 1
+    assert all(r == {'rows': [1]} for r in results)
+
+
+def test_lock_file_result_not_reused_later(tmp_path):
+    calls = []
+    flight = SingleFlight(lockdir=str(tmp_path))
+    fn = _slowcount(calls, delay=0)
+
+    assert flight.do('key', fn) == {'rows': [1]}
+    assert flight.do('key', fn) == {'rows': [2]}